@@ -22,6 +22,8 @@ class Battleship extends React.Component {
 
   constructor(props: Object, context: Object) {
     super(props, context);
+    this.wsRequestId = 0;
+    this.wsPending = {};
     this.setDefaultState();
   }
 
@@ -36,7 +38,8 @@ class Battleship extends React.Component {
       websocket: null,
       sessionId: null,
       game: null,
-      allGames: null
+      allGames: null,
+      matchmaking: false
     }
   }
 
@@ -190,44 +193,45 @@ class Battleship extends React.Component {
       evt.preventDefault();
       return false;
     }
-    $.ajax({
-      type: "PUT",
-      url: this.buildUrl([
-        "api",
-        "games",
-        this.state.game.id,
-        "players",
-        youPlayer.id,
-        "ships",
-        this.state.placeShip.ship.id,
-        [
+    this.sendWsCommand(
+      "place_ship",
+      {
+        game_id: this.state.game.id,
+        ship_id: this.state.placeShip.ship.id,
+        coords: [
           coords[0].toString(),
           coords[1].toString(),
           this.state.placeShip.orientation
         ].join("-")
-      ]),
-      dataType: "json",
-      contentType: "application/json",
-      beforeSend: (req) => {
-        req.setRequestHeader("X-Bs-Session-Id", this.state.sessionId);
-        return true;
       },
-      complete: (xhr, status) => {
-        const resp = xhr.responseJSON;
+      (resp) => {
         if (resp.code === "bad_ship_coords") {
           window.alert("You cannot put a ship in that location.");
         }
-        this.setState(
-          {
-            placeShip: null
-          },
-          () => {
-            this.loadDataGame();
-          }
-        );
+        this.setState({
+          placeShip: null
+        });
         return true;
+      }
+    );
+    evt.preventDefault();
+    return false;
+  }
+
+  handleClickAutoPlaceShips (evt) {
+    this.sendWsCommand(
+      "place_fleet",
+      {
+        game_id: this.state.game.id,
+        auto: true
       },
-    })
+      (resp) => {
+        this.setState({
+          placeShip: null
+        });
+        return true;
+      }
+    );
     evt.preventDefault();
     return false;
   }
@@ -239,31 +243,17 @@ class Battleship extends React.Component {
       evt.preventDefault();
       return false;
     }
-    $.ajax({
-      type: "PUT",
-      url: this.buildUrl([
-        "api",
-        "games",
-        this.state.game.id,
-        "players",
-        youPlayer.id,
-        "moves",
-        [
+    this.sendWsCommand(
+      "move",
+      {
+        game_id: this.state.game.id,
+        coords: [
           coords[0].toString(),
           coords[1].toString()
         ].join("-")
-      ]),
-      dataType: "json",
-      contentType: "application/json",
-      beforeSend: (req) => {
-        req.setRequestHeader("X-Bs-Session-Id", this.state.sessionId);
-        return true;
       },
-      success: (resp, status, xhr) => {
-        this.loadDataGame();
-        return true;
-      }
-    })
+      null
+    );
     evt.preventDefault();
     return false;
   }
@@ -509,6 +499,20 @@ class Battleship extends React.Component {
 
   renderGameBodyYourShips () {
     const availShips = this.getPlayerAvailShips();
+    const youPlayer = this.getYouPlayer();
+    const autoPlace = (() => {
+      if (youPlayer.all_ships_added) {
+        return [];
+      }
+      return (
+        <div>
+          Or,&nbsp;
+          <a href="#" onClick={this.handleClickAutoPlaceShips.bind(this)}>
+            place all remaining ships randomly
+          </a>
+        </div>
+      );
+    })();
     return (
       <div className="yourShips">
         <h3>Your Ships</h3>
@@ -519,6 +523,7 @@ class Battleship extends React.Component {
             where you want to place the ship.
           </li>
         </ol>
+        {autoPlace}
         <table className="ships">
           <thead>
             <tr>
@@ -625,10 +630,55 @@ class Battleship extends React.Component {
             CLICK HERE TO START NEW GAME
           </a>
         </div>
+        <div>
+          <a href="#" onClick={this.handleClickStartBotGame.bind(this)}>
+            CLICK HERE TO PLAY AGAINST THE COMPUTER
+          </a>
+        </div>
+        <div>
+          {this.state.matchmaking ?
+            <a href="#" onClick={this.handleClickCancelMatch.bind(this)}>
+              WAITING FOR AN OPPONENT... CLICK HERE TO CANCEL
+            </a> :
+            <a href="#" onClick={this.handleClickFindMatch.bind(this)}>
+              CLICK HERE TO FIND AN OPPONENT
+            </a>
+          }
+        </div>
       </div>
     );
   }
 
+  handleClickFindMatch (evt) {
+    this.sendWsCommand("matchmake", {}, (resp) => {
+      if (resp.code === "ok") {
+        this.setState({
+          matchmaking: true
+        });
+      }
+      return true;
+    });
+    evt.preventDefault();
+    return false;
+  }
+
+  handleClickCancelMatch (evt) {
+    this.sendWsCommand("unmatchmake", {}, null);
+    this.setState({
+      matchmaking: false
+    });
+    evt.preventDefault();
+    return false;
+  }
+
+  handleWsMatchFound (data) {
+    this.setState({
+      matchmaking: false
+    });
+    this.setGame(data.data);
+    return true;
+  }
+
   handleClickStartGame (evt) {
     $.ajax({
       type: "POST",
@@ -648,6 +698,38 @@ class Battleship extends React.Component {
     return false;
   }
 
+  handleClickStartBotGame (evt) {
+    $.ajax({
+      type: "POST",
+      url: this.buildUrl(["api", "games"]),
+      dataType: "json",
+      contentType: "application/json",
+      beforeSend: (req) => {
+        req.setRequestHeader("X-Bs-Session-Id", this.state.sessionId);
+        return true;
+      },
+      success: (resp, status, xhr) => {
+        $.ajax({
+          type: "POST",
+          url: this.buildUrl(["api", "games", resp.data.id, "bots"]),
+          dataType: "json",
+          contentType: "application/json",
+          beforeSend: (req) => {
+            req.setRequestHeader("X-Bs-Session-Id", this.state.sessionId);
+            return true;
+          },
+          success: (resp, status, xhr) => {
+            this.setGame(resp.data);
+            return true;
+          }
+        });
+        return true;
+      }
+    })
+    evt.preventDefault();
+    return false;
+  }
+
   buildUrl (parts) {
     const path: string = ["", ...parts].join("/");
     return path;
@@ -710,8 +792,10 @@ class Battleship extends React.Component {
         return true;
       },
       success: (resp) => {
+        // Large board variants only export sparse cells, which this
+        // client does not render
         this.setState({
-          allGames: resp.data
+          allGames: resp.data.filter((game) => game.size <= 32)
         });
         return true;
       }
@@ -760,21 +844,135 @@ class Battleship extends React.Component {
     return true;
   }
 
-  handleWsRefreshGame () {
+  handleWsRefreshGame (data) {
     if (this.state.game === null) {
       return false
     }
+    if (data.game_id !== this.state.game.id) {
+      return false;
+    }
     this.loadDataGame();
     return true;
   }
 
+  handleWsGameDelta (data) {
+    if (this.state.game === null) {
+      return false;
+    }
+    if (data.game_id !== this.state.game.id) {
+      return false;
+    }
+    if (data.version <= this.state.game.version) {
+      return false;
+    }
+    if (data.version !== (this.state.game.version + 1)) {
+      this.loadDataGame();
+      return true;
+    }
+    const game = JSON.parse(JSON.stringify(this.state.game));
+    data.changes.forEach(this.applyGameChange.bind(this, game));
+    game.version = data.version;
+    this.setGame(game);
+    return true;
+  }
+
+  upsertPlayerShip (player, ship) {
+    const others = player.ships.filter((s) => s.id !== ship.id);
+    player.ships = [...others, ship];
+    return true;
+  }
+
+  applyGameChange (game, change) {
+    const player = game.players[change.player_id];
+    if (player === undefined) {
+      return false;
+    }
+    if (change.type === "ship_added") {
+      player.all_ships_added = change.all_ships_added;
+      if (change.ship !== undefined) {
+        this.upsertPlayerShip(player, change.ship);
+        change.cells.forEach(([x, y]) => {
+          player.grid[y][x] = change.ship.intcode;
+        });
+      }
+      return true;
+    }
+    if (change.type === "cell") {
+      player.grid_attempts[change.y][change.x] = change.value;
+      player.moves_count += 1;
+      if (change.ship !== null) {
+        this.upsertPlayerShip(player, change.ship);
+      }
+      return true;
+    }
+    if (change.type === "ship_sunk") {
+      this.upsertPlayerShip(player, change.ship);
+      return true;
+    }
+    if (change.type === "sunk_all") {
+      player.sunk_all = true;
+      return true;
+    }
+    if (change.type === "turn") {
+      game.player_id_turn = change.player_id;
+      Object.keys(game.players).forEach((playerId) => {
+        game.players[playerId].is_turn = (playerId === change.player_id);
+      });
+      return true;
+    }
+    if (change.type === "winner") {
+      game.player_id_winner = change.player_id;
+      game.game_status = false;
+      return true;
+    }
+    return false;
+  }
+
+  sendWsCommand (command, params, callback) {
+    this.wsRequestId += 1;
+    const requestId = this.wsRequestId;
+    if (callback !== null) {
+      this.wsPending[requestId] = callback;
+    }
+    this.state.websocket.send(JSON.stringify(Object.assign(
+      {
+        id: requestId,
+        command: command
+      },
+      params
+    )));
+    return requestId;
+  }
+
+  handleWsReply (data) {
+    const callback = this.wsPending[data.id];
+    if (callback === undefined) {
+      return false;
+    }
+    delete this.wsPending[data.id];
+    callback(data);
+    return true;
+  }
+
   handleWsMessage (data) {
+    if (data.action === "reply") {
+      this.handleWsReply(data);
+      return true;
+    }
     if (data.action === "refresh_games") {
       this.handleWsRefreshGames();
       return true;
     }
     if (data.action === "refresh_game") {
-      this.handleWsRefreshGame();
+      this.handleWsRefreshGame(data);
+      return true;
+    }
+    if (data.action === "game_delta") {
+      this.handleWsGameDelta(data);
+      return true;
+    }
+    if (data.action === "match_found") {
+      this.handleWsMatchFound(data);
       return true;
     }
     return true;
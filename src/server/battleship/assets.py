@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+
+"""
+BattleShip Static Assets
+
+Loads the client files into memory once, with gzip and, when the
+brotli module is installed, brotli variants, so serving them is a
+dict lookup and a write instead of file reads and compression on the
+IOLoop.
+
+Every asset is also registered under a versioned name, with a hash
+of its content before the extension, like
+`build/battleship-build.<hash>.js`.  HTML references to other assets
+are rewritten to their versioned names, which never change content,
+and can be cached forever.
+
+Variants built ahead, as `<file>.gz` or `<file>.br` next to the file
+and newer than it, are used instead of compressing at load.
+
+"""
+
+import io
+import os
+import re
+import gzip
+import hashlib
+import mimetypes
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ENCODING_IDENTITY = "identity"
+ENCODING_GZIP = "gzip"
+ENCODING_BROTLI = "br"
+## Preferred first
+ENCODINGS = (ENCODING_BROTLI, ENCODING_GZIP, ENCODING_IDENTITY)
+ENCODING_SUFFIXES = {
+    ENCODING_GZIP: ".gz",
+    ENCODING_BROTLI: ".br"
+}
+COMPRESS_MIN_SIZE = 256
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/javascript",
+    "application/json",
+    "application/xml",
+    "image/svg+xml"
+)
+CACHE_IMMUTABLE = "public, max-age=31536000, immutable"
+CACHE_REVALIDATE = "no-cache"
+HTML_REF_RE = re.compile(r"((?:src|href)=\")/([^\"?#]+)(\")")
+
+
+def gzip_compress(body):
+    """
+    With a fixed mtime, so the output only depends on `body`
+    """
+    buf = io.BytesIO()
+    with gzip.GzipFile(
+        fileobj=buf,
+        mode="wb",
+        compresslevel=9,
+        mtime=0
+    ) as fh:
+        fh.write(body)
+    return buf.getvalue()
+
+
+def brotli_compress(body):
+    return brotli.compress(body, quality=11)
+
+
+COMPRESSORS = {
+    ENCODING_GZIP: gzip_compress,
+    ENCODING_BROTLI: brotli_compress
+}
+
+
+def get_available_encodings():
+    if brotli is None:
+        return (ENCODING_GZIP, ENCODING_IDENTITY)
+    return ENCODINGS
+
+
+def parse_accept_encoding(header):
+    """
+    Returns the {coding: qvalue} of an Accept-Encoding header
+    """
+    accepted = {}
+    for part in (header or "").split(","):
+        fields = part.strip().split(";")
+        coding = fields[0].strip().lower()
+        if coding == "":
+            continue
+        qvalue = 1.0
+        for param in fields[1:]:
+            name, _, val = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    qvalue = float(val)
+                except ValueError:
+                    qvalue = 0.0
+        accepted[coding] = qvalue
+    return accepted
+
+
+def choose_encoding(header, available):
+    """
+    Picks the first of `available`, in ENCODINGS order, that the
+    Accept-Encoding `header` allows.  Falls back to identity, which
+    is always available, rather than refusing the request.
+    """
+    accepted = parse_accept_encoding(header)
+    default = accepted.get("*", 0)
+    for encoding in ENCODINGS:
+        if encoding not in available:
+            continue
+        if accepted.get(encoding, default) > 0:
+            return encoding
+    return ENCODING_IDENTITY
+
+
+def get_versioned_path(path, digest):
+    stem, ext = os.path.splitext(path)
+    return "%s.%s%s" % (stem, digest, ext)
+
+
+class AssetModel(object):
+
+    path = None
+    content_type = None
+    digest = None
+    variants = None
+    etags = None
+
+    def __init__(self, path, content_type, body):
+        self.path = path
+        self.content_type = content_type
+        self.digest = hashlib.sha256(body).hexdigest()[:16]
+        self.variants = {ENCODING_IDENTITY: body}
+        self.etags = {}
+        return None
+
+    def is_compressible(self):
+        return (
+            len(self.variants[ENCODING_IDENTITY]) >= COMPRESS_MIN_SIZE and
+            self.content_type.startswith(COMPRESSIBLE_TYPES)
+        )
+
+    def add_variants(self, file_path=None):
+        """
+        Compresses the body with every available encoding, or reads
+        the ones built ahead next to `file_path`.  Variants that are
+        not smaller are left out.
+        """
+        body = self.variants[ENCODING_IDENTITY]
+        if self.is_compressible():
+            for encoding in get_available_encodings():
+                if encoding == ENCODING_IDENTITY:
+                    continue
+                variant = None
+                if file_path is not None:
+                    variant = read_prebuilt(file_path, encoding)
+                if variant is None:
+                    variant = COMPRESSORS[encoding](body)
+                if len(variant) < len(body):
+                    self.variants[encoding] = variant
+        ## Strong ETags must differ between encodings of the same body
+        self.etags = dict(
+            map(
+                lambda e: (e, "\"%s-%s\"" % (self.digest, e)),
+                self.variants.keys()
+            )
+        )
+        return True
+
+    def export_stats(self):
+        return dict(
+            map(lambda v: (v[0], len(v[1])), self.variants.items())
+        )
+
+
+def read_prebuilt(file_path, encoding):
+    prebuilt_path = file_path + ENCODING_SUFFIXES[encoding]
+    try:
+        if os.path.getmtime(prebuilt_path) < os.path.getmtime(file_path):
+            return None
+        with open(prebuilt_path, "rb") as fh:
+            return fh.read()
+    except OSError:
+        return None
+
+
+class AssetStore(object):
+    """
+    Assets by request path, relative to the root, both under their
+    own and their versioned names
+    """
+
+    root = None
+    assets = None
+    versioned = None
+
+    def __init__(self, root):
+        self.root = root
+        self.assets = {}
+        self.versioned = {}
+        return None
+
+    def get(self, path):
+        """
+        Returns `(asset, is_versioned)`, or `(None, False)`
+        """
+        if path in self.versioned:
+            return (self.versioned[path], True)
+        return (self.assets.get(path), False)
+
+    def add(self, path, body, file_path=None):
+        content_type = mimetypes.guess_type(path)[0]
+        if content_type is None:
+            content_type = "application/octet-stream"
+        if content_type.startswith("text/"):
+            content_type += "; charset=utf-8"
+        if content_type.startswith("text/html"):
+            body = self.rewrite_html(body)
+            file_path = None
+        asset = AssetModel(path, content_type, body)
+        asset.add_variants(file_path)
+        self.assets[path] = asset
+        self.versioned[get_versioned_path(path, asset.digest)] = asset
+        return asset
+
+    def rewrite_html(self, body):
+        def replace(match):
+            asset = self.assets.get(match.group(2))
+            if asset is None:
+                return match.group(0)
+            return "%s/%s%s" % (
+                match.group(1),
+                get_versioned_path(asset.path, asset.digest),
+                match.group(3)
+            )
+        return HTML_REF_RE.sub(replace, body.decode("utf-8")).encode("utf-8")
+
+    def export_stats(self):
+        return dict(
+            map(
+                lambda a: (a.path, a.export_stats()),
+                self.assets.values()
+            )
+        )
+
+    @classmethod
+    def iter_files(cls, root):
+        suffixes = tuple(ENCODING_SUFFIXES.values())
+        for dir_path, dir_names, file_names in os.walk(root):
+            dir_names[:] = sorted(
+                filter(lambda d: not d.startswith("."), dir_names)
+            )
+            for file_name in sorted(file_names):
+                if file_name.startswith(".") or file_name.endswith(suffixes):
+                    continue
+                file_path = os.path.join(dir_path, file_name)
+                yield (
+                    os.path.relpath(file_path, root).replace(os.sep, "/"),
+                    file_path
+                )
+
+    @classmethod
+    def load(cls, root):
+        """
+        Loads every file under `root`.  HTML goes last, so the assets
+        it references already have their versioned names.
+        """
+        store = AssetStore(root)
+        files = sorted(
+            cls.iter_files(root),
+            key=lambda f: f[0].endswith((".html", ".htm"))
+        )
+        for path, file_path in files:
+            with open(file_path, "rb") as fh:
+                store.add(path, fh.read(), file_path)
+        return store
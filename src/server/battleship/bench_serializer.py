@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+"""
+BattleShip JSON Serialization Benchmark
+
+Compares the available serializer backends on real
+`GameModel.export` payloads.
+
+Usage: bench_serializer.py [NUM_GAMES] [NUM_ROUNDS]
+
+"""
+
+import sys
+import time
+import random
+
+import serializer
+import runserver
+
+
+def make_games(num_games):
+    games = []
+    num_cells = runserver.GRID_SIZE ** 2
+    for _ in range(num_games):
+        game = runserver.GameModel.create_game_from_id()
+        sessions = list(
+            map(lambda _: runserver.SessionModel.make_session(), range(2))
+        )
+        players = list(map(game.add_player, sessions))
+        for player in players:
+            for y, ship_id in enumerate(runserver.SHIPS.keys()):
+                player.add_ship(ship_id, (0, (y * 2)), "x")
+        cells = dict(
+            map(
+                lambda p: (p.id, random.sample(range(num_cells), 60)),
+                players
+            )
+        )
+        for _ in range(random.randint(0, 100)):
+            if game.game_status is False:
+                break
+            idx = cells[game.player_turn.id].pop()
+            coords = (idx % runserver.GRID_SIZE, idx // runserver.GRID_SIZE)
+            game.make_move(game.player_turn, coords)
+        games.append((game, players[0].id))
+    return games
+
+
+def main():
+    num_games = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    num_rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    games = make_games(num_games)
+    payloads = list(map(lambda g: g[0].export(g[1]), games))
+    print("GAMES: %d, ROUNDS: %d" % (num_games, num_rounds))
+    for backend in serializer.get_available_backends():
+        serializer.set_backend(backend)
+        start = time.perf_counter()
+        for _ in range(num_rounds):
+            for payload in payloads:
+                serializer.dumps(payload)
+        elapsed = time.perf_counter() - start
+        count = num_games * num_rounds
+        print(
+            "%-8s %10.2f us/export %12.0f exports/s" %
+            (backend, ((elapsed / count) * 1e6), (count / elapsed))
+        )
+    return True
+
+
+if __name__ == "__main__":
+    main()
+    sys.exit(0)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+"""
+BattleShip Bot Targeting
+
+Hunt/target probability density strategy.  For every remaining ship
+length, counts all placements still legal given the attempted cells
+and sunk ships, and fires at the unattempted cell covered by the most
+placements.  Placements over unresolved hits are weighted up, which
+turns hunting into targeting once a ship is found.
+
+All counting is done with NumPy sliding-window sums over the whole
+board, with no per-cell Python loops.
+
+"""
+
+import numpy as np
+
+HIT_WEIGHT = 50
+
+
+def mask_to_grid(mask, size):
+    """
+    Converts a bitboard int, with cell (x, y) at bit `(y * size) + x`,
+    into a (size, size) bool array
+    """
+    num_cells = size * size
+    raw = np.frombuffer(
+        mask.to_bytes(((num_cells + 7) // 8), "little"),
+        dtype=np.uint8
+    )
+    bits = np.unpackbits(raw).reshape(-1, 8)[:, ::-1].reshape(-1)
+    return bits[:num_cells].reshape(size, size).astype(bool)
+
+
+def cells_to_grid(cells, size):
+    """
+    Converts an iterable of cell indexes `(y * size) + x` into a
+    (size, size) bool array
+    """
+    grid = np.zeros((size * size), dtype=bool)
+    grid[np.fromiter(cells, dtype=np.intp)] = True
+    return grid.reshape(size, size)
+
+
+def get_axis_slice(arr, axis, start, stop):
+    index = [slice(None)] * arr.ndim
+    index[axis] = slice(start, stop)
+    return arr[tuple(index)]
+
+
+def get_window_sums(grid, length, span, axis=-1):
+    """
+    Sums of `grid` over every window of `length` cells along `axis`,
+    that starts where it fits within `span` cells.  Other axes, like
+    a batch of boards, are kept as is.
+
+    Adds `length` shifted views, which is faster than a cumulative
+    sum along short rows.
+    """
+    num_starts = span - length + 1
+    sums = get_axis_slice(grid, axis, 0, num_starts).astype(np.int32)
+    for offset in range(1, length):
+        sums += get_axis_slice(grid, axis, offset, (offset + num_starts))
+    return sums
+
+
+def spread_windows(weights, length, size, axis=-1):
+    """
+    Adds each window weight onto every cell the window covers
+    """
+    num_starts = weights.shape[axis]
+    shape = list(weights.shape)
+    shape[axis] = size
+    out = np.zeros(shape, dtype=weights.dtype)
+    for offset in range(length):
+        get_axis_slice(out, axis, offset, (offset + num_starts))[...] += (
+            weights
+        )
+    return out
+
+
+def get_density_axis(blocked, hits, length, span, axis):
+    size = blocked.shape[axis]
+    if length > span:
+        return np.zeros(blocked.shape, dtype=np.int32)
+    legal = get_window_sums(blocked, length, span, axis) == 0
+    covered_hits = get_window_sums(hits, length, span, axis)
+    weights = legal * (1 + (HIT_WEIGHT * covered_hits))
+    return spread_windows(weights, length, size, axis)
+
+
+def get_length_density(blocked, hits, length, span=None):
+    """
+    Placements of one ship of `length` covering each cell, both
+    across and down.  `span` limits how far along an axis ships may
+    extend, to match the server rule that ships end before the last
+    row and column.
+    """
+    if span is None:
+        span = blocked.shape[-1] - 1
+    return (
+        get_density_axis(blocked, hits, length, span, -1) +
+        get_density_axis(blocked, hits, length, span, -2)
+    )
+
+
+def get_density(blocked, hits, lengths, span=None):
+    density = np.zeros(blocked.shape, dtype=np.float64)
+    for length in lengths:
+        density += get_length_density(blocked, hits, length, span)
+    return density
+
+
+def choose_target(hits, misses, sunk, lengths, rng=None):
+    """
+    `hits`, `misses` and `sunk` are (size, size) bool grids of the
+    attempted cells and of the cells of sunk ships, and `lengths` the
+    lengths of the ships not sunk yet.  Returns the (x, y) cell to
+    fire at.
+    """
+    if rng is None:
+        rng = np.random
+    attempted = hits | misses
+    density = get_density(
+        (misses | sunk).astype(np.int32),
+        (hits & ~sunk).astype(np.int32),
+        lengths
+    )
+    density[attempted] = -1
+    ## Random tie breaking between equally likely cells
+    density += rng.random_sample(density.shape) * 0.5
+    if density.max() < 0:
+        return None
+    y, x = np.unravel_index(int(np.argmax(density)), density.shape)
+    return (int(x), int(y))
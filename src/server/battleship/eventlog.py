@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+
+"""
+BattleShip Event Log
+
+Append-only, segmented event log with snapshots, used to recover
+games after a restart.
+
+Log segments are `events-<n>.log`, and hold records of:
+
+    <crc32:u32> <length:u32> <marshal payload>
+
+Snapshots are `snapshot-<n>.snap`, and hold the state as of the
+start of log segment `n`.  They use the same record framing, after
+a magic header, and are read through mmap.  Recovery loads the
+latest snapshot, then replays segments `n` and up.
+
+"""
+
+import os
+import re
+import mmap
+import uuid
+import zlib
+import struct
+import marshal
+
+RECORD_HEADER = struct.Struct("<II")
+SNAPSHOT_MAGIC = b"BSSNAP01"
+MARSHAL_VERSION = 4
+SEGMENT_RE = re.compile(r"^events-([0-9]+)\.log$")
+SNAPSHOT_RE = re.compile(r"^snapshot-([0-9]+)\.snap$")
+SNAPSHOT_TMP_RE = re.compile(r"^snapshot-([0-9]+)\.snap\.tmp$")
+
+
+def pack_id(obj_id):
+    """
+    Ids are stored as 16 raw bytes when they round trip as UUIDs
+    """
+    try:
+        packed = uuid.UUID(obj_id)
+    except ValueError:
+        return obj_id
+    if str(packed) != obj_id:
+        return obj_id
+    return packed.bytes
+
+
+def unpack_id(packed):
+    if isinstance(packed, bytes):
+        return str(uuid.UUID(bytes=packed))
+    return packed
+
+
+def pack_record(obj):
+    payload = marshal.dumps(obj, MARSHAL_VERSION)
+    return RECORD_HEADER.pack(zlib.crc32(payload), len(payload)) + payload
+
+
+def iter_records(buf, offset=0):
+    """
+    Yields records from `buf`, stopping at the first torn or
+    corrupt record
+    """
+    end = len(buf)
+    while (offset + RECORD_HEADER.size) <= end:
+        crc, length = RECORD_HEADER.unpack_from(buf, offset)
+        start = offset + RECORD_HEADER.size
+        if (start + length) > end:
+            break
+        payload = buf[start:(start + length)]
+        if zlib.crc32(payload) != crc:
+            break
+        yield marshal.loads(payload)
+        offset = start + length
+    return None
+
+
+def list_numbered(data_dir, regex):
+    out = []
+    for name in os.listdir(data_dir):
+        match = regex.match(name)
+        if match is not None:
+            out.append((int(match.group(1)), os.path.join(data_dir, name)))
+    return sorted(out)
+
+
+def fsync_dir(data_dir):
+    fd = os.open(data_dir, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    return True
+
+
+def fsync_fd(fd):
+    """
+    Syncs and closes `fd`, a duplicate from `EventLog.write`, so it
+    can run on another thread while the log moves on
+    """
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    return True
+
+
+class EventLog(object):
+
+    data_dir = None
+    segment = None
+    fh = None
+    buffer = None
+    appended = None
+    flushes = None
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.segment = None
+        self.fh = None
+        self.buffer = []
+        self.appended = 0
+        self.flushes = 0
+        return None
+
+    def get_segment_path(self, segment):
+        return os.path.join(self.data_dir, "events-%d.log" % segment)
+
+    def get_snapshot_path(self, segment):
+        return os.path.join(self.data_dir, "snapshot-%d.snap" % segment)
+
+    def open(self):
+        """
+        Continues in a fresh segment after the latest one on disk.
+        Snapshots left half written by a crashed child are removed.
+        """
+        os.makedirs(self.data_dir, exist_ok=True)
+        for num, path in list_numbered(self.data_dir, SNAPSHOT_TMP_RE):
+            os.remove(path)
+        segments = list_numbered(self.data_dir, SEGMENT_RE)
+        snapshots = list_numbered(self.data_dir, SNAPSHOT_RE)
+        last = max(
+            [0] +
+            list(map(lambda s: s[0], segments)) +
+            list(map(lambda s: s[0], snapshots))
+        )
+        return self.open_segment(last + 1)
+
+    def open_segment(self, segment):
+        if self.fh is not None:
+            self.flush()
+            self.fh.close()
+        self.segment = segment
+        self.fh = open(self.get_segment_path(segment), "ab")
+        fsync_dir(self.data_dir)
+        return True
+
+    def append(self, event):
+        self.buffer.append(pack_record(event))
+        self.appended += 1
+        return True
+
+    def flush(self):
+        """
+        Writes all buffered records with a single fsync
+        """
+        fd = self.write()
+        if fd is None:
+            return False
+        return fsync_fd(fd)
+
+    def write(self):
+        """
+        Writes all buffered records without syncing them.  Returns a
+        duplicate of the file descriptor, for `fsync_fd`, or None
+        when there was nothing to write.
+        """
+        if len(self.buffer) == 0 or self.fh is None:
+            return None
+        self.fh.write(b"".join(self.buffer))
+        self.buffer = []
+        self.fh.flush()
+        self.flushes += 1
+        return os.dup(self.fh.fileno())
+
+    def rotate(self):
+        """
+        Starts a new segment, and returns its number, which is
+        what a snapshot of the current state must be named by
+        """
+        self.open_segment(self.segment + 1)
+        return self.segment
+
+    def close(self):
+        if self.fh is None:
+            return False
+        self.flush()
+        self.fh.close()
+        self.fh = None
+        return True
+
+    def write_snapshot(self, segment, records):
+        path = self.get_snapshot_path(segment)
+        path_tmp = "%s.tmp" % path
+        with open(path_tmp, "wb") as fh:
+            fh.write(SNAPSHOT_MAGIC)
+            for record in records:
+                fh.write(pack_record(record))
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.rename(path_tmp, path)
+        fsync_dir(self.data_dir)
+        return path
+
+    def prune(self, segment):
+        """
+        Removes segments and snapshots made obsolete by the
+        snapshot for `segment`
+        """
+        for num, path in list_numbered(self.data_dir, SEGMENT_RE):
+            if num < segment:
+                os.remove(path)
+        for num, path in list_numbered(self.data_dir, SNAPSHOT_RE):
+            if num < segment:
+                os.remove(path)
+        return True
+
+    def iter_recovery(self):
+        """
+        Yields ("snapshot", record) for the latest snapshot, then
+        ("event", record) for every log record after it
+        """
+        snapshots = list_numbered(self.data_dir, SNAPSHOT_RE)
+        start = 0
+        if len(snapshots) > 0:
+            start, path = snapshots[-1]
+            with open(path, "rb") as fh:
+                size = os.fstat(fh.fileno()).st_size
+                if size > len(SNAPSHOT_MAGIC):
+                    buf = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+                    try:
+                        if buf[:len(SNAPSHOT_MAGIC)] == SNAPSHOT_MAGIC:
+                            offset = len(SNAPSHOT_MAGIC)
+                            for record in iter_records(buf, offset):
+                                yield ("snapshot", record)
+                    finally:
+                        buf.close()
+        for num, path in list_numbered(self.data_dir, SEGMENT_RE):
+            if num < start:
+                continue
+            with open(path, "rb") as fh:
+                buf = fh.read()
+            for record in iter_records(buf):
+                yield ("event", record)
+        return None
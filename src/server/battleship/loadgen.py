@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+
+"""
+BattleShip Load Generator
+
+Starts `make_app()` in a child process, or targets `--url`, and plays
+complete games with simulated clients through the real API:
+session create, websocket connect, create or join a game, place all
+ships through the ships route, then alternate moves through the moves
+route until there is a winner.
+
+Reports throughput, per route latency percentiles, websocket fan-out
+delay and server RSS, and saves them as JSON.
+
+"""
+
+import sys
+import time
+import json
+import random
+import datetime
+import resource
+import argparse
+import multiprocessing
+
+from tornado import (
+    gen as torn_gen,
+    httpclient as torn_httpclient,
+    ioloop as torn_ioloop,
+    locks as torn_locks,
+    websocket as torn_ws
+)
+
+import runserver
+
+
+def run_server(port):
+    runserver.make_app().listen(port, address="127.0.0.1")
+    torn_ioloop.IOLoop.current().start()
+    return True
+
+
+def get_rss_kb(pid):
+    try:
+        with open("/proc/%d/status" % pid) as fh:
+            for line in fh:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except IOError:
+        return None
+    return None
+
+
+def get_percentile(values_sorted, pct):
+    if len(values_sorted) == 0:
+        return None
+    idx = int(round((pct / 100.0) * (len(values_sorted) - 1)))
+    return values_sorted[idx]
+
+
+def make_fleet():
+    """
+    Random legal fleet, following the same bounds rule as
+    `PlayerModel.get_ship_arr`
+    """
+    taken = set()
+    fleet = []
+    for ship_id, ship_def in runserver.SHIPS.items():
+        length = ship_def["length"]
+        while True:
+            orientation = random.choice(["x", "y"])
+            x = random.randrange(runserver.GRID_SIZE)
+            y = random.randrange(runserver.GRID_SIZE)
+            if orientation == "x":
+                cells = list(map(lambda i: ((x + i), y), range(length)))
+                end = x + length
+            else:
+                cells = list(map(lambda i: (x, (y + i)), range(length)))
+                end = y + length
+            if end >= runserver.GRID_SIZE:
+                continue
+            if len(taken.intersection(cells)) > 0:
+                continue
+            taken.update(cells)
+            fleet.append((ship_id, x, y, orientation))
+            break
+    return fleet
+
+
+class Stats(object):
+
+    latencies = None
+    errors = None
+    fanout = None
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.fanout = []
+        return None
+
+    def add(self, route, elapsed, ok):
+        self.latencies.setdefault(route, []).append(elapsed)
+        if not ok:
+            self.errors[route] = self.errors.get(route, 0) + 1
+        return True
+
+    def summarize(self, values):
+        values_sorted = sorted(values)
+        return {
+            "count": len(values_sorted),
+            "mean_ms": (
+                (sum(values_sorted) / len(values_sorted)) * 1000
+                if len(values_sorted) > 0
+                else None
+            ),
+            "p50_ms": self.to_ms(get_percentile(values_sorted, 50)),
+            "p95_ms": self.to_ms(get_percentile(values_sorted, 95)),
+            "p99_ms": self.to_ms(get_percentile(values_sorted, 99)),
+            "max_ms": self.to_ms(values_sorted[-1] if values_sorted else None)
+        }
+
+    def to_ms(self, val):
+        return None if val is None else (val * 1000)
+
+    def export(self):
+        routes = {}
+        for route, values in self.latencies.items():
+            routes[route] = dict(
+                self.summarize(values),
+                errors=self.errors.get(route, 0)
+            )
+        return {
+            "routes": routes,
+            "ws_fanout": self.summarize(self.fanout)
+        }
+
+
+class Client(object):
+
+    base_url = None
+    stats = None
+    session_id = None
+    websocket = None
+    version = None
+    version_times = None
+    cond = None
+
+    def __init__(self, base_url, stats):
+        self.base_url = base_url
+        self.stats = stats
+        self.version = 0
+        self.version_times = {}
+        self.cond = torn_locks.Condition()
+        return None
+
+    async def request(self, route, method, path):
+        body = b"" if method in ("POST", "PUT") else None
+        headers = {}
+        if self.session_id is not None:
+            headers[runserver.SESSION_KEY] = self.session_id
+        start = time.monotonic()
+        resp = await torn_httpclient.AsyncHTTPClient().fetch(
+            "%s%s" % (self.base_url, path),
+            method=method,
+            body=body,
+            headers=headers,
+            raise_error=False
+        )
+        self.stats.add(route, (time.monotonic() - start), (resp.code == 200))
+        return resp
+
+    async def connect(self):
+        resp = await self.request(
+            "POST /api/sessions",
+            "POST",
+            "/api/sessions"
+        )
+        self.session_id = resp.headers[runserver.SESSION_KEY]
+        start = time.monotonic()
+        self.websocket = await torn_ws.websocket_connect(
+            "%s/ws/%s" % (
+                self.base_url.replace("http", "ws", 1),
+                self.session_id
+            )
+        )
+        self.stats.add("WS connect", (time.monotonic() - start), True)
+        torn_ioloop.IOLoop.current().spawn_callback(self.read_loop)
+        return True
+
+    async def read_loop(self):
+        while True:
+            message = await self.websocket.read_message()
+            if message is None:
+                break
+            data = json.loads(message)
+            version = data.get("version")
+            if version is not None and version > self.version:
+                self.version = version
+                self.version_times[version] = time.monotonic()
+                self.cond.notify_all()
+        return True
+
+    async def wait_version(self, version, timeout=30):
+        deadline = time.monotonic() + timeout
+        while self.version < version:
+            if time.monotonic() > deadline:
+                return None
+            await self.cond.wait(
+                timeout=datetime.timedelta(
+                    seconds=(deadline - time.monotonic())
+                )
+            )
+        return self.version_times.get(version)
+
+    def close(self):
+        if self.websocket is not None:
+            self.websocket.close()
+        return True
+
+
+async def play_match(base_url, stats):
+    """
+    Plays one game between two clients.  Returns the number of moves,
+    or None when the game could not be completed.
+    """
+    clients = [Client(base_url, stats), Client(base_url, stats)]
+    await torn_gen.multi(list(map(lambda c: c.connect(), clients)))
+    resp = await clients[0].request("POST /api/games", "POST", "/api/games")
+    game = json.loads(resp.body)["data"]
+    game_id = game["id"]
+    player_ids = [game["player_id_you"], None]
+    resp = await clients[1].request(
+        "POST /api/games/:id/players",
+        "POST",
+        "/api/games/%s/players" % game_id
+    )
+    player_ids[1] = json.loads(resp.body)["data"]["player_id_you"]
+    version = 2
+    for client, player_id in zip(clients, player_ids):
+        for ship_id, x, y, orientation in make_fleet():
+            resp = await client.request(
+                "PUT /api/games/:id/players/:id/ships/:ship/:coords",
+                "PUT",
+                "/api/games/%s/players/%s/ships/%s/%d-%d-%s" % (
+                    game_id,
+                    player_id,
+                    ship_id,
+                    x,
+                    y,
+                    orientation
+                )
+            )
+            if resp.code != 200:
+                return None
+            version += 1
+    targets = list(
+        map(
+            lambda _: random.sample(
+                range(runserver.GRID_SIZE ** 2),
+                (runserver.GRID_SIZE ** 2)
+            ),
+            clients
+        )
+    )
+    turn = 0
+    moves = 0
+    while True:
+        client = clients[turn]
+        other = clients[1 - turn]
+        idx = targets[turn].pop()
+        start = time.monotonic()
+        resp = await client.request(
+            "PUT /api/games/:id/players/:id/moves/:coords",
+            "PUT",
+            "/api/games/%s/players/%s/moves/%d-%d" % (
+                game_id,
+                player_ids[turn],
+                (idx % runserver.GRID_SIZE),
+                (idx // runserver.GRID_SIZE)
+            )
+        )
+        if resp.code != 200:
+            return None
+        moves += 1
+        version += 1
+        received = await other.wait_version(version)
+        if received is not None:
+            stats.fanout.append(received - start)
+        if json.loads(resp.body)["data"]["sunk_all"]:
+            break
+        turn = 1 - turn
+    for client in clients:
+        client.close()
+    return moves
+
+
+async def run_load(base_url, num_clients, stats):
+    num_matches = max(1, (num_clients // 2))
+    results = await torn_gen.multi(
+        list(map(lambda _: play_match(base_url, stats), range(num_matches)))
+    )
+    return results
+
+
+async def sample_rss(pid, samples, stop):
+    while not stop:
+        rss = get_rss_kb(pid)
+        if rss is not None:
+            samples.append(rss)
+        await torn_gen.sleep(0.25)
+    return True
+
+
+def raise_nofile_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BattleShip Load Generator")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--port", type=int, default=18888)
+    parser.add_argument(
+        "--url",
+        default=None,
+        help="Target a running server instead of starting one"
+    )
+    parser.add_argument(
+        "--server-pid",
+        type=int,
+        default=None,
+        help="Pid to sample RSS from, with --url"
+    )
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+    raise_nofile_limit()
+    server = None
+    server_pid = args.server_pid
+    base_url = args.url
+    if base_url is None:
+        server = multiprocessing.Process(target=run_server, args=(args.port,))
+        server.start()
+        server_pid = server.pid
+        base_url = "http://127.0.0.1:%d" % args.port
+        time.sleep(0.5)
+    torn_httpclient.AsyncHTTPClient.configure(
+        None,
+        max_clients=max(10, args.clients)
+    )
+    stats = Stats()
+    rss_samples = []
+    rss_stop = []
+    loop = torn_ioloop.IOLoop.current()
+    rss_start = get_rss_kb(server_pid) if server_pid is not None else None
+    if server_pid is not None:
+        loop.spawn_callback(sample_rss, server_pid, rss_samples, rss_stop)
+    start = time.monotonic()
+    results = loop.run_sync(
+        lambda: run_load(base_url, args.clients, stats)
+    )
+    elapsed = time.monotonic() - start
+    rss_stop.append(True)
+    rss_end = get_rss_kb(server_pid) if server_pid is not None else None
+    if server is not None:
+        server.terminate()
+        server.join()
+    completed = list(filter(lambda r: r is not None, results))
+    num_requests = sum(map(len, stats.latencies.values()))
+    out = dict(
+        stats.export(),
+        started_at=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        clients=args.clients,
+        elapsed_s=elapsed,
+        requests=num_requests,
+        throughput_rps=(num_requests / elapsed),
+        games_completed=len(completed),
+        games_failed=(len(results) - len(completed)),
+        moves_per_game=(
+            (sum(completed) / len(completed)) if len(completed) > 0 else None
+        ),
+        server_rss_kb={
+            "start": rss_start,
+            "peak": max(rss_samples) if len(rss_samples) > 0 else rss_end,
+            "end": rss_end
+        }
+    )
+    output = args.output
+    if output is None:
+        output = "loadgen-%s.json" % time.strftime("%Y%m%d-%H%M%S")
+    with open(output, "w") as fh:
+        json.dump(out, fh, indent=2, sort_keys=True)
+    print(
+        "GAMES: %d/%d, REQUESTS: %d, %.0f req/s, ELAPSED: %.1fs" %
+        (
+            len(completed),
+            len(results),
+            num_requests,
+            out["throughput_rps"],
+            elapsed
+        )
+    )
+    for route, summary in sorted(out["routes"].items()):
+        print(
+            "%-52s p50 %7.2fms  p95 %7.2fms  p99 %7.2fms  errors %d" %
+            (
+                route,
+                summary["p50_ms"],
+                summary["p95_ms"],
+                summary["p99_ms"],
+                summary["errors"]
+            )
+        )
+    if out["ws_fanout"]["count"] > 0:
+        print(
+            "%-52s p50 %7.2fms  p95 %7.2fms  p99 %7.2fms" %
+            (
+                "WS fan-out",
+                out["ws_fanout"]["p50_ms"],
+                out["ws_fanout"]["p95_ms"],
+                out["ws_fanout"]["p99_ms"]
+            )
+        )
+    print("SERVER_RSS_KB: %s" % out["server_rss_kb"])
+    print("SAVED: %s" % output)
+    return True
+
+
+if __name__ == "__main__":
+    main()
+    sys.exit(0)
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+
+"""
+BattleShip Metrics
+
+Minimal in-process counters, gauges and histograms, rendered in the
+Prometheus text exposition format.  Recording is a dict lookup and
+a few additions, so it can stay on in production.
+
+"""
+
+import bisect
+import collections
+
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5
+)
+FANOUT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+WAIT_BUCKETS = (0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def escape_label(val):
+    return (
+        str(val)
+        .replace("\\", "\\\\")
+        .replace("\"", "\\\"")
+        .replace("\n", "\\n")
+    )
+
+
+def format_labels(names, values, extra=None):
+    pairs = list(
+        map(
+            lambda p: "%s=\"%s\"" % (p[0], escape_label(p[1])),
+            zip(names, values)
+        )
+    )
+    if extra is not None:
+        pairs.append("%s=\"%s\"" % extra)
+    if len(pairs) == 0:
+        return ""
+    return "{%s}" % ",".join(pairs)
+
+
+def add_label(line, name, value):
+    """
+    Adds a `name` label to a rendered sample line
+    """
+    pair = "%s=\"%s\"" % (name, escape_label(value))
+    metric, sep, rest = line.partition("{")
+    if sep != "":
+        return "%s{%s,%s" % (metric, pair, rest)
+    metric, sep, rest = line.partition(" ")
+    return "%s{%s} %s" % (metric, pair, rest)
+
+
+def merge_rendered(rendered, label_name):
+    """
+    Joins the output of several registries, like one per process,
+    keeping the samples of each metric together, and telling them
+    apart by a `label_name` label set to their index
+    """
+    families = collections.OrderedDict()
+    for index, text in enumerate(rendered):
+        family = None
+        for line in text.splitlines():
+            if line.startswith("# "):
+                family = families.setdefault(line.split(" ", 3)[2], ([], []))
+                if line not in family[0]:
+                    family[0].append(line)
+            elif line != "" and family is not None:
+                family[1].append(add_label(line, label_name, index))
+    lines = []
+    for headers, samples in families.values():
+        lines.extend(headers)
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+def format_value(val):
+    if isinstance(val, float) and val == float("inf"):
+        return "+Inf"
+    return repr(val) if isinstance(val, float) else str(val)
+
+
+class Counter(object):
+
+    kind = "counter"
+    name = None
+    help_text = None
+    label_names = None
+    values = None
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.values = {}
+        return None
+
+    def inc(self, labels=(), amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+        return True
+
+    def render(self):
+        return list(
+            map(
+                lambda i: "%s%s %s" % (
+                    self.name,
+                    format_labels(self.label_names, i[0]),
+                    format_value(i[1])
+                ),
+                sorted(self.values.items())
+            )
+        )
+
+
+class Gauge(object):
+    """
+    Read at render time from `get_value`, so nothing is recorded
+    """
+
+    kind = "gauge"
+    name = None
+    help_text = None
+    get_value = None
+
+    def __init__(self, name, help_text, get_value):
+        self.name = name
+        self.help_text = help_text
+        self.get_value = get_value
+        return None
+
+    def render(self):
+        return ["%s %s" % (self.name, format_value(self.get_value()))]
+
+
+class Histogram(object):
+
+    kind = "histogram"
+    name = None
+    help_text = None
+    label_names = None
+    buckets = None
+    counts = None
+    sums = None
+
+    def __init__(self, name, help_text, label_names=(), buckets=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self.counts = {}
+        self.sums = {}
+        return None
+
+    def observe(self, value, labels=()):
+        counts = self.counts.get(labels)
+        if counts is None:
+            counts = [0] * (len(self.buckets) + 1)
+            self.counts[labels] = counts
+            self.sums[labels] = 0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sums[labels] += value
+        return True
+
+    def render(self):
+        lines = []
+        for labels, counts in sorted(self.counts.items()):
+            total = 0
+            for bound, count in zip((self.buckets + (float("inf"),)), counts):
+                total += count
+                lines.append(
+                    "%s_bucket%s %d" % (
+                        self.name,
+                        format_labels(
+                            self.label_names,
+                            labels,
+                            ("le", format_value(bound))
+                        ),
+                        total
+                    )
+                )
+            lines.append(
+                "%s_sum%s %s" % (
+                    self.name,
+                    format_labels(self.label_names, labels),
+                    format_value(self.sums[labels])
+                )
+            )
+            lines.append(
+                "%s_count%s %d" % (
+                    self.name,
+                    format_labels(self.label_names, labels),
+                    total
+                )
+            )
+        return lines
+
+
+class Registry(object):
+
+    metrics = None
+
+    def __init__(self):
+        self.metrics = []
+        return None
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, label_names=()):
+        return self.add(Counter(name, help_text, label_names))
+
+    def gauge(self, name, help_text, get_value):
+        return self.add(Gauge(name, help_text, get_value))
+
+    def histogram(self, name, help_text, label_names=(), buckets=()):
+        return self.add(Histogram(name, help_text, label_names, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append("# HELP %s %s" % (metric.name, metric.help_text))
+            lines.append("# TYPE %s %s" % (metric.name, metric.kind))
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
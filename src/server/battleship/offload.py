@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+"""
+BattleShip Executor Offload
+
+Runs CPU heavy, pure computations on a thread or process pool, so
+they do not block the IOLoop, and applies their results back on the
+IOLoop.
+
+A job is a `compute` function, called with arguments snapshotted on
+the IOLoop, and an `apply` function, called on the IOLoop with its
+result.  Jobs submitted with the same key, like a game id, are
+applied in submission order, whatever order their computations end
+in, so the state they apply to changes in a known order.  Jobs with
+no `compute` only wait for the jobs before them, and apply at once
+when there are none.
+
+A job with a `prepare` function snapshots its arguments on the IOLoop
+when the jobs before it have applied, instead of when it is
+submitted, so it sees their changes.  Its computation only starts
+then.
+
+With no executor, computations run inline, and jobs apply as soon as
+they are submitted.
+
+"""
+
+import collections
+import concurrent.futures
+
+from tornado import (
+    concurrent as torn_concurrent,
+    ioloop as torn_ioloop
+)
+
+EXECUTOR_NONE = "none"
+EXECUTOR_THREAD = "thread"
+EXECUTOR_PROCESS = "process"
+EXECUTORS = (EXECUTOR_NONE, EXECUTOR_THREAD, EXECUTOR_PROCESS)
+
+
+def make_executor(kind, workers):
+    if kind == EXECUTOR_THREAD:
+        return concurrent.futures.ThreadPoolExecutor(workers)
+    if kind == EXECUTOR_PROCESS:
+        return concurrent.futures.ProcessPoolExecutor(workers)
+    return None
+
+
+class JobModel(object):
+
+    compute = None
+    args = None
+    apply = None
+    prepare = None
+    computed = None
+    future = None
+
+    def __init__(self, compute, args, apply, prepare=None):
+        self.compute = compute
+        self.args = args
+        self.apply = apply
+        self.prepare = prepare
+        self.computed = None
+        self.future = torn_concurrent.Future()
+        return None
+
+    def is_started(self):
+        return self.compute is None or self.computed is not None
+
+    def is_ready(self):
+        return self.compute is None or (
+            self.computed is not None and self.computed.done()
+        )
+
+
+class OrderedExecutor(object):
+
+    executor = None
+    queues = None
+    submitted = None
+    offloaded = None
+
+    def __init__(self, executor=None):
+        self.executor = executor
+        self.queues = {}
+        self.submitted = 0
+        self.offloaded = 0
+        return None
+
+    def submit(self, key, compute, args, apply, prepare=None):
+        """
+        Returns a Future of the result of `apply`.  With `prepare`,
+        `args` are ignored, and `prepare()` returns them once the
+        jobs before have applied, or None to skip `compute`.
+        """
+        self.submitted += 1
+        job = JobModel(compute, args, apply, prepare)
+        queue = self.queues.get(key)
+        if queue is None:
+            queue = collections.deque()
+            self.queues[key] = queue
+        queue.append(job)
+        if prepare is None and not job.is_started():
+            self.start(key, job)
+        self.drain(key)
+        return job.future
+
+    def start(self, key, job):
+        computed = concurrent.futures.Future()
+        try:
+            args = job.args if job.prepare is None else job.prepare()
+            if args is None:
+                computed.set_result(None)
+            elif self.executor is None:
+                computed.set_result(job.compute(*args))
+            else:
+                computed = self.executor.submit(job.compute, *args)
+                self.offloaded += 1
+        except Exception as exc:
+            computed.set_exception(exc)
+        job.computed = computed
+        if not computed.done():
+            torn_ioloop.IOLoop.current().add_future(
+                computed,
+                lambda _: self.drain(key)
+            )
+        return True
+
+    def drain(self, key):
+        """
+        Applies the ready jobs at the head of the `key` queue, and
+        starts the prepared job that comes to the head
+        """
+        queue = self.queues.get(key)
+        if queue is None:
+            return False
+        while len(queue) > 0:
+            if not queue[0].is_started():
+                self.start(key, queue[0])
+            if not queue[0].is_ready():
+                break
+            job = queue.popleft()
+            try:
+                value = None
+                if job.computed is not None:
+                    value = job.computed.result()
+                job.future.set_result(job.apply(value))
+            except Exception as exc:
+                job.future.set_exception(exc)
+        ## An apply may have submitted, and drained, jobs of its own
+        if len(queue) == 0 and self.queues.get(key) is queue:
+            del self.queues[key]
+        return True
+
+    def get_pending(self):
+        return sum(map(len, self.queues.values()))
+
+    def export(self):
+        return {
+            "submitted": self.submitted,
+            "offloaded": self.offloaded,
+            "pending": self.get_pending()
+        }
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+"""
+BattleShip Profiling
+
+On-demand tools for finding what stalls the IOLoop:
+
+- `SamplingProfiler` samples the main thread stack on SIGPROF, and
+  writes collapsed stacks, the input format of flamegraph.pl and
+  speedscope.
+- `RequestTracer` times the phases of each request, and keeps the
+  traces of requests slower than a threshold.
+- `LoopMonitor` measures how late the IOLoop runs a timer, which is
+  how long it was blocked.
+
+"""
+
+import os
+import time
+import signal
+import collections
+
+from tornado import ioloop as torn_ioloop
+
+TRACES_KEPT = 100
+BLOCKS_KEPT = 100
+
+
+class SamplingProfiler(object):
+
+    interval = None
+    stacks = None
+    samples = None
+    started_at = None
+
+    def __init__(self):
+        self.interval = None
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.started_at = None
+        return None
+
+    def is_running(self):
+        return self.interval is not None
+
+    def start(self, interval=0.01):
+        """
+        Samples every `interval` seconds of CPU time
+        """
+        if self.is_running():
+            return False
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.started_at = time.time()
+        signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, interval, interval)
+        return True
+
+    def sample(self, signum, frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(
+                "%s:%s" % (os.path.basename(code.co_filename), code.co_name)
+            )
+            frame = frame.f_back
+        names.reverse()
+        self.stacks[";".join(names)] += 1
+        self.samples += 1
+        return None
+
+    def stop(self):
+        if not self.is_running():
+            return False
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+        self.interval = None
+        return True
+
+    def export_collapsed(self):
+        return "".join(
+            map(
+                lambda s: "%s %d\n" % s,
+                sorted(self.stacks.items())
+            )
+        )
+
+    def write_collapsed(self, path):
+        with open(path, "w") as fh:
+            fh.write(self.export_collapsed())
+        return path
+
+
+class TraceModel(object):
+
+    name = None
+    started_at = None
+    start = None
+    last = None
+    spans = None
+
+    def __init__(self, name):
+        self.name = name
+        self.started_at = time.time()
+        self.start = time.monotonic()
+        self.last = self.start
+        self.spans = collections.OrderedDict()
+        return None
+
+    def mark(self, phase):
+        """
+        Adds the time since the previous mark to `phase`
+        """
+        now = time.monotonic()
+        self.spans[phase] = self.spans.get(phase, 0) + (now - self.last)
+        self.last = now
+        return now
+
+    def export(self, total):
+        return {
+            "name": self.name,
+            "started_at": self.started_at,
+            "total_ms": total * 1000,
+            "spans_ms": list(
+                map(lambda s: [s[0], (s[1] * 1000)], self.spans.items())
+            )
+        }
+
+
+class RequestTracer(object):
+    """
+    Traces one request at a time, which is all the IOLoop runs
+    between two yields.  Marks made outside of a trace are ignored.
+    Requests that yield keep their own trace, and `suspend` it while
+    they wait, and `resume` it after.
+    """
+
+    threshold = None
+    current = None
+    traces = None
+    traced = None
+    slow = None
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.current = None
+        self.traces = collections.deque(maxlen=TRACES_KEPT)
+        self.traced = 0
+        self.slow = 0
+        return None
+
+    def begin(self, name):
+        self.current = TraceModel(name)
+        return self.current
+
+    def mark(self, phase):
+        if self.current is None:
+            return False
+        self.current.mark(phase)
+        return True
+
+    def suspend(self, trace):
+        if self.current is trace:
+            self.current = None
+        return True
+
+    def resume(self, trace):
+        self.current = trace
+        return True
+
+    def end(self, trace):
+        if trace is None:
+            return False
+        if self.current is trace:
+            self.current = None
+        total = trace.mark("finish") - trace.start
+        self.traced += 1
+        if total >= self.threshold:
+            self.slow += 1
+            self.traces.append(trace.export(total))
+        return True
+
+    def export(self):
+        return {
+            "threshold_ms": self.threshold * 1000,
+            "traced": self.traced,
+            "slow": self.slow,
+            "traces": list(self.traces)
+        }
+
+
+class LoopMonitor(object):
+    """
+    Runs a timer every `interval` seconds, and records each time it
+    fires more than `threshold` seconds late
+    """
+
+    interval = None
+    threshold = None
+    observe = None
+    expected_at = None
+    checks = None
+    blocked = None
+    blocked_max = None
+    blocks = None
+
+    def __init__(self, interval, threshold, observe=None):
+        self.interval = interval
+        self.threshold = threshold
+        self.observe = observe
+        self.checks = 0
+        self.blocked = 0
+        self.blocked_max = 0
+        self.blocks = collections.deque(maxlen=BLOCKS_KEPT)
+        return None
+
+    def start(self):
+        self.expected_at = time.monotonic() + self.interval
+        torn_ioloop.IOLoop.current().call_later(self.interval, self.check)
+        return True
+
+    def check(self):
+        lag = max(0, (time.monotonic() - self.expected_at))
+        self.checks += 1
+        if self.observe is not None:
+            self.observe(lag)
+        if lag > self.threshold:
+            self.blocked += 1
+            self.blocked_max = max(self.blocked_max, lag)
+            self.blocks.append([time.time(), (lag * 1000)])
+        return self.start()
+
+    def export(self):
+        return {
+            "interval_ms": self.interval * 1000,
+            "threshold_ms": self.threshold * 1000,
+            "checks": self.checks,
+            "blocked": self.blocked,
+            "blocked_max_ms": self.blocked_max * 1000,
+            "blocks": list(self.blocks)
+        }
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+"""
+BattleShip Admission Control
+
+Token bucket rate limits, keyed by client IP or session id, with a
+separate budget per route class, and a cap on requests in flight.
+Checks are a dict lookup and a few additions, so they run before any
+handler work.
+
+Buckets are kept in LRU order, up to `max_keys` per budget, so a
+client cycling through made up session ids can not grow memory.  An
+evicted bucket was idle the longest, and comes back full.
+
+"""
+
+import math
+import time
+import collections
+
+SCOPE_IP = "ip"
+SCOPE_SESSION = "session"
+KEYS_MAX = 100000
+
+
+class RateLimiter(object):
+
+    rate = None
+    burst = None
+    max_keys = None
+    buckets = None
+
+    def __init__(self, rate, burst, max_keys=KEYS_MAX):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets = collections.OrderedDict()
+        return None
+
+    def take(self, key, now=None):
+        """
+        Takes a token for `key`.  Returns 0 when there was one, or
+        else the seconds until there is.
+        """
+        bucket = self.refill(key, now)
+        wait = self.get_wait(bucket)
+        if wait == 0:
+            bucket[0] -= 1
+        return wait
+
+    def refill(self, key, now=None):
+        """
+        Returns the `[tokens, updated_at]` bucket of `key`, topped up
+        to `now`, without taking from it
+        """
+        if now is None:
+            now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = [self.burst, now]
+            self.buckets[key] = bucket
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+            bucket[0] = min(
+                self.burst,
+                (bucket[0] + ((now - bucket[1]) * self.rate))
+            )
+            bucket[1] = now
+        return bucket
+
+    def get_wait(self, bucket):
+        if bucket[0] < 1:
+            return (1 - bucket[0]) / self.rate
+        return 0
+
+
+class AdmissionModel(object):
+    """
+    `limits` maps each route class to its {scope: (rate, burst)}
+    budgets, where scope is SCOPE_IP or SCOPE_SESSION
+    """
+
+    limiters = None
+    inflight = None
+    inflight_max = None
+    on_reject = None
+
+    def __init__(self, limits, inflight_max, on_reject=None):
+        self.limiters = {}
+        for rate_class, budgets in limits.items():
+            for scope, budget in budgets.items():
+                self.limiters[(rate_class, scope)] = RateLimiter(*budget)
+        self.inflight = 0
+        self.inflight_max = inflight_max
+        self.on_reject = on_reject
+        return None
+
+    def check_rate(self, rate_class, ip, session_id=None):
+        """
+        Returns the seconds to wait before retrying, or 0 when the
+        request is within every budget of `rate_class`.  Tokens are
+        only taken when all budgets have one, so a request rejected
+        by one budget does not use up the others.
+        """
+        now = time.monotonic()
+        keys = ((SCOPE_IP, ip), (SCOPE_SESSION, session_id))
+        buckets = []
+        for scope, key in keys:
+            limiter = self.limiters.get((rate_class, scope))
+            if limiter is None or key is None:
+                continue
+            bucket = limiter.refill(key, now)
+            wait = limiter.get_wait(bucket)
+            if wait > 0:
+                if self.on_reject is not None:
+                    self.on_reject(rate_class, scope)
+                return wait
+            buckets.append(bucket)
+        for bucket in buckets:
+            bucket[0] -= 1
+        return 0
+
+    def begin(self):
+        if self.inflight >= self.inflight_max:
+            if self.on_reject is not None:
+                self.on_reject("inflight", "")
+            return False
+        self.inflight += 1
+        return True
+
+    def end(self):
+        self.inflight -= 1
+        return True
+
+    @classmethod
+    def get_retry_after(cls, wait):
+        return str(max(1, int(math.ceil(wait))))
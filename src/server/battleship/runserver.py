@@ -8,25 +8,133 @@ Copyright 2017 Brendon Brendon <brendon@Brendon.io>
 """
 
 import os
+import re
+import math
+import hmac
+import random
 import sys
-import json
+import time
 import uuid
+import zlib
+import array
+import tempfile
+import bisect
+import argparse
+import itertools
+import collections
 from pprint import pprint
 
-import numpy as np
 from tornado import (
+    escape as torn_escape,
+    gen as torn_gen,
+    httpclient as torn_httpclient,
+    httpserver as torn_httpserver,
     ioloop as torn_ioloop,
+    iostream as torn_iostream,
+    log as torn_log,
+    netutil as torn_netutil,
+    process as torn_process,
     web as torn_web,
     websocket as torn_ws
 )
 
+import bot
+import assets
+import eventlog
+import metrics
+import offload
+import profiling
+import ratelimit
+import serializer
+
 SRC_ROOT = os.path.realpath(os.path.join(os.path.dirname(__file__), "../../"))
 STATIC_ROOT = os.path.realpath(os.path.join(SRC_ROOT, "client/web/"))
+STATIC_ASSETS = None
 
 GAMES = {}
+GAMES_OPEN = {}
+GAMES_OPEN_SEQS = []
+GAMES_SEQ = itertools.count(1)
+GAMES_PAGE_SIZE = 50
+GAMES_PAGE_SIZE_MAX = 200
+GAMES_STARTED = {}
+GAMES_FINISHED = {}
+GAMES_ARCHIVE = {}
+GAMES_ARCHIVE_PATH = None
 SESSIONS = {}
+SESSIONS_IDLE = {}
+SESSIONS_SEEN = {}
+WS_PENDING = {}
+MATCH_QUEUE = collections.OrderedDict()
+MATCH_PENDING = False
+MATCHMAKING_SHARD = 0
+SESSION_TTL = 3600
+GAME_OPEN_TTL = 3600
+GAME_IDLE_TTL = 3600
+GAME_FINISHED_TTL = 300
+GAME_ARCHIVE_TTL = 86400
+SWEEP_INTERVAL = 30
+SWEEP_STATS = {
+    "sessions_expired": 0,
+    "games_abandoned": 0,
+    "games_idle_expired": 0,
+    "games_archived": 0,
+    "games_evicted": 0
+}
+REFRESH_LIST_INTERVAL = float(os.environ.get("BS_REFRESH_LIST_INTERVAL", 0))
+EXPORT_CACHE_STATS = {
+    "hits": 0,
+    "misses": 0,
+    "invalidations": 0
+}
 SESSION_KEY = "X-Bs-Session-Id"
+ADMIN_KEY = "X-Bs-Admin-Token"
+ADMIN_TOKEN = os.environ.get("BS_ADMIN_TOKEN")
+PROFILE_DIR = os.environ.get("BS_PROFILE_DIR", tempfile.gettempdir())
+PROFILE_INTERVAL = 0.01
+SLOW_REQUEST_THRESHOLD = 0.1
+LOOP_MONITOR_INTERVAL = 0.1
+LOOP_BLOCK_THRESHOLD = 0.05
+SESSION_ID_RE = re.compile(r"^[A-Za-z0-9-]{36}$")
+ADMISSION = None
+## Token bucket (rate per second, burst) budgets, per route class
+RATE_LIMITS = {
+    "session": {
+        ratelimit.SCOPE_IP: (2, 20)
+    },
+    "lobby": {
+        ratelimit.SCOPE_SESSION: (5, 20),
+        ratelimit.SCOPE_IP: (50, 200)
+    },
+    "play": {
+        ratelimit.SCOPE_SESSION: (20, 50),
+        ratelimit.SCOPE_IP: (200, 500)
+    },
+    "api": {
+        ratelimit.SCOPE_SESSION: (10, 50),
+        ratelimit.SCOPE_IP: (100, 300)
+    },
+    "ws_connect": {
+        ratelimit.SCOPE_IP: (5, 20)
+    },
+    "ws_command": {
+        ratelimit.SCOPE_SESSION: (20, 50),
+        ratelimit.SCOPE_IP: (200, 500)
+    }
+}
+REQUESTS_INFLIGHT_MAX = 1000
+SHARD_ID = None
+SHARD_COUNT = 1
+SHARD_HOST = "127.0.0.1"
+SHARD_PORT_BASE = None
+CURSOR_KEY = "X-Bs-Cursor-Next"
 GRID_SIZE = 10
+GRID_SIZE_MIN = 5
+GRID_SIZE_MAX = 1000
+BITBOARD_SIZE_MAX = 32
+SPARSE_PLACEMENT_ATTEMPTS = 1000
+FLEET_SHIPS_MAX = 20
+SHIP_ID_RE = re.compile(r"^[a-z][a-z0-9_]{0,31}$")
 SHIPS = {
     "carrier": {
         "id": "carrier",
@@ -55,8 +163,193 @@ SHIPS = {
     }
 }
 SHIPS_INTCODES = dict(map(lambda s: (s[1]["intcode"], s[0]), SHIPS.items()))
+SHIPS_JSON = serializer.dumps(list(SHIPS.values()))
+SHIP_PLACEMENTS = {}
+FLEET_AUTO_ATTEMPTS = 100
 MOVE_HIT = 1
 MOVE_MISS = 2
+EVENT_LOG = None
+EVENT_LOG_FLUSH_INTERVAL = 0.05
+EVENT_SESSION = 1
+EVENT_GAME = 2
+EVENT_JOIN = 3
+EVENT_SHIP = 4
+EVENT_MOVE = 5
+EVENT_WINNER = 6
+EVENT_SESSION_EXPIRE = 7
+EVENT_GAME_REMOVE = 8
+EVENT_BOT = 9
+EVENT_VERSION = 10
+OFFLOAD = offload.OrderedExecutor()
+OFFLOAD_EXPORT_SIZE_MIN = BITBOARD_SIZE_MAX + 1
+METRICS = metrics.Registry()
+METRIC_HTTP_REQUESTS = METRICS.counter(
+    "bs_http_requests_total",
+    "HTTP requests by handler, method and status",
+    ("handler", "method", "status")
+)
+METRIC_HTTP_SECONDS = METRICS.histogram(
+    "bs_http_request_duration_seconds",
+    "HTTP request latency by handler and method",
+    ("handler", "method"),
+    metrics.LATENCY_BUCKETS
+)
+METRIC_HTTP_CODES = METRICS.counter(
+    "bs_http_response_codes_total",
+    "Response codes returned in API bodies, by handler",
+    ("handler", "code")
+)
+METRIC_WS_CONNECTS = METRICS.counter(
+    "bs_ws_connects_total",
+    "Websocket connections opened"
+)
+METRIC_WS_DISCONNECTS = METRICS.counter(
+    "bs_ws_disconnects_total",
+    "Websocket connections closed"
+)
+METRIC_WS_MESSAGES = METRICS.counter(
+    "bs_ws_messages_sent_total",
+    "Websocket messages sent"
+)
+METRIC_WS_DROPS = METRICS.counter(
+    "bs_ws_frames_dropped_total",
+    "Queued websocket frames dropped, coalesced or on overflow",
+    ("reason",)
+)
+METRIC_WS_OVERFLOWS = METRICS.counter(
+    "bs_ws_overflow_disconnects_total",
+    "Websocket connections closed for going over their queue limit"
+)
+METRIC_WS_QUEUE_DEPTH = METRICS.histogram(
+    "bs_ws_queue_depth_frames",
+    "Frames already queued on the connection, per frame sent",
+    (),
+    metrics.FANOUT_BUCKETS
+)
+METRIC_WS_COMMAND_SECONDS = METRICS.histogram(
+    "bs_ws_command_duration_seconds",
+    "Websocket command latency by command and reply code",
+    ("command", "code"),
+    metrics.LATENCY_BUCKETS
+)
+METRIC_FANOUT = METRICS.histogram(
+    "bs_broadcast_fanout_sessions",
+    "Sessions each broadcast is sent to, by action",
+    ("action",),
+    metrics.FANOUT_BUCKETS
+)
+METRICS.gauge("bs_games", "Live games", lambda: len(GAMES))
+METRICS.gauge("bs_games_open", "Games open to join", lambda: len(GAMES_OPEN))
+METRICS.gauge(
+    "bs_games_finished",
+    "Finished games not archived yet",
+    lambda: len(GAMES_FINISHED)
+)
+METRICS.gauge(
+    "bs_games_archived",
+    "Archived games kept in memory",
+    lambda: len(GAMES_ARCHIVE)
+)
+METRIC_MATCHES = METRICS.counter(
+    "bs_matches_total",
+    "Games created by matchmaking"
+)
+METRIC_MATCH_WAIT = METRICS.histogram(
+    "bs_match_wait_seconds",
+    "Time sessions waited in the matchmaking queue",
+    (),
+    metrics.WAIT_BUCKETS
+)
+METRICS.gauge(
+    "bs_match_queue",
+    "Sessions waiting for a match",
+    lambda: len(MATCH_QUEUE)
+)
+METRIC_ADMISSION_REJECTED = METRICS.counter(
+    "bs_admission_rejected_total",
+    "Requests rejected by rate limits, or over the in flight cap",
+    ("rate_class", "scope")
+)
+METRICS.gauge(
+    "bs_requests_inflight",
+    "HTTP requests admitted and not finished",
+    lambda: ADMISSION.inflight if ADMISSION is not None else 0
+)
+METRICS.gauge(
+    "bs_offload_pending",
+    "Offloaded jobs computing, or waiting to apply in order",
+    OFFLOAD.get_pending
+)
+METRIC_IOLOOP_LAG = METRICS.histogram(
+    "bs_ioloop_lag_seconds",
+    "How late the IOLoop ran the monitor timer",
+    (),
+    metrics.LATENCY_BUCKETS
+)
+METRICS.gauge("bs_sessions", "Live sessions", lambda: len(SESSIONS))
+METRICS.gauge(
+    "bs_spectators",
+    "Sessions watching games",
+    lambda: sum(map(lambda g: len(g.spectators), GAMES.values()))
+)
+METRICS.gauge(
+    "bs_sessions_idle",
+    "Sessions with a websocket and no live game",
+    lambda: len(SESSIONS_IDLE)
+)
+METRICS.gauge(
+    "bs_ws_queued_frames",
+    "Frames waiting in websocket outbound queues",
+    lambda: sum(map(lambda q: len(q.frames), OutboundQueueModel.get_queues()))
+)
+METRICS.gauge(
+    "bs_ws_queued_bytes",
+    "Characters waiting in websocket outbound queues",
+    lambda: sum(map(lambda q: q.size, OutboundQueueModel.get_queues()))
+)
+PROFILER = profiling.SamplingProfiler()
+TRACER = profiling.RequestTracer(SLOW_REQUEST_THRESHOLD)
+LOOP_MONITOR = profiling.LoopMonitor(
+    LOOP_MONITOR_INTERVAL,
+    LOOP_BLOCK_THRESHOLD,
+    METRIC_IOLOOP_LAG.observe
+)
+BOT_MOVE_DELAY = 0.3
+BOT_SIZE_MAX = 100
+SPECTATORS_MAX = 1000
+WS_QUEUE_MAX_FRAMES = 256
+WS_QUEUE_MAX_BYTES = 1024 * 1024
+
+
+def make_shard_obj_id():
+    """
+    When sharded, the first 2 hex digits of the id are
+    the owning shard
+    """
+    obj_id = str(uuid.uuid4())
+    if SHARD_ID is None:
+        return obj_id
+    return "%02x%s" % (SHARD_ID, obj_id[2:])
+
+
+def get_shard_by_session_id(session_id):
+    """
+    New games go to a shard picked from the session id, so every
+    router worker sends a session's games to the same shard
+    """
+    if session_id is None:
+        return SHARD_ID
+    return zlib.crc32(session_id.encode("utf-8")) % SHARD_COUNT
+
+
+def get_shard_by_obj_id(obj_id):
+    try:
+        shard_id = int(obj_id[:2], 16)
+    except ValueError:
+        return None
+    if shard_id >= SHARD_COUNT:
+        return None
+    return shard_id
 
 
 class SessionModel(object):
@@ -64,69 +357,327 @@ class SessionModel(object):
     id = None
     websocket = None
     in_game = None
+    players = None
+    spectating = None
+    last_seen = None
 
-    def __init__(self):
-        self.id = str(uuid.uuid4())
+    def __init__(self, session_id=None):
+        self.id = str(uuid.uuid4()) if session_id is None else session_id
         self.websocket = None
         self.in_game = False
+        self.players = {}
+        self.spectating = {}
+        self.last_seen = time.monotonic()
         return None
 
+    def touch(self):
+        """
+        Keeps SESSIONS_SEEN ordered from least to most recently seen
+        """
+        self.last_seen = time.monotonic()
+        SESSIONS_SEEN.pop(self.id, None)
+        SESSIONS_SEEN[self.id] = self
+        return True
+
     def set_websocket(self, conn):
         self.websocket = conn
+        self.update_idle()
+        self.touch()
         return True
 
     def remove_websocket(self):
         self.websocket = None
+        MatchmakerModel.dequeue(self)
+        ## Spectators only get updates over their websocket
+        for game in list(self.spectating.values()):
+            game.remove_spectator(self)
+        self.update_idle()
+        self.touch()
         return True
 
+    def has_live_games(self):
+        return any(
+            map(
+                lambda p: p.game.game_status is not False,
+                self.players.values()
+            )
+        )
+
     def enable_in_game(self):
         self.in_game = True
+        self.update_idle()
+        return True
+
+    def update_idle(self):
+        """
+        Keeps SESSIONS_IDLE to the sessions that are connected,
+        and not in or watching a game
+        """
+        is_idle = (
+            self.in_game is False and
+            len(self.spectating) == 0 and
+            self.websocket is not None and
+            self.id in SESSIONS
+        )
+        if is_idle:
+            SESSIONS_IDLE[self.id] = self
+        elif self.id in SESSIONS_IDLE:
+            del SESSIONS_IDLE[self.id]
+        return is_idle
+
+    def add_player(self, player):
+        self.players[player.game.id] = player
+        return True
+
+    def remove_player(self, game_id):
+        if game_id not in self.players:
+            return False
+        del self.players[game_id]
+        if len(self.players) == 0 and self.in_game:
+            self.in_game = False
+            self.update_idle()
+        return True
+
+    def get_player_for_game(self, game_id):
+        if game_id not in self.players:
+            return None
+        return self.players[game_id]
+
+    def get_games(self):
+        return list(map(lambda p: p.game, self.players.values()))
+
+    def send_data(self, data, key=None):
+        if self.websocket is None:
+            return False
+        self.websocket.send_data(data, key)
         return True
 
-    def send_data(self, data):
+    def send_frame(self, frame, key=None):
         if self.websocket is None:
             return False
-        self.websocket.send_data(data)
+        self.websocket.send_frame(frame, key)
         return True
 
     @classmethod
     def destroy(cls, session):
+        for game in list(session.spectating.values()):
+            game.remove_spectator(session)
+        MatchmakerModel.dequeue(session)
         session.websocket = None
         session.in_game = None
         if session.id in SESSIONS:
             del SESSIONS[session.id]
+        SESSIONS_SEEN.pop(session.id, None)
+        session.update_idle()
         return True
 
     @classmethod
     def get_sessions_not_in_games(cls):
-        return list(
-            filter(
-                lambda s: not s.in_game and s.websocket is not None,
-                SESSIONS.values()
-            )
-        )
+        return list(SESSIONS_IDLE.values())
 
     @classmethod
-    def make_session(cls):
-        session = SessionModel()
+    def make_session(cls, session_id=None):
+        session = SessionModel(session_id)
         SESSIONS[session.id] = session
+        session.touch()
+        PersistModel.record(EVENT_SESSION, session.id)
         return session
 
     @classmethod
-    def find_session(cls, session_id):
+    def is_adoptable(cls, session_id):
+        if SHARD_ID is None:
+            return False
+        return SESSION_ID_RE.match(session_id) is not None
+
+    @classmethod
+    def find_session(cls, session_id, adopt=False):
+        """
+        When sharded, a session may have been created on another
+        shard, so unknown ids are adopted locally, with `adopt`,
+        by requests that change state
+        """
         if not session_id in SESSIONS:
-            return None
-        return SESSIONS[session_id]
+            if not adopt or not SessionModel.is_adoptable(session_id):
+                return None
+            session = SessionModel.make_session(session_id)
+            conn = WS_PENDING.pop(session_id, None)
+            if conn is not None:
+                conn.attach_session(session)
+            return session
+        session = SESSIONS[session_id]
+        session.touch()
+        return session
 
     @classmethod
     def notify_sessions_refresh_list(cls):
-        sessions = SessionModel.get_sessions_not_in_games()
-        for session in sessions:
-            session.send_data({
-                "action": "refresh_games"
-            })
+        return LOBBY_BROADCASTER.notify()
+
+
+class BroadcasterModel(object):
+    """
+    Coalesces notifications into at most one frame per
+    `interval` seconds, or per IOLoop tick when `interval` is 0
+    """
+
+    frame = None
+    action = None
+    interval = None
+    get_sessions = None
+    pending = None
+    events = None
+    flushes = None
+
+    def __init__(self, data, interval, get_sessions):
+        self.frame = serializer.dumps(data)
+        self.action = data["action"]
+        self.interval = interval
+        self.get_sessions = get_sessions
+        self.pending = False
+        self.events = 0
+        self.flushes = 0
+        return None
+
+    def notify(self):
+        self.events += 1
+        if self.pending:
+            return False
+        self.pending = True
+        loop = torn_ioloop.IOLoop.current()
+        if self.interval > 0:
+            loop.call_later(self.interval, self.flush)
+        else:
+            loop.add_callback(self.flush)
+        return True
+
+    def flush(self):
+        self.pending = False
+        self.flushes += 1
+        sent = 0
+        for session in self.get_sessions():
+            session.send_frame(self.frame, self.action)
+            sent += 1
+        METRIC_FANOUT.observe(sent, (self.action,))
+        return True
+
+
+class OutboundQueueModel(object):
+    """
+    Frames waiting to be written to one websocket.  Only one write is
+    in flight at a time, so a slow client backs up here, where it is
+    bounded, instead of in the IOStream buffer.
+
+    A frame sent with a `key` replaces any queued frame with the same
+    key, so idempotent notifications collapse into one.  A connection
+    over WS_QUEUE_MAX_FRAMES or WS_QUEUE_MAX_BYTES is closed.
+    """
+
+    write = None
+    close = None
+    frames = None
+    keyed = None
+    size = None
+    writing = None
+    closed = None
+
+    def __init__(self, write, close):
+        self.write = write
+        self.close = close
+        self.frames = collections.deque()
+        self.keyed = {}
+        self.size = 0
+        self.writing = False
+        self.closed = False
+        return None
+
+    def push(self, frame, key=None):
+        if self.closed:
+            return False
+        ## The older copy is dropped, and the new one goes last, so it
+        ## is never sent ahead of frames queued after the older copy
+        if key is not None and key in self.keyed:
+            entry = self.keyed.pop(key)
+            self.frames.remove(entry)
+            self.size -= len(entry[1])
+            METRIC_WS_DROPS.inc(("coalesced",))
+        METRIC_WS_QUEUE_DEPTH.observe(len(self.frames))
+        ## A single large frame is let through an empty queue
+        if len(self.frames) > 0 and (
+            len(self.frames) >= WS_QUEUE_MAX_FRAMES or
+            (self.size + len(frame)) > WS_QUEUE_MAX_BYTES
+        ):
+            METRIC_WS_DROPS.inc(("overflow",), (len(self.frames) + 1))
+            METRIC_WS_OVERFLOWS.inc()
+            self.clear()
+            self.close()
+            return False
+        entry = [key, frame]
+        self.frames.append(entry)
+        self.size += len(frame)
+        if key is not None:
+            self.keyed[key] = entry
+        if not self.writing:
+            self.flush()
+        return True
+
+    def flush(self):
+        while len(self.frames) > 0:
+            key, frame = self.frames.popleft()
+            self.size -= len(frame)
+            if key is not None:
+                del self.keyed[key]
+            try:
+                future = self.write(frame)
+            except torn_ws.WebSocketClosedError:
+                self.clear()
+                return False
+            METRIC_WS_MESSAGES.inc()
+            if future is not None and not future.done():
+                self.writing = True
+                torn_ioloop.IOLoop.current().add_future(
+                    future,
+                    self.on_written
+                )
+                return True
+        return True
+
+    def on_written(self, future):
+        self.writing = False
+        if future.exception() is not None:
+            self.clear()
+            return False
+        return self.flush()
+
+    def clear(self):
+        self.closed = True
+        self.frames.clear()
+        self.keyed = {}
+        self.size = 0
         return True
 
+    @classmethod
+    def get_queues(cls):
+        return list(
+            map(
+                lambda s: s.websocket.outbound,
+                filter(
+                    lambda s: (
+                        s.websocket is not None and
+                        s.websocket.outbound is not None
+                    ),
+                    SESSIONS.values()
+                )
+            )
+        )
+
+
+LOBBY_BROADCASTER = BroadcasterModel(
+    {
+        "action": "refresh_games"
+    },
+    REFRESH_LIST_INTERVAL,
+    SessionModel.get_sessions_not_in_games
+)
+
 
 class ShipModel(object):
 
@@ -165,37 +716,392 @@ class ShipModel(object):
         return SHIPS_INTCODES[intcode]
 
     @classmethod
-    def make_ship_by_id(cls, ship_id):
-        ship_def = SHIPS[ship_id]
+    def make_ship_by_id(cls, ship_id, ships=None):
+        ship_def = (SHIPS if ships is None else ships)[ship_id]
         return ShipModel(ship_id, ship_def["length"], ship_def["intcode"])
 
 
+class BitBoardModel(object):
+    """
+    Packs a player zone into integer bitsets, where the cell at
+    (x, y) is bit `(y * size) + x`
+    """
+
+    __slots__ = ("size", "occupied", "hits", "misses", "ship_masks")
+
+    is_sparse = False
+
+    def __init__(self, size):
+        self.size = size
+        self.occupied = 0
+        self.hits = 0
+        self.misses = 0
+        self.ship_masks = {}
+        return None
+
+    def is_in_bounds(self, coords):
+        x, y = coords
+        return (0 <= x < self.size and 0 <= y < self.size)
+
+    def get_bit(self, coords):
+        x, y = coords
+        return (1 << ((y * self.size) + x))
+
+    def get_ship_mask(self, ship_len, coords, orientation):
+        x, y = coords
+        if not self.is_in_bounds(coords):
+            return None
+        if orientation == "x":
+            if (x + ship_len) >= self.size:
+                return None
+            return (((1 << ship_len) - 1) << ((y * self.size) + x))
+        if orientation == "y":
+            if (y + ship_len) >= self.size:
+                return None
+            mask = 0
+            for i in range(ship_len):
+                mask |= self.get_bit((x, (y + i)))
+            return mask
+        return None
+
+    def is_space_available(self, ship_mask):
+        return (self.occupied & ship_mask) == 0
+
+    def get_empty_mask(self):
+        return 0
+
+    def get_random_placement(self, ship_len, taken):
+        """
+        Random legal placement that avoids the ships on the board
+        and the `taken` mask, or None
+        """
+        taken = taken | self.occupied
+        placements = list(
+            filter(
+                lambda p: not (p[0] & taken),
+                self.get_placements(ship_len)
+            )
+        )
+        if len(placements) == 0:
+            return None
+        return random.choice(placements)
+
+    def get_placements(self, ship_len):
+        """
+        All legal (ship_mask, coords, orientation) placements of a
+        ship on an empty board, computed once per board size
+        """
+        key = (self.size, ship_len)
+        if key not in SHIP_PLACEMENTS:
+            placements = []
+            for y in range(self.size):
+                for x in range(self.size):
+                    for orientation in ["x", "y"]:
+                        ship_mask = self.get_ship_mask(
+                            ship_len,
+                            (x, y),
+                            orientation
+                        )
+                        if ship_mask is not None:
+                            placements.append(
+                                (ship_mask, (x, y), orientation)
+                            )
+            SHIP_PLACEMENTS[key] = placements
+        return SHIP_PLACEMENTS[key]
+
+    def add_ship_mask(self, ship_id, ship_mask):
+        self.occupied |= ship_mask
+        self.ship_masks[ship_id] = ship_mask
+        return True
+
+    def get_ship_id_at(self, coords):
+        bit = self.get_bit(coords)
+        if not (self.occupied & bit):
+            return None
+        for ship_id, ship_mask in self.ship_masks.items():
+            if ship_mask & bit:
+                return ship_id
+        return None
+
+    def add_attempt(self, is_hit, coords):
+        bit = self.get_bit(coords)
+        if is_hit:
+            self.hits |= bit
+        else:
+            self.misses |= bit
+        return True
+
+    def is_attempted(self, coords):
+        return bool((self.hits | self.misses) & self.get_bit(coords))
+
+    def is_sunk_all(self):
+        return (self.occupied & ~self.hits) == 0
+
+    def iter_cells(self, mask):
+        while mask:
+            low = mask & -mask
+            idx = low.bit_length() - 1
+            yield (idx % self.size, idx // self.size)
+            mask ^= low
+
+    def export_grid(self, intcodes):
+        grid = list(map(lambda _: [0] * self.size, range(self.size)))
+        for ship_id, ship_mask in self.ship_masks.items():
+            for x, y in self.iter_cells(ship_mask):
+                grid[y][x] = intcodes[ship_id]
+        return grid
+
+    def export_attempts(self):
+        grid = list(map(lambda _: [0] * self.size, range(self.size)))
+        for x, y in self.iter_cells(self.hits):
+            grid[y][x] = MOVE_HIT
+        for x, y in self.iter_cells(self.misses):
+            grid[y][x] = MOVE_MISS
+        return grid
+
+    def get_bool_grid(self, mask):
+        return bot.mask_to_grid(mask, self.size)
+
+    def export_snapshot(self):
+        return (self.hits, self.misses, tuple(self.ship_masks.items()))
+
+    def load_snapshot(self, record):
+        hits, misses, ship_masks = record
+        self.hits = hits
+        self.misses = misses
+        for ship_id, ship_mask in ship_masks:
+            self.add_ship_mask(ship_id, ship_mask)
+        return True
+
+
+class SparseBoardModel(object):
+    """
+    Player zone for large boards, which only stores ship cells and
+    attempted cells, by cell index `(y * size) + x`.  Ship masks are
+    frozensets of cell indexes.
+    """
+
+    __slots__ = ("size", "occupied", "hits", "misses", "ship_masks")
+
+    is_sparse = True
+
+    def __init__(self, size):
+        self.size = size
+        self.occupied = {}
+        self.hits = set()
+        self.misses = set()
+        self.ship_masks = {}
+        return None
+
+    def is_in_bounds(self, coords):
+        x, y = coords
+        return (0 <= x < self.size and 0 <= y < self.size)
+
+    def get_cell(self, coords):
+        x, y = coords
+        return ((y * self.size) + x)
+
+    def get_ship_mask(self, ship_len, coords, orientation):
+        x, y = coords
+        if not self.is_in_bounds(coords):
+            return None
+        cell = self.get_cell(coords)
+        if orientation == "x":
+            if (x + ship_len) >= self.size:
+                return None
+            return frozenset(range(cell, (cell + ship_len)))
+        if orientation == "y":
+            if (y + ship_len) >= self.size:
+                return None
+            return frozenset(
+                range(cell, (cell + (ship_len * self.size)), self.size)
+            )
+        return None
+
+    def is_space_available(self, ship_mask):
+        return self.occupied.keys().isdisjoint(ship_mask)
+
+    def get_empty_mask(self):
+        return frozenset()
+
+    def get_random_placement(self, ship_len, taken):
+        """
+        Same as `BitBoardModel.get_random_placement`, but samples
+        placements, as there is no table of them for large boards
+        """
+        for _ in range(SPARSE_PLACEMENT_ATTEMPTS):
+            coords = (random.randrange(self.size), random.randrange(self.size))
+            orientation = random.choice(["x", "y"])
+            ship_mask = self.get_ship_mask(ship_len, coords, orientation)
+            if ship_mask is None or (ship_mask & taken):
+                continue
+            if not self.is_space_available(ship_mask):
+                continue
+            return (ship_mask, coords, orientation)
+        return None
+
+    def add_ship_mask(self, ship_id, ship_mask):
+        for cell in ship_mask:
+            self.occupied[cell] = ship_id
+        self.ship_masks[ship_id] = ship_mask
+        return True
+
+    def get_ship_id_at(self, coords):
+        return self.occupied.get(self.get_cell(coords))
+
+    def add_attempt(self, is_hit, coords):
+        if is_hit:
+            self.hits.add(self.get_cell(coords))
+        else:
+            self.misses.add(self.get_cell(coords))
+        return True
+
+    def is_attempted(self, coords):
+        cell = self.get_cell(coords)
+        return (cell in self.hits or cell in self.misses)
+
+    def is_sunk_all(self):
+        return len(self.hits) == len(self.occupied)
+
+    def iter_cells(self, mask):
+        for cell in mask:
+            yield (cell % self.size, cell // self.size)
+
+    def export_cells(self, intcodes):
+        return list(
+            map(
+                lambda c: [
+                    (c[0] % self.size),
+                    (c[0] // self.size),
+                    intcodes[c[1]]
+                ],
+                self.occupied.items()
+            )
+        )
+
+    def export_attempt_cells(self):
+        return (
+            list(
+                map(
+                    lambda c: [c[0], c[1], MOVE_HIT],
+                    self.iter_cells(self.hits)
+                )
+            ) +
+            list(
+                map(
+                    lambda c: [c[0], c[1], MOVE_MISS],
+                    self.iter_cells(self.misses)
+                )
+            )
+        )
+
+    def get_bool_grid(self, mask):
+        return bot.cells_to_grid(mask, self.size)
+
+    def export_snapshot(self):
+        return (
+            tuple(self.hits),
+            tuple(self.misses),
+            tuple(
+                map(
+                    lambda m: (m[0], tuple(m[1])),
+                    self.ship_masks.items()
+                )
+            )
+        )
+
+    def load_snapshot(self, record):
+        hits, misses, ship_masks = record
+        self.hits = set(hits)
+        self.misses = set(misses)
+        for ship_id, ship_mask in ship_masks:
+            self.add_ship_mask(ship_id, frozenset(ship_mask))
+        return True
+
+
+class MoveLogModel(object):
+    """
+    Shots received, in order, as the flat cell index `(y * size) + x`
+    and the intcode of the ship hit, 0 for a miss.  Takes 5 bytes
+    per move.
+    """
+
+    size = None
+    cells = None
+    ships = None
+
+    def __init__(self, size):
+        self.size = size
+        self.cells = array.array("I")
+        self.ships = array.array("B")
+        return None
+
+    def __len__(self):
+        return len(self.cells)
+
+    def add(self, coords, intcode):
+        self.cells.append((coords[1] * self.size) + coords[0])
+        self.ships.append(intcode)
+        return len(self.cells)
+
+    def export(self, start, intcodes_shown):
+        """
+        Moves from index `start` on, as [x, y, value, intcode] lists.
+        Intcodes not in `intcodes_shown` are exported as 0.
+        """
+        return list(
+            map(
+                lambda m: [
+                    (m[0] % self.size),
+                    (m[0] // self.size),
+                    MOVE_HIT if m[1] > 0 else MOVE_MISS,
+                    m[1] if m[1] in intcodes_shown else 0
+                ],
+                zip(self.cells[start:], self.ships[start:])
+            )
+        )
+
+    def export_snapshot(self):
+        return (self.cells.tobytes(), self.ships.tobytes())
+
+    def load_snapshot(self, record):
+        cells, ships = record
+        self.cells.frombytes(cells)
+        self.ships.frombytes(ships)
+        return True
+
+
 class PlayerModel(object):
 
     id = None
     game = None
     session = None
-    moves_map = None
-    moves_index = None
+    moves = None
     ships = None
-    grid = None
-    grid_attempts = None
+    board = None
     sunk_all = None
 
-    def __init__(self, session, game):
-        self.id = str(uuid.uuid4())
+    def __init__(self, session, game, player_id=None):
+        self.id = str(uuid.uuid4()) if player_id is None else player_id
         self.game = game
         self.session = session
-        self.moves_index = []
-        self.moves_map = {}
+        self.moves = MoveLogModel(game.size)
         self.ships = {}
-        self.grid = np.zeros((GRID_SIZE, GRID_SIZE))
-        self.grid_attempts = np.zeros((GRID_SIZE, GRID_SIZE))
+        self.board = PlayerModel.make_board(game.size)
         self.sunk_all = False
         return None
 
-    def export(self, this_player_id=None):
+    def export(self, this_player_id=None, moves_from=None):
+        """
+        Sparse boards export lists of [x, y, value] cells, in `cells`
+        and `cells_attempts`, instead of full `grid` matrices.
+
+        Only moves from index `moves_from` on are exported, and none
+        when it is None.  The ship hit by a move is only shown to the
+        player, or once sunk.
+        """
         is_this_player = this_player_id == self.id
+        is_sparse = self.board.is_sparse
         ships_objs = self.ships.values()
         ships_pre = (
             filter(lambda s: s.sunk, ships_objs)
@@ -203,12 +1109,40 @@ class PlayerModel(object):
             else ships_objs
         )
         ships_list = list(map(lambda s: s.export(), ships_pre))
+        intcodes = dict(map(lambda s: (s.id, s.intcode), ships_objs))
+        moves_count = len(self.moves)
+        if moves_from is None:
+            moves_from = moves_count
+        moves_from = min(max(0, moves_from), moves_count)
         return {
             "id": self.id,
-            "moves_index": self.moves_index,
+            "moves_count": moves_count,
+            "moves_from": moves_from,
+            "moves": self.moves.export(
+                moves_from,
+                frozenset(map(lambda s: s["intcode"], ships_list))
+            ),
             "sunk_all": self.sunk_all,
-            "grid_attempts": self.grid_attempts.tolist(),
-            "grid": self.grid.tolist() if is_this_player else None,
+            "grid_attempts": (
+                self.board.export_attempts()
+                if not is_sparse
+                else None
+            ),
+            "grid": (
+                self.board.export_grid(intcodes)
+                if is_this_player and not is_sparse
+                else None
+            ),
+            "cells_attempts": (
+                self.board.export_attempt_cells()
+                if is_sparse
+                else None
+            ),
+            "cells": (
+                self.board.export_cells(intcodes)
+                if is_this_player and is_sparse
+                else None
+            ),
             "all_ships_added": self.check_all_ships_added(),
             "ships": ships_list,
             "is_turn": (
@@ -218,7 +1152,7 @@ class PlayerModel(object):
         }
 
     def get_moves(self):
-        return self.moves_index
+        return self.moves
 
     def check_session(self, session_id):
         return session_id is not None and session_id == self.session.id
@@ -227,43 +1161,124 @@ class PlayerModel(object):
         return (ship_id in self.ships)
 
     def check_all_ships_added(self):
-        return (len(self.ships) == len(SHIPS))
+        return (len(self.ships) == len(self.game.ships))
 
     def add_ship(self, ship_id, coords, orientation):
-        if self.has_ship(ship_id):
+        if ship_id not in self.game.ships or self.has_ship(ship_id):
             return False
-        ship = ShipModel.make_ship_by_id(ship_id)
-        ship_arr = self.get_ship_arr(ship.length, coords, orientation)
-        if ship_arr is None:
+        ship = ShipModel.make_ship_by_id(ship_id, self.game.ships)
+        ship_mask = self.get_ship_arr(ship.length, coords, orientation)
+        if ship_mask is None:
             return None
-        available = self.is_space_available(ship_arr)
+        available = self.is_space_available(ship_mask)
         if not available:
             return False
-        self.add_ship_coords_to_grid(ship_arr, ship.intcode)
-        self.ships[ship_id] = ship
-        self.game.notify_players_refresh_game()
-        return True
-
-    def add_ship_coords_to_grid(self, ship_arr, ship_intcode):
-        ship_arr.fill(ship_intcode)
+        self.place_ship(ship, ship_mask, coords, orientation)
+        self.notify_ships_added()
         return True
 
-    def is_space_available(self, ship_arr):
-        return (len(list(filter(lambda k: k > 0, ship_arr))) == 0)
+    def add_fleet(self, fleet):
+        """
+        `fleet` is a list of (ship_id, coords, orientation) tuples.
+        Ships are validated together, and are either all added,
+        with a single notification, or none are.
+        """
+        if self.check_all_ships_added():
+            return (False, None, "fleet_already_placed")
+        if len(fleet) == 0:
+            return (False, None, "bad_ship_coords")
+        placed = []
+        placed_ids = set()
+        fleet_mask = self.board.get_empty_mask()
+        for ship_id, coords, orientation in fleet:
+            if (
+                ship_id not in self.game.ships or
+                ship_id in placed_ids or
+                self.has_ship(ship_id)
+            ):
+                return (False, None, "bad_ship_id")
+            placed_ids.add(ship_id)
+            ship = ShipModel.make_ship_by_id(ship_id, self.game.ships)
+            ship_mask = self.get_ship_arr(ship.length, coords, orientation)
+            if ship_mask is None or (fleet_mask & ship_mask):
+                return (False, None, "bad_ship_coords")
+            if not self.is_space_available(ship_mask):
+                return (False, None, "bad_ship_coords")
+            fleet_mask = fleet_mask | ship_mask
+            placed.append((ship, ship_mask, coords, orientation))
+        for ship, ship_mask, coords, orientation in placed:
+            self.place_ship(ship, ship_mask, coords, orientation)
+        self.notify_ships_added()
+        return (True, None, None)
+
+    def get_auto_fleet(self):
+        """
+        Random legal placements for all ships not added yet,
+        picked from the precomputed placement tables on small boards
+        """
+        ships = self.game.ships
+        missing = sorted(
+            filter(lambda s: not self.has_ship(s), ships.keys()),
+            key=lambda s: -ships[s]["length"]
+        )
+        for _ in range(FLEET_AUTO_ATTEMPTS):
+            fleet = []
+            taken = self.board.get_empty_mask()
+            for ship_id in missing:
+                placement = self.board.get_random_placement(
+                    ships[ship_id]["length"],
+                    taken
+                )
+                if placement is None:
+                    break
+                ship_mask, coords, orientation = placement
+                taken = taken | ship_mask
+                fleet.append((ship_id, coords, orientation))
+            if len(fleet) == len(missing):
+                return fleet
+        return None
+
+    def place_ship(self, ship, ship_mask, coords, orientation):
+        self.add_ship_coords_to_grid(ship_mask, ship.id)
+        self.ships[ship.id] = ship
+        PersistModel.record(
+            EVENT_SHIP,
+            self.game.id,
+            self.id,
+            ship.id,
+            coords[0],
+            coords[1],
+            orientation
+        )
+        self.game.add_change({
+            "type": "ship_added",
+            "player_id": self.id,
+            "ship": ship.export(),
+            "cells": self.get_ship_cells(ship.length, coords, orientation),
+            "all_ships_added": self.check_all_ships_added()
+        })
+        return True
+
+    def notify_ships_added(self):
+        self.game.notify_players_changes()
+        if self.game.bot is not None:
+            self.game.bot.schedule()
+        return True
+
+    def add_ship_coords_to_grid(self, ship_mask, ship_id):
+        return self.board.add_ship_mask(ship_id, ship_mask)
+
+    def is_space_available(self, ship_mask):
+        return self.board.is_space_available(ship_mask)
 
     def get_ship_arr(self, ship_len, coords, orientation):
+        return self.board.get_ship_mask(ship_len, coords, orientation)
+
+    def get_ship_cells(self, ship_len, coords, orientation):
         x, y = coords
         if orientation == "x":
-            end = (x + ship_len)
-            if end >= GRID_SIZE:
-                return None
-            return self.grid[y][x:end]
-        if orientation == "y":
-            end = (y + ship_len)
-            if end >= GRID_SIZE:
-                return None
-            return self.grid[y:end,x]
-        return None
+            return list(map(lambda i: [(x + i), y], range(ship_len)))
+        return list(map(lambda i: [x, (y + i)], range(ship_len)))
 
     def parse_ship_coords(self, coords_code):
         parts = coords_code.split("-")
@@ -279,6 +1294,34 @@ class PlayerModel(object):
             return False
         return ((x, y), orientation)
 
+    def parse_fleet(self, data):
+        """
+        Parses {"auto": true}, or {"ships": [{"ship_id": <id>,
+        "coords": "<x>-<y>-<orientation>"}, ...]}
+        """
+        if not isinstance(data, dict):
+            return None
+        if data.get("auto") is True:
+            return self.get_auto_fleet()
+        ships = data.get("ships")
+        if not isinstance(ships, list):
+            return None
+        fleet = []
+        for ship in ships:
+            if not isinstance(ship, dict):
+                return None
+            ship_id = ship.get("ship_id")
+            coords_code = ship.get("coords")
+            if not isinstance(ship_id, str):
+                return None
+            if not isinstance(coords_code, str):
+                return None
+            parsed = self.parse_ship_coords(coords_code)
+            if not parsed:
+                return None
+            fleet.append((ship_id, parsed[0], parsed[1]))
+        return fleet
+
     def parse_move(self, move_code):
         parts = move_code.split("-")
         if len(parts) != 2:
@@ -291,24 +1334,17 @@ class PlayerModel(object):
         return (x, y)
 
     def get_ship_at_coords(self, coords):
-        x, y = coords
-        intcode = self.grid[y][x]
-        if intcode == 0:
+        ship_id = self.board.get_ship_id_at(coords)
+        if ship_id is None:
             return None
-        ship_id = ShipModel.get_ship_id_by_intcode(intcode)
         ship = self.ships[ship_id]
         return ship
 
     def add_grid_attempt(self, is_hit, coords):
-        x, y = coords
-        code = MOVE_HIT if is_hit else MOVE_MISS
-        self.grid_attempts[y][x] = code
-        return True
+        return self.board.add_attempt(is_hit, coords)
 
     def is_sunk_all(self):
-        return (
-            len(list(filter(lambda s: not s.sunk, self.ships.values()))) == 0
-        )
+        return self.board.is_sunk_all()
 
     def register_hit(self, coords):
         """
@@ -318,11 +1354,24 @@ class PlayerModel(object):
             return (False, None, "not_all_ships_added")
         if self.sunk_all:
             return (False, None, "all_ships_already_sunk")
+        if not self.board.is_in_bounds(coords):
+            return (False, None, "bad_move")
+        if self.board.is_attempted(coords):
+            return (False, None, "already_attempted")
         ship = self.get_ship_at_coords(coords)
         is_hit = (ship is not None)
         self.add_grid_attempt(is_hit, coords)
-        self.moves_map[coords] = True
-        self.moves_index.append(self.moves_map[coords])
+        self.moves.add(coords, ship.intcode if is_hit else 0)
+        if is_hit:
+            ship.add_hit()
+        self.game.add_change({
+            "type": "cell",
+            "player_id": self.id,
+            "x": coords[0],
+            "y": coords[1],
+            "value": MOVE_HIT if is_hit else MOVE_MISS,
+            "ship": ship.export() if is_hit else None
+        })
         if not is_hit:
             return (
                 True,
@@ -333,9 +1382,18 @@ class PlayerModel(object):
                 },
                 None
             )
-        ship.add_hit()
+        if ship.sunk:
+            self.game.add_change({
+                "type": "ship_sunk",
+                "player_id": self.id,
+                "ship": ship.export()
+            })
         if self.is_sunk_all():
             self.sunk_all = True
+            self.game.add_change({
+                "type": "sunk_all",
+                "player_id": self.id
+            })
         return (
             True,
             {
@@ -346,56 +1404,289 @@ class PlayerModel(object):
             None
         )
 
+    def export_snapshot(self):
+        return (
+            eventlog.pack_id(self.id),
+            eventlog.pack_id(self.session.id),
+            self.board.export_snapshot(),
+            tuple(
+                map(
+                    lambda s: (s.id, s.hits, s.sunk),
+                    self.ships.values()
+                )
+            ),
+            self.moves.export_snapshot(),
+            self.sunk_all
+        )
+
+    @classmethod
+    def make_board(cls, size):
+        if size > BITBOARD_SIZE_MAX:
+            return SparseBoardModel(size)
+        return BitBoardModel(size)
+
     @classmethod
-    def create_player(cls, session, game):
-        player = PlayerModel(session, game)
+    def create_player(cls, session, game, player_id=None):
+        player = PlayerModel(session, game, player_id)
         session.enable_in_game()
+        session.add_player(player)
+        return player
+
+    @classmethod
+    def load_snapshot(cls, game, record):
+        (
+            player_id,
+            session_id,
+            board,
+            ships,
+            moves,
+            sunk_all
+        ) = record
+        session_id = eventlog.unpack_id(session_id)
+        session = SessionModel.find_session(session_id)
+        if session is None:
+            session = SessionModel.make_session(session_id)
+        player = PlayerModel.create_player(
+            session,
+            game,
+            eventlog.unpack_id(player_id)
+        )
+        player.board.load_snapshot(board)
+        for ship_id, ship_hits, ship_sunk in ships:
+            ship = ShipModel.make_ship_by_id(ship_id, game.ships)
+            ship.hits = ship_hits
+            ship.sunk = ship_sunk
+            player.ships[ship_id] = ship
+        player.moves.load_snapshot(moves)
+        player.sunk_all = sunk_all
         return player
 
 
 class GameModel(object):
 
     id = None
+    seq = None
+    size = None
+    ships = None
+    ships_json = None
     players = None
+    players_by_session = None
+    spectators = None
     game_status = None
     player_winner = None
     player_turn = None
+    version = None
+    changes = None
+    export_cache = None
+    updated_at = None
+    finished_at = None
+    bot = None
 
-    def __init__(self):
-        self.id = str(uuid.uuid4())
+    def __init__(self, game_id=None, size=None, ships=None):
+        self.id = make_shard_obj_id() if game_id is None else game_id
+        self.seq = next(GAMES_SEQ)
+        self.size = GRID_SIZE if size is None else size
+        self.ships = SHIPS if ships is None else ships
+        self.ships_json = (
+            SHIPS_JSON
+            if ships is None
+            else serializer.dumps(list(ships.values()))
+        )
         self.players = {}
+        self.players_by_session = {}
+        self.spectators = {}
         self.game_status = None
         self.player_winner = None
         self.player_turn = None
+        self.version = 0
+        self.changes = []
+        self.export_cache = {}
+        self.updated_at = time.monotonic()
+        self.finished_at = None
+        self.bot = None
         return None
 
-    def add_player(self, session):
+    def add_player(self, session, player_id=None):
         ## Check if already a player
         player = self.get_player_by_session_id(session.id)
         ## If doesnt exist, create one
         if player is None:
             if len(self.players) >= 2:
                 return None
-            player = PlayerModel.create_player(session, self)
-            self.players[player.id] = player
-        self.game_status = True
+            player = PlayerModel.create_player(session, self, player_id)
+            self.index_player(player)
+            PersistModel.record(EVENT_JOIN, self.id, session.id, player.id)
+        ## Rejoining a finished game leaves it finished
+        if self.game_status is not False:
+            self.game_status = True
         if self.player_turn is None:
             self.player_turn = player
         SessionModel.notify_sessions_refresh_list()
         self.notify_players_refresh_game()
         return player
 
+    def index_player(self, player):
+        self.players[player.id] = player
+        self.players_by_session[player.session.id] = player
+        if len(self.players) >= 2:
+            GameModel.unindex_open_game(self)
+        return True
+
+    def bump_version(self):
+        self.version += 1
+        self.updated_at = time.monotonic()
+        self.touch_started()
+        PersistModel.record_version(self)
+        if len(self.export_cache) > 0:
+            self.export_cache = {}
+            EXPORT_CACHE_STATS["invalidations"] += 1
+        return self.version
+
+    def touch_started(self):
+        """
+        Keeps GAMES_STARTED ordered from least to most recently
+        updated, for games with both players and no winner
+        """
+        if self.game_status is not True or len(self.players) < 2:
+            return False
+        GAMES_STARTED.pop(self.id, None)
+        GAMES_STARTED[self.id] = self
+        return True
+
     def notify_players_refresh_game(self):
+        TRACER.mark("mutate")
+        self.bump_version()
+        key = ("refresh_game", self.id)
+        for player in self.players.values():
+            player.session.send_data(
+                {
+                    "action": "refresh_game",
+                    "game_id": self.id,
+                    "version": self.version
+                },
+                key
+            )
+        METRIC_FANOUT.observe(len(self.players), ("refresh_game",))
+        self.send_spectators(
+            {
+                "action": "refresh_game",
+                "game_id": self.id,
+                "version": self.version
+            },
+            key
+        )
+        TRACER.mark("broadcast")
+        return True
+
+    def add_change(self, change):
+        self.changes.append(change)
+        return True
+
+    def notify_players_changes(self):
+        """
+        Sends all pending changes to each player as a single delta,
+        tagged with the new game version
+        """
+        if len(self.changes) == 0:
+            return False
+        TRACER.mark("mutate")
+        changes = self.changes
+        self.changes = []
+        self.bump_version()
         for player in self.players.values():
             player.session.send_data({
-                "action": "refresh_game"
+                "action": "game_delta",
+                "game_id": self.id,
+                "version": self.version,
+                "changes": list(
+                    map(lambda c: self.export_change(c, player.id), changes)
+                )
+            })
+        METRIC_FANOUT.observe(len(self.players), ("game_delta",))
+        if len(self.spectators) > 0:
+            self.send_spectators({
+                "action": "game_delta",
+                "game_id": self.id,
+                "version": self.version,
+                "changes": list(
+                    map(lambda c: self.export_change(c, None), changes)
+                )
             })
+        TRACER.mark("broadcast")
+        return True
+
+    def add_spectator(self, session):
+        if session.id in self.players_by_session:
+            return False
+        if session.id not in self.spectators:
+            if len(self.spectators) >= SPECTATORS_MAX:
+                self.remove_detached_spectators()
+            if len(self.spectators) >= SPECTATORS_MAX:
+                return False
+            self.spectators[session.id] = session
+            session.spectating[self.id] = self
+            session.update_idle()
+        return True
+
+    def remove_spectator(self, session):
+        if session.id not in self.spectators:
+            return False
+        del self.spectators[session.id]
+        session.spectating.pop(self.id, None)
+        session.update_idle()
+        return True
+
+    def remove_detached_spectators(self):
+        """
+        Spectators who watched over HTTP, and never connected a
+        websocket, do not hold a place when the game is full
+        """
+        for session in list(self.spectators.values()):
+            if session.websocket is None:
+                self.remove_spectator(session)
+        return True
+
+    def send_spectators(self, data, key=None):
+        """
+        Spectators all get the same view, so it is encoded once, and
+        the same frame is written to every socket
+        """
+        if len(self.spectators) == 0:
+            return False
+        frame = serializer.dumps(data)
+        for session in self.spectators.values():
+            session.send_frame(frame, key)
+        METRIC_FANOUT.observe(len(self.spectators), ("spectate",))
         return True
 
-    def export(self, this_player_id=None):
+    def export_change(self, change, this_player_id=None):
+        if change["player_id"] == this_player_id:
+            return change
+        if change["type"] == "ship_added":
+            return {
+                "type": change["type"],
+                "player_id": change["player_id"],
+                "all_ships_added": change["all_ships_added"]
+            }
+        if (
+            change["type"] == "cell" and
+            change["ship"] is not None and
+            not change["ship"]["sunk"]
+        ):
+            return dict(change, ship=None)
+        return change
+
+    def export(self, this_player_id=None, moves_from=None):
+        exported = self.export_state(this_player_id, moves_from)
+        exported["all_avail_ships"] = list(self.ships.values())
+        return exported
+
+    def export_state(self, this_player_id=None, moves_from=None):
         opposing_player = self.get_opposing_player(this_player_id)
         return {
             "id": self.id,
+            "version": self.version,
+            "size": self.size,
             "game_status": self.game_status,
             "player_id_turn": (
                 self.player_turn.id
@@ -410,7 +1701,10 @@ class GameModel(object):
             "players": (
                 dict(
                     map(
-                        lambda p: (p.id, p.export(this_player_id)),
+                        lambda p: (
+                            p.id,
+                            p.export(this_player_id, moves_from)
+                        ),
                         self.players.values()
                     )
                 )
@@ -420,25 +1714,82 @@ class GameModel(object):
                 None
                 if opposing_player is None
                 else opposing_player.id
-            ),
-            "all_avail_ships": list(SHIPS.values())
+            )
         }
 
-    def get_player_by_session_id(self, session_id):
-        players = (
-            list(
-                filter(
-                    lambda p: (
-                        p.session is not None and
-                        p.session.id == session_id
-                    ),
-                    self.players.values()
-                )
-            )
+    def export_json(self, this_player_id=None, moves_from=None):
+        """
+        Same as `export`, but serialized, and cached per viewer
+        until the next version bump.  Exports with `moves_from` are
+        not cached.
+        """
+        if moves_from is None:
+            cached = self.get_cached_export(this_player_id)
+            if cached is not None:
+                return cached
+        exported = self.export_state(this_player_id, moves_from)
+        TRACER.mark("export")
+        out = serializer.dumps(
+            exported,
+            [("all_avail_ships", self.ships_json)]
         )
-        if len(players) == 0:
+        TRACER.mark("encode")
+        if moves_from is None:
+            self.export_cache[this_player_id] = (self.version, out)
+        return out
+
+    def export_json_async(self, this_player_id=None, moves_from=None):
+        """
+        Same as `export_json`, but returns a Future of the state
+        after the pending moves of the game.  Large boards are
+        exported on the IOLoop once those moves applied, and
+        serialized on the executor.
+        """
+        if self.size < OFFLOAD_EXPORT_SIZE_MIN:
+            return OFFLOAD.submit(
+                self.id,
+                None,
+                (),
+                lambda _: self.export_json(this_player_id, moves_from)
+            )
+        cached = None
+        version = None
+
+        def prepare():
+            nonlocal cached, version
+            version = self.version
+            if moves_from is None:
+                cached = self.get_cached_export(this_player_id)
+                if cached is not None:
+                    return None
+            exported = self.export_state(this_player_id, moves_from)
+            TRACER.mark("export")
+            return (exported, [("all_avail_ships", self.ships_json)])
+
+        def apply(out):
+            if cached is not None:
+                return cached
+            return self.cache_export(this_player_id, moves_from, version, out)
+
+        return OFFLOAD.submit(self.id, serializer.dumps, (), apply, prepare)
+
+    def get_cached_export(self, this_player_id):
+        cached = self.export_cache.get(this_player_id)
+        if cached is not None and cached[0] == self.version:
+            EXPORT_CACHE_STATS["hits"] += 1
+            return cached[1]
+        EXPORT_CACHE_STATS["misses"] += 1
+        return None
+
+    def cache_export(self, this_player_id, moves_from, version, out):
+        if moves_from is None and version == self.version:
+            self.export_cache[this_player_id] = (version, out)
+        return out
+
+    def get_player_by_session_id(self, session_id):
+        if session_id not in self.players_by_session:
             return None
-        return players[0]
+        return self.players_by_session[session_id]
 
     def has_player(self, player_id):
         return (player_id in self.players)
@@ -478,16 +1829,63 @@ class GameModel(object):
         hit_status, hit_data, hit_msg = oppose_player.register_hit(coords)
         if not hit_status:
             return (False, None, hit_msg)
+        PersistModel.record(
+            EVENT_MOVE,
+            self.id,
+            this_player.id,
+            coords[0],
+            coords[1]
+        )
         if oppose_player.sunk_all:
             self.register_winner(this_player)
+            PersistModel.record(EVENT_WINNER, self.id, this_player.id)
+            self.add_change({
+                "type": "winner",
+                "player_id": this_player.id
+            })
         else:
             self.swap_player_turn()
-        self.notify_players_refresh_game()
+            self.add_change({
+                "type": "turn",
+                "player_id": self.player_turn.id
+            })
+        self.notify_players_changes()
+        if self.bot is not None:
+            self.bot.schedule()
         return (True, hit_data, None)
 
     def register_winner(self, player):
         self.game_status = False
         self.player_winner = player
+        self.finished_at = time.monotonic()
+        GameModel.unindex_open_game(self)
+        GAMES_STARTED.pop(self.id, None)
+        GAMES_FINISHED[self.id] = self
+        return True
+
+    def archive(self):
+        return ArchivedGameModel(
+            self.id,
+            tuple(self.players.keys()),
+            tuple(map(lambda p: p.session.id, self.players.values())),
+            self.player_winner.id if self.player_winner is not None else None,
+            sum(map(lambda p: len(p.moves), self.players.values())),
+            time.monotonic()
+        )
+
+    @classmethod
+    def remove_game(cls, game):
+        if game.id not in GAMES:
+            return False
+        del GAMES[game.id]
+        GAMES_STARTED.pop(game.id, None)
+        GAMES_FINISHED.pop(game.id, None)
+        GameModel.unindex_open_game(game)
+        for player in game.players.values():
+            player.session.remove_player(game.id)
+        for session in list(game.spectators.values()):
+            game.remove_spectator(session)
+        PersistModel.record(EVENT_GAME_REMOVE, game.id)
         return True
 
     @classmethod
@@ -500,216 +1898,2045 @@ class GameModel(object):
             return None
         return GAMES[game_id]
 
-    @classmethod
-    def create_game_from_id(cls):
-        game = GameModel()
-        GAMES[game.id] = game
-        return game
+    def export_snapshot(self):
+        return (
+            eventlog.pack_id(self.id),
+            self.version,
+            self.game_status,
+            tuple(map(lambda p: p.export_snapshot(), self.players.values())),
+            (
+                eventlog.pack_id(self.player_turn.id)
+                if self.player_turn is not None
+                else None
+            ),
+            (
+                eventlog.pack_id(self.player_winner.id)
+                if self.player_winner is not None
+                else None
+            ),
+            (
+                eventlog.pack_id(self.bot.player.id)
+                if self.bot is not None
+                else None
+            ),
+            self.export_variant()
+        )
 
-    @classmethod
-    def get_joinable_games(cls, session_id):
-        def func(g):
-            #print("---------")
-            #print(session_id)
-            #print(g.get_player_by_session_id(session_id))
-            return (
-                (
-                    (g.get_player_by_session_id(session_id) is not None) or
-                    (len(g.players) < 2)
-                ) and
-                (g.game_status is not False)
-            )
+    def export_variant(self):
+        """
+        (size, ((ship_id, length), ...)) for custom variants,
+        or () for the default board and fleet
+        """
+        if self.size == GRID_SIZE and self.ships is SHIPS:
+            return ()
         return (
-            list(
-                filter(
-                    func,
-                    GAMES.values()
-                )
-            )
-        );
+            self.size,
+            tuple(map(lambda s: (s["id"], s["length"]), self.ships.values()))
+        )
 
+    @classmethod
+    def load_variant(cls, record):
+        if len(record) == 0:
+            return (None, None)
+        size, ship_defs = record
+        return (size, GameModel.make_fleet(ship_defs))
 
-class BaseWebHandler(torn_web.RequestHandler):
+    @classmethod
+    def make_fleet(cls, ship_defs):
+        return dict(
+            map(
+                lambda s: (
+                    s[1][0],
+                    {
+                        "id": s[1][0],
+                        "intcode": (s[0] + 1),
+                        "length": s[1][1]
+                    }
+                ),
+                enumerate(ship_defs)
+            )
+        )
 
-    def get_session(self):
-        if SESSION_KEY not in self.request.headers:
+    @classmethod
+    def parse_variant(cls, data):
+        """
+        Parses {"size": <n>, "ships": [{"id": <id>, "length": <n>}, ...]},
+        where both keys are optional.  Returns (size, ships), or None.
+        """
+        if not isinstance(data, dict):
             return None
-        sess_id_header = self.request.headers[SESSION_KEY]
-        session = SessionModel.find_session(sess_id_header)
-        if session is None:
+        size = data.get("size", GRID_SIZE)
+        if (
+            not isinstance(size, int) or
+            isinstance(size, bool) or
+            size < GRID_SIZE_MIN or
+            size > GRID_SIZE_MAX
+        ):
             return None
-        return session
-
-    def response(self, body_obj=None, status=200, code="ok", headers=None):
-        self.set_status(status)
-        self.set_header("Content-Type", "application/json")
-        if headers is not None:
-            for key, val in headers:
-                self.set_header(key, val)
-        self.write(json.dumps({
-            "code": code,
-            "data": body_obj
-        }))
-        return None
+        ship_objs = data.get("ships")
+        if ship_objs is None:
+            if size == GRID_SIZE:
+                return (None, None)
+            ship_objs = list(SHIPS.values())
+        if (
+            not isinstance(ship_objs, list) or
+            len(ship_objs) == 0 or
+            len(ship_objs) > FLEET_SHIPS_MAX
+        ):
+            return None
+        ship_defs = []
+        for ship_obj in ship_objs:
+            if not isinstance(ship_obj, dict):
+                return None
+            ship_id = ship_obj.get("id")
+            length = ship_obj.get("length")
+            if not isinstance(ship_id, str) or not SHIP_ID_RE.match(ship_id):
+                return None
+            if not isinstance(length, int) or isinstance(length, bool):
+                return None
+            ## Ships must end before the last row and column
+            if length < 1 or length >= size:
+                return None
+            ship_defs.append((ship_id, length))
+        if len(set(map(lambda s: s[0], ship_defs))) != len(ship_defs):
+            return None
+        ## Leave room for a random fleet to be placed
+        if (sum(map(lambda s: s[1], ship_defs)) * 2) > ((size - 1) ** 2):
+            return None
+        return (size, GameModel.make_fleet(ship_defs))
 
+    @classmethod
+    def load_snapshot(cls, record):
+        (
+            game_id,
+            version,
+            game_status,
+            players,
+            turn_id,
+            winner_id,
+            bot_id,
+            variant
+        ) = record
+        size, ships = GameModel.load_variant(variant)
+        game = GameModel(eventlog.unpack_id(game_id), size, ships)
+        GAMES[game.id] = game
+        for player_record in players:
+            game.index_player(PlayerModel.load_snapshot(game, player_record))
+        game.version = version
+        game.game_status = game_status
+        if turn_id is not None:
+            game.player_turn = game.get_player(eventlog.unpack_id(turn_id))
+        if winner_id is not None:
+            game.player_winner = game.get_player(eventlog.unpack_id(winner_id))
+        if bot_id is not None:
+            game.bot = BotModel(game.get_player(eventlog.unpack_id(bot_id)))
+            game.bot.schedule()
+        if len(game.players) < 2 and game.game_status is not False:
+            GameModel.index_open_game(game)
+        game.touch_started()
+        if game.game_status is False:
+            game.finished_at = game.updated_at
+            GAMES_FINISHED[game.id] = game
+        return game
 
-class SessionsHandler(BaseWebHandler):
+    @classmethod
+    def create_game_from_id(cls, game_id=None, size=None, ships=None):
+        game = GameModel(game_id, size, ships)
+        GAMES[game.id] = game
+        GameModel.index_open_game(game)
+        PersistModel.record(EVENT_GAME, game.id, *game.export_variant())
+        return game
 
-    def post(self):
-        session = SessionModel.make_session()
-        return self.response(
-            None,
-            headers=[(SESSION_KEY, session.id)]
-        )
+    @classmethod
+    def index_open_game(cls, game):
+        if game.seq in GAMES_OPEN:
+            return False
+        GAMES_OPEN[game.seq] = game
+        GAMES_OPEN_SEQS.append(game.seq)
+        return True
 
+    @classmethod
+    def unindex_open_game(cls, game):
+        if game.seq not in GAMES_OPEN:
+            return False
+        del GAMES_OPEN[game.seq]
+        pos = bisect.bisect_left(GAMES_OPEN_SEQS, game.seq)
+        del GAMES_OPEN_SEQS[pos]
+        return True
 
-class SessionHandler(BaseWebHandler):
+    @classmethod
+    def get_open_games_page(cls, cursor=0, limit=GAMES_PAGE_SIZE):
+        """
+        Returns a (games, next_cursor) tuple, where `cursor` is
+        the `seq` of the last game seen on the previous page
+        """
+        start = bisect.bisect_right(GAMES_OPEN_SEQS, cursor)
+        seqs = GAMES_OPEN_SEQS[start:(start + limit)]
+        games = list(map(lambda q: GAMES_OPEN[q], seqs))
+        has_more = (start + limit) < len(GAMES_OPEN_SEQS)
+        next_cursor = seqs[-1] if has_more else None
+        return (games, next_cursor)
 
-    def get(self, session_id):
-        session = SessionModel.find_session(session_id)
-        if session is None:
-            session = SessionModel.make_session()
-        return self.response(
-            None,
-            headers=[(SESSION_KEY, session.id)]
+    @classmethod
+    def get_joinable_games(cls, session, cursor=0, limit=GAMES_PAGE_SIZE):
+        games, next_cursor = GameModel.get_open_games_page(cursor, limit)
+        if cursor > 0:
+            return (games, next_cursor)
+        ## Games this session already plays in, but that are full,
+        ## are only listed on the first page
+        own_games = list(
+            filter(
+                lambda g: (
+                    g.game_status is not False and
+                    g.seq not in GAMES_OPEN
+                ),
+                session.get_games()
+            )
         )
+        return ((own_games + games), next_cursor)
 
 
-class GamesHandler(BaseWebHandler):
+ArchivedGameModel = collections.namedtuple(
+    "ArchivedGameModel",
+    [
+        "id",
+        "player_ids",
+        "session_ids",
+        "player_id_winner",
+        "moves",
+        "archived_at"
+    ]
+)
 
-    def post(self):
-        session = self.get_session()
-        if session is None:
-            return self.response(None, 401, "no_session_id")
-        game = GameModel.create_game_from_id()
-        player = game.add_player(session)
-        exported = game.export(player.id)
-        return self.response(
-            exported,
-            headers=[(SESSION_KEY, player.session.id)]
-        )
 
-    def get(self):
-        session = self.get_session()
-        if session is None:
-            return self.response(None, 401, "no_session_id")
-        games = GameModel.get_joinable_games(session.id)
-        out = list(map(lambda g: g.export(), games))
-        return self.response(out)
+class BotModel(object):
+    """
+    Computer opponent, playing as a regular player of the game
+    """
 
+    player = None
+    pending = None
 
-class GameHandler(BaseWebHandler):
+    def __init__(self, player):
+        self.player = player
+        self.pending = False
+        return None
+
+    def place_ships(self):
+        fleet = self.player.get_auto_fleet()
+        if fleet is None:
+            return False
+        fleet_status, fleet_data, fleet_msg = self.player.add_fleet(fleet)
+        return fleet_status
 
-    def get(self, game_id):
+    def schedule(self):
         """
-        Gets status for current game
+        Plays the next move shortly, when it is the bot's turn
         """
-        game = GameModel.get_game_by_id(game_id)
-        if game is None:
-            return self.response(None, 404, "game_not_found")
-        session = self.get_session()
-        if session is None:
-            return self.response(None, 401, "no_session_id")
-        player = game.get_player_by_session_id(session.id)
-        exported = game.export(player.id)
-        return self.response(exported)
+        game = self.player.game
+        if self.pending or game.game_status is not True:
+            return False
+        if game.player_turn is None or game.player_turn.id != self.player.id:
+            return False
+        self.pending = True
+        torn_ioloop.IOLoop.current().call_later(BOT_MOVE_DELAY, self.play)
+        return True
 
+    def get_move_args(self, oppose_player):
+        """
+        Snapshot of the opposing board, as `bot.choose_target` args
+        """
+        board = oppose_player.board
+        ships = oppose_player.ships.values()
+        sunk = board.get_empty_mask()
+        for ship in filter(lambda s: s.sunk, ships):
+            sunk = sunk | board.ship_masks[ship.id]
+        return (
+            board.get_bool_grid(board.hits),
+            board.get_bool_grid(board.misses),
+            board.get_bool_grid(sunk),
+            list(map(lambda s: s.length, filter(lambda s: not s.sunk, ships)))
+        )
 
-class PlayersHandler(BaseWebHandler):
+    def choose_move(self, oppose_player):
+        return bot.choose_target(*self.get_move_args(oppose_player))
 
-    def post(self, game_id):
+    def play(self):
         """
-        Allows a user to join an existing game
+        Targeting runs on the executor, and the move is made back on
+        the IOLoop, unless the game changed in between.  The bot is
+        pending until then.
         """
-        if not GameModel.game_exists(game_id):
-            return self.response(None, 404, "game_not_found")
-        game = GameModel.get_game_by_id(game_id)
-        session = self.get_session()
-        if session is None:
+        game = self.player.game
+        oppose_player = None
+        if (
+            game.id in GAMES and
+            game.game_status is True and
+            game.player_turn is not None and
+            game.player_turn.id == self.player.id
+        ):
+            oppose_player = game.get_opposing_player(self.player.id)
+        if oppose_player is None or not oppose_player.check_all_ships_added():
+            self.pending = False
+            return False
+        version = game.version
+        played = OFFLOAD.submit(
+            game.id,
+            bot.choose_target,
+            self.get_move_args(oppose_player),
+            lambda coords: self.apply_move(version, coords)
+        )
+        torn_ioloop.IOLoop.current().add_future(played, self.on_played)
+        return True
+
+    def on_played(self, played):
+        if played.exception() is None:
+            return True
+        self.pending = False
+        exc = played.exception()
+        torn_log.app_log.error(
+            "BOT_MOVE_FAILED: %s" % self.player.game.id,
+            exc_info=(type(exc), exc, exc.__traceback__)
+        )
+        return False
+
+    def apply_move(self, version, coords):
+        self.pending = False
+        game = self.player.game
+        if coords is None or game.id not in GAMES:
+            return False
+        if game.version != version:
+            return self.schedule()
+        move_status, move_data, move_msg = game.make_move(self.player, coords)
+        return move_status
+
+    @classmethod
+    def add_to_game(cls, game, player_id=None):
+        if game.bot is not None or len(game.players) >= 2:
+            return None
+        ## Dense targeting would block the IOLoop on huge boards
+        if game.size > BOT_SIZE_MAX:
+            return None
+        session = SessionModel.make_session()
+        player = game.add_player(session, player_id)
+        if player is None:
+            return None
+        game.bot = BotModel(player)
+        PersistModel.record(EVENT_BOT, game.id, player.id)
+        game.bot.place_ships()
+        return game.bot
+
+
+class MatchmakerModel(object):
+    """
+    Pairs sessions waiting in MATCH_QUEUE, in arrival order, into new
+    games.  Pairing runs once per IOLoop tick, however many sessions
+    joined the queue during it, and each pair is pushed a
+    `match_found` with its game.
+    """
+
+    @classmethod
+    def enqueue(cls, session):
+        if session.websocket is None:
+            return False
+        if session.id not in MATCH_QUEUE:
+            MATCH_QUEUE[session.id] = (session, time.monotonic())
+        MatchmakerModel.schedule()
+        return True
+
+    @classmethod
+    def dequeue(cls, session):
+        return MATCH_QUEUE.pop(session.id, None) is not None
+
+    @classmethod
+    def schedule(cls):
+        global MATCH_PENDING
+        if MATCH_PENDING:
+            return False
+        MATCH_PENDING = True
+        torn_ioloop.IOLoop.current().add_callback(MatchmakerModel.match)
+        return True
+
+    @classmethod
+    def match(cls):
+        global MATCH_PENDING
+        MATCH_PENDING = False
+        now = time.monotonic()
+        waiting = None
+        while len(MATCH_QUEUE) > 0:
+            session, queued_at = MATCH_QUEUE.popitem(last=False)[1]
+            if session.websocket is None:
+                continue
+            if waiting is None:
+                waiting = (session, queued_at)
+                continue
+            METRIC_MATCH_WAIT.observe(now - waiting[1])
+            METRIC_MATCH_WAIT.observe(now - queued_at)
+            MatchmakerModel.start_game(waiting[0], session)
+            waiting = None
+        ## An odd one out keeps its place at the front
+        if waiting is not None:
+            MATCH_QUEUE[waiting[0].id] = waiting
+            MATCH_QUEUE.move_to_end(waiting[0].id, last=False)
+        return True
+
+    @classmethod
+    def start_game(cls, session_a, session_b):
+        game = GameModel.create_game_from_id()
+        players = (game.add_player(session_a), game.add_player(session_b))
+        for player in players:
+            player.session.send_frame(
+                serializer.dumps(
+                    {
+                        "action": "match_found",
+                        "game_id": game.id
+                    },
+                    [("data", game.export_json(player.id))]
+                )
+            )
+        METRIC_MATCHES.inc()
+        return game
+
+
+class SweeperModel(object):
+    """
+    Expires idle sessions, abandoned open games and started games
+    with no changes for GAME_IDLE_TTL, and compacts finished games
+    into archived records, which are evicted, or spilled to
+    GAMES_ARCHIVE_PATH, after their retention window
+    """
+
+    @classmethod
+    def sweep(cls):
+        now = time.monotonic()
+        SweeperModel.sweep_open_games(now - GAME_OPEN_TTL)
+        SweeperModel.sweep_idle_games(now - GAME_IDLE_TTL)
+        SweeperModel.sweep_finished_games(now - GAME_FINISHED_TTL)
+        SweeperModel.sweep_archive(now - GAME_ARCHIVE_TTL)
+        SweeperModel.sweep_sessions(now - SESSION_TTL)
+        return True
+
+    @classmethod
+    def sweep_sessions(cls, cutoff):
+        ## SESSIONS_SEEN is ordered by last_seen, so stop at the first
+        ## session seen after the cutoff
+        busy = []
+        for session in list(SESSIONS_SEEN.values()):
+            if session.last_seen >= cutoff:
+                break
+            if session.websocket is not None or session.has_live_games():
+                busy.append(session)
+                continue
+            SessionModel.destroy(session)
+            PersistModel.record(EVENT_SESSION_EXPIRE, session.id)
+            SWEEP_STATS["sessions_expired"] += 1
+        for session in busy:
+            session.touch()
+        return True
+
+    @classmethod
+    def sweep_open_games(cls, cutoff):
+        games = list(
+            filter(lambda g: g.updated_at < cutoff, GAMES_OPEN.values())
+        )
+        for game in games:
+            GameModel.remove_game(game)
+            SWEEP_STATS["games_abandoned"] += 1
+        return True
+
+    @classmethod
+    def sweep_idle_games(cls, cutoff):
+        """
+        Started games nobody moved in, like a bot game the human
+        left, which would otherwise keep both sessions live forever.
+        Open games are left to `sweep_open_games`.
+        """
+        ## GAMES_STARTED is ordered by updated_at
+        for game in list(GAMES_STARTED.values()):
+            if game.updated_at >= cutoff:
+                break
+            if game.game_status is not True or game.seq in GAMES_OPEN:
+                del GAMES_STARTED[game.id]
+                continue
+            GameModel.remove_game(game)
+            SWEEP_STATS["games_idle_expired"] += 1
+        return True
+
+    @classmethod
+    def sweep_finished_games(cls, cutoff):
+        ## GAMES_FINISHED is ordered by finished_at
+        for game in list(GAMES_FINISHED.values()):
+            if game.finished_at >= cutoff:
+                break
+            if game.game_status is not False:
+                del GAMES_FINISHED[game.id]
+                continue
+            GAMES_ARCHIVE[game.id] = game.archive()
+            GameModel.remove_game(game)
+            SWEEP_STATS["games_archived"] += 1
+        return True
+
+    @classmethod
+    def sweep_archive(cls, cutoff):
+        evicted = []
+        for archived in GAMES_ARCHIVE.values():
+            if archived.archived_at >= cutoff:
+                break
+            evicted.append(archived)
+        if len(evicted) == 0:
+            return False
+        if GAMES_ARCHIVE_PATH is not None:
+            with open(GAMES_ARCHIVE_PATH, "ab") as fh:
+                fh.write(
+                    b"".join(
+                        map(
+                            lambda a: eventlog.pack_record(tuple(a[:-1])),
+                            evicted
+                        )
+                    )
+                )
+        for archived in evicted:
+            del GAMES_ARCHIVE[archived.id]
+            SWEEP_STATS["games_evicted"] += 1
+        return True
+
+    @classmethod
+    def export_stats(cls):
+        return dict(
+            SWEEP_STATS,
+            sessions_live=len(SESSIONS),
+            games_live=len(GAMES),
+            games_open=len(GAMES_OPEN),
+            games_started=len(GAMES_STARTED),
+            games_finished=len(GAMES_FINISHED),
+            games_archived_live=len(GAMES_ARCHIVE)
+        )
+
+    @classmethod
+    def start(cls):
+        torn_ioloop.PeriodicCallback(
+            SweeperModel.sweep,
+            (SWEEP_INTERVAL * 1000)
+        ).start()
+        return True
+
+
+class PersistModel(object):
+    """
+    Writes every state change to the event log, takes snapshots
+    in a forked child, and rebuilds state from both at startup
+    """
+
+    snapshot_pid = None
+    snapshot_segment = None
+    versions_changed = None
+    sync_executor = None
+
+    @classmethod
+    def record(cls, event_type, *fields):
+        if EVENT_LOG is None:
+            return False
+        EVENT_LOG.append(
+            (event_type,) +
+            tuple(
+                map(
+                    lambda f: (
+                        eventlog.pack_id(f)
+                        if isinstance(f, str) and len(f) == 36
+                        else f
+                    ),
+                    fields
+                )
+            )
+        )
+        return True
+
+    @classmethod
+    def record_version(cls, game):
+        if EVENT_LOG is None:
+            return False
+        PersistModel.versions_changed.add(game.id)
+        return True
+
+    @classmethod
+    def flush(cls):
+        """
+        Ends the events of each changed game with its version, which
+        replay restores rather than counting bumps, then writes the
+        buffer, and fsyncs it off the IOLoop
+        """
+        for game_id in PersistModel.versions_changed:
+            game = GAMES.get(game_id)
+            if game is not None:
+                PersistModel.record(EVENT_VERSION, game.id, game.version)
+        PersistModel.versions_changed = set()
+        fd = EVENT_LOG.write()
+        if fd is None:
+            return False
+        PersistModel.sync_executor.submit(eventlog.fsync_fd, fd)
+        return True
+
+    @classmethod
+    def apply_event(cls, event):
+        event_type = event[0]
+        fields = list(
+            map(
+                lambda f: eventlog.unpack_id(f) if isinstance(f, bytes) else f,
+                event[1:]
+            )
+        )
+        if event_type == EVENT_SESSION:
+            if SessionModel.find_session(fields[0]) is None:
+                SessionModel.make_session(fields[0])
+            return True
+        if event_type == EVENT_GAME:
+            size, ships = GameModel.load_variant(fields[1:])
+            GameModel.create_game_from_id(fields[0], size, ships)
+            return True
+        if event_type == EVENT_SESSION_EXPIRE:
+            session = SessionModel.find_session(fields[0])
+            if session is not None:
+                SessionModel.destroy(session)
+            return True
+        game = GameModel.get_game_by_id(fields[0])
+        if game is None:
+            return False
+        if event_type == EVENT_GAME_REMOVE:
+            GameModel.remove_game(game)
+            return True
+        if event_type == EVENT_VERSION:
+            game.version = fields[1]
+            game.export_cache = {}
+            return True
+        if event_type == EVENT_JOIN:
+            session = SessionModel.find_session(fields[1])
+            if session is None:
+                session = SessionModel.make_session(fields[1])
+            game.add_player(session, fields[2])
+            return True
+        if event_type == EVENT_BOT:
+            if game.bot is None and game.has_player(fields[1]):
+                game.bot = BotModel(game.get_player(fields[1]))
+                game.bot.schedule()
+            return True
+        if not game.has_player(fields[1]):
+            return False
+        player = game.get_player(fields[1])
+        if event_type == EVENT_SHIP:
+            ship_id, x, y, orientation = fields[2:]
+            player.add_ship(ship_id, (x, y), orientation)
+            return True
+        if event_type == EVENT_MOVE:
+            game.make_move(player, tuple(fields[2:]))
+            return True
+        if event_type == EVENT_WINNER:
+            if game.player_winner is None:
+                game.register_winner(player)
+            return True
+        return False
+
+    @classmethod
+    def load_record(cls, record):
+        kind, data = record
+        if kind == "s":
+            if SessionModel.find_session(eventlog.unpack_id(data)) is None:
+                SessionModel.make_session(eventlog.unpack_id(data))
+            return True
+        if kind == "g":
+            GameModel.load_snapshot(data)
+            return True
+        return False
+
+    @classmethod
+    def iter_snapshot_records(cls):
+        for session in SESSIONS.values():
+            yield ("s", eventlog.pack_id(session.id))
+        for game in GAMES.values():
+            yield ("g", game.export_snapshot())
+        return None
+
+    @classmethod
+    def recover(cls, log):
+        counts = {
+            "snapshot": 0,
+            "event": 0
+        }
+        for kind, record in log.iter_recovery():
+            counts[kind] += 1
+            if kind == "snapshot":
+                PersistModel.load_record(record)
+            else:
+                PersistModel.apply_event(record)
+        return counts
+
+    @classmethod
+    def snapshot(cls):
+        """
+        Rotates the log, then writes the snapshot for the new
+        segment from a forked child, so the IOLoop is not blocked
+        """
+        if EVENT_LOG is None:
+            return False
+        if PersistModel.snapshot_pid is not None:
+            PersistModel.reap_snapshot()
+            if PersistModel.snapshot_pid is not None:
+                return False
+        PersistModel.flush()
+        segment = EVENT_LOG.rotate()
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                EVENT_LOG.write_snapshot(
+                    segment,
+                    PersistModel.iter_snapshot_records()
+                )
+                status = 0
+            finally:
+                os._exit(status)
+        PersistModel.snapshot_pid = pid
+        PersistModel.snapshot_segment = segment
+        return True
+
+    @classmethod
+    def reap_snapshot(cls):
+        if PersistModel.snapshot_pid is None:
+            return False
+        pid, status = os.waitpid(PersistModel.snapshot_pid, os.WNOHANG)
+        if pid == 0:
+            return False
+        PersistModel.snapshot_pid = None
+        if status == 0:
+            EVENT_LOG.prune(PersistModel.snapshot_segment)
+        return True
+
+    @classmethod
+    def start(cls, data_dir, snapshot_interval):
+        global EVENT_LOG, GAMES_ARCHIVE_PATH
+        GAMES_ARCHIVE_PATH = os.path.join(data_dir, "archive.log")
+        log = eventlog.EventLog(data_dir)
+        if os.path.isdir(data_dir):
+            counts = PersistModel.recover(log)
+            print(
+                "RECOVERED: %d snapshot records, %d events" %
+                (counts["snapshot"], counts["event"])
+            )
+        log.open()
+        EVENT_LOG = log
+        PersistModel.versions_changed = set()
+        ## One thread, so fsyncs run in write order
+        PersistModel.sync_executor = offload.make_executor(
+            offload.EXECUTOR_THREAD,
+            1
+        )
+        PersistModel.snapshot()
+        torn_ioloop.PeriodicCallback(
+            PersistModel.flush,
+            (EVENT_LOG_FLUSH_INTERVAL * 1000)
+        ).start()
+        torn_ioloop.PeriodicCallback(
+            PersistModel.snapshot,
+            (snapshot_interval * 1000)
+        ).start()
+        torn_ioloop.PeriodicCallback(
+            PersistModel.reap_snapshot,
+            1000
+        ).start()
+        return True
+
+
+class BaseWebHandler(torn_web.RequestHandler):
+    """
+    With an `admission` app setting, requests over the budgets of
+    their `rate_class`, or None for no rate limit, are answered 429
+    before any work, and requests over the in flight cap 503
+    """
+
+    traced = True
+    trace = None
+    rate_class = "api"
+    admitted = False
+
+    def prepare(self):
+        if not self.admit():
+            return None
+        if self.traced:
+            self.trace = TRACER.begin(type(self).__name__)
+        return None
+
+    def admit(self):
+        admission = self.settings.get("admission")
+        if admission is None:
+            return True
+        if self.rate_class is not None:
+            wait = admission.check_rate(
+                self.rate_class,
+                self.request.remote_ip,
+                get_rate_session_id(self.request.headers.get(SESSION_KEY))
+            )
+            if wait > 0:
+                retry_after = ratelimit.AdmissionModel.get_retry_after(wait)
+                self.response(
+                    None,
+                    429,
+                    "rate_limited",
+                    [("Retry-After", retry_after)]
+                )
+                self.finish()
+                return False
+        if not admission.begin():
+            self.response(None, 503, "server_busy")
+            self.finish()
+            return False
+        self.admitted = True
+        return True
+
+    def release(self):
+        if not self.admitted:
+            return False
+        self.admitted = False
+        self.settings["admission"].end()
+        return True
+
+    def on_connection_close(self):
+        self.release()
+        return None
+
+    def get_session(self):
+        """
+        Reads with a session id this shard does not know get an
+        unsaved session, so only requests that change state adopt it
+        """
+        session = None
+        if SESSION_KEY in self.request.headers:
+            sess_id_header = self.request.headers[SESSION_KEY]
+            adopt = self.request.method not in ("GET", "HEAD")
+            session = SessionModel.find_session(sess_id_header, adopt)
+            if session is None and not adopt and (
+                SessionModel.is_adoptable(sess_id_header)
+            ):
+                session = SessionModel(sess_id_header)
+        TRACER.mark("session")
+        return session
+
+    def on_finish(self):
+        self.release()
+        TRACER.end(self.trace)
+        handler = type(self).__name__
+        METRIC_HTTP_REQUESTS.inc(
+            (handler, self.request.method, self.get_status())
+        )
+        METRIC_HTTP_SECONDS.observe(
+            self.request.request_time(),
+            (handler, self.request.method)
+        )
+        return None
+
+    def response(self, body_obj=None, status=200, code="ok", headers=None):
+        METRIC_HTTP_CODES.inc((type(self).__name__, code))
+        self.set_status(status)
+        self.set_header("Content-Type", "application/json")
+        if headers is not None:
+            for key, val in headers:
+                self.set_header(key, val)
+        self.write(serializer.dumps({
+            "code": code,
+            "data": body_obj
+        }))
+        TRACER.mark("encode")
+        return None
+
+    def response_json(self, body_json, status=200, code="ok", headers=None):
+        """
+        Same as `response`, but with `body_json` already serialized
+        """
+        METRIC_HTTP_CODES.inc((type(self).__name__, code))
+        self.set_status(status)
+        self.set_header("Content-Type", "application/json")
+        if headers is not None:
+            for key, val in headers:
+                self.set_header(key, val)
+        self.write(serializer.dumps({"code": code}, [("data", body_json)]))
+        TRACER.mark("encode")
+        return None
+
+
+class StatsHandler(BaseWebHandler):
+
+    rate_class = None
+
+    def get(self):
+        return self.response({
+            "export_cache": EXPORT_CACHE_STATS,
+            "lobby_broadcaster": {
+                "events": LOBBY_BROADCASTER.events,
+                "flushes": LOBBY_BROADCASTER.flushes,
+                "idle_sessions": len(SESSIONS_IDLE)
+            },
+            "lifecycle": SweeperModel.export_stats(),
+            "offload": OFFLOAD.export()
+        })
+
+
+class MetricsHandler(BaseWebHandler):
+
+    rate_class = None
+
+    def get(self):
+        """
+        Metrics in the Prometheus text format
+        """
+        self.set_header("Content-Type", metrics.CONTENT_TYPE)
+        self.write(METRICS.render())
+        return None
+
+
+class BaseAdminHandler(BaseWebHandler):
+    """
+    Admin routes are enabled by setting the BS_ADMIN_TOKEN env var,
+    and require it in the X-Bs-Admin-Token header
+    """
+
+    def is_admin(self):
+        token = self.request.headers.get(ADMIN_KEY)
+        if ADMIN_TOKEN is None or token is None:
+            return False
+        return hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+class ProfilerHandler(BaseAdminHandler):
+
+    def get(self):
+        if not self.is_admin():
+            return self.response(None, 403, "admin_not_authorized")
+        return self.response({
+            "running": PROFILER.is_running(),
+            "samples": PROFILER.samples
+        })
+
+    def post(self):
+        """
+        Starts sampling the stack every `interval_ms` of CPU time
+        """
+        if not self.is_admin():
+            return self.response(None, 403, "admin_not_authorized")
+        try:
+            interval = float(
+                self.get_query_argument(
+                    "interval_ms",
+                    (PROFILE_INTERVAL * 1000)
+                )
+            ) / 1000
+        except ValueError:
+            return self.response(None, 400, "bad_interval")
+        if not math.isfinite(interval) or interval < 0.001:
+            return self.response(None, 400, "bad_interval")
+        if not PROFILER.start(interval):
+            return self.response(None, 409, "profiler_running")
+        return self.response()
+
+    def delete(self):
+        """
+        Stops sampling, and writes the collapsed stacks, for
+        flamegraph.pl or speedscope, to BS_PROFILE_DIR
+        """
+        if not self.is_admin():
+            return self.response(None, 403, "admin_not_authorized")
+        if not PROFILER.stop():
+            return self.response(None, 409, "profiler_not_running")
+        path = PROFILER.write_collapsed(
+            os.path.join(
+                PROFILE_DIR,
+                "bs-profile-%d-%d.folded" % (os.getpid(), int(time.time()))
+            )
+        )
+        return self.response({
+            "path": path,
+            "samples": PROFILER.samples,
+            "stacks": len(PROFILER.stacks)
+        })
+
+
+class TracesHandler(BaseAdminHandler):
+
+    def get(self):
+        """
+        Recent slow requests, with the time spent in each phase,
+        and recent IOLoop blocks
+        """
+        if not self.is_admin():
+            return self.response(None, 403, "admin_not_authorized")
+        return self.response({
+            "requests": TRACER.export(),
+            "ioloop": LOOP_MONITOR.export()
+        })
+
+    def put(self):
+        if not self.is_admin():
+            return self.response(None, 403, "admin_not_authorized")
+        try:
+            threshold = float(self.get_query_argument("threshold_ms")) / 1000
+        except (ValueError, torn_web.MissingArgumentError):
+            return self.response(None, 400, "bad_threshold")
+        if not math.isfinite(threshold) or threshold <= 0:
+            return self.response(None, 400, "bad_threshold")
+        TRACER.threshold = threshold
+        return self.response(TRACER.export())
+
+
+class SessionsHandler(BaseWebHandler):
+
+    rate_class = "session"
+
+    def post(self):
+        session = SessionModel.make_session()
+        return self.response(
+            None,
+            headers=[(SESSION_KEY, session.id)]
+        )
+
+
+class SessionHandler(BaseWebHandler):
+
+    rate_class = "session"
+
+    def get(self, session_id):
+        session = SessionModel.find_session(session_id, True)
+        if session is None:
+            session = SessionModel.make_session()
+        return self.response(
+            None,
+            headers=[(SESSION_KEY, session.id)]
+        )
+
+
+class GamesHandler(BaseWebHandler):
+
+    rate_class = "lobby"
+
+    def post(self):
+        """
+        Creates a game, with an optional JSON body choosing the
+        variant, as {"size": <n>, "ships": [{"id", "length"}, ...]}
+        """
+        session = self.get_session()
+        if session is None:
+            return self.response(None, 401, "no_session_id")
+        variant = (None, None)
+        if len(self.request.body.strip()) > 0:
+            try:
+                data = serializer.loads(self.request.body)
+            except ValueError:
+                return self.response(None, 400, "bad_request_body")
+            variant = GameModel.parse_variant(data)
+            if variant is None:
+                return self.response(None, 400, "bad_game_variant")
+        game = GameModel.create_game_from_id(None, *variant)
+        player = game.add_player(session)
+        exported = game.export_json(player.id)
+        return self.response_json(
+            exported,
+            headers=[(SESSION_KEY, player.session.id)]
+        )
+
+    def get(self):
+        session = self.get_session()
+        if session is None:
+            return self.response(None, 401, "no_session_id")
+        try:
+            cursor = int(self.get_query_argument("cursor", 0))
+            limit = int(self.get_query_argument("limit", GAMES_PAGE_SIZE))
+        except ValueError:
+            return self.response(None, 400, "bad_cursor")
+        if cursor < 0 or limit < 1:
+            return self.response(None, 400, "bad_cursor")
+        limit = min(limit, GAMES_PAGE_SIZE_MAX)
+        games, next_cursor = GameModel.get_joinable_games(
+            session,
+            cursor,
+            limit
+        )
+        out = "[%s]" % ", ".join(map(lambda g: g.export_json(), games))
+        headers = (
+            [(CURSOR_KEY, str(next_cursor))]
+            if next_cursor is not None
+            else None
+        )
+        return self.response_json(out, headers=headers)
+
+
+class SessionGamesHandler(BaseWebHandler):
+
+    rate_class = "lobby"
+
+    def get(self, session_id):
+        """
+        Lists the games this session is playing in
+        """
+        session = self.get_session()
+        if session is None:
+            return self.response(None, 401, "no_session_id")
+        if session.id != session_id:
+            return self.response(None, 403, "session_not_authorized")
+        out = "[%s]" % ", ".join(
+            map(
+                lambda p: p.game.export_json(p.id),
+                session.players.values()
+            )
+        )
+        return self.response_json(out)
+
+
+class GameHandler(BaseWebHandler):
+
+    async def get(self, game_id):
+        """
+        Gets status for current game.  Moves are only exported from
+        the `moves_from` query argument on, when given.
+        """
+        game = GameModel.get_game_by_id(game_id)
+        if game is None:
+            if game_id in GAMES_ARCHIVE:
+                exported = GAMES_ARCHIVE[game_id]._asdict()
+                del exported["archived_at"]
+                return self.response(exported, 410, "game_archived")
+            return self.response(None, 404, "game_not_found")
+        session = self.get_session()
+        if session is None:
+            return self.response(None, 401, "no_session_id")
+        moves_from = self.get_query_argument("moves_from", None)
+        if moves_from is not None:
+            try:
+                moves_from = int(moves_from)
+            except ValueError:
+                return self.response(None, 400, "bad_moves_from")
+            if moves_from < 0:
+                return self.response(None, 400, "bad_moves_from")
+        player = session.get_player_for_game(game.id)
+        exported = await await_traced(
+            self.trace,
+            game.export_json_async(
+                None if player is None else player.id,
+                moves_from
+            )
+        )
+        return self.response_json(exported)
+
+
+class PlayersHandler(BaseWebHandler):
+
+    def post(self, game_id):
+        """
+        Allows a user to join an existing game
+        """
+        if not GameModel.game_exists(game_id):
+            return self.response(None, 404, "game_not_found")
+        game = GameModel.get_game_by_id(game_id)
+        session = self.get_session()
+        if session is None:
             return self.response(None, 401, "no_session_id")
         player = game.add_player(session)
         if player is None:
-            return self.response(None, 401, "max_players_already_joined")
-        exported = game.export(player.id)
-        return self.response(exported)
+            return self.response(None, 401, "max_players_already_joined")
+        exported = game.export_json(player.id)
+        return self.response_json(exported)
+
+
+class SpectatorsHandler(BaseWebHandler):
+
+    def post(self, game_id):
+        """
+        Watches a game, and gets its spectator view, which only
+        shows ships once they are sunk
+        """
+        game = GameModel.get_game_by_id(game_id)
+        if game is None:
+            return self.response(None, 404, "game_not_found")
+        session = self.get_session()
+        if session is None:
+            return self.response(None, 401, "no_session_id")
+        if not game.add_spectator(session):
+            return self.response(None, 409, "cannot_spectate")
+        return self.response_json(game.export_json(None))
+
+    def delete(self, game_id):
+        game = GameModel.get_game_by_id(game_id)
+        if game is None:
+            return self.response(None, 404, "game_not_found")
+        session = self.get_session()
+        if session is None:
+            return self.response(None, 401, "no_session_id")
+        game.remove_spectator(session)
+        return self.response()
+
+
+class MatchmakingHandler(BaseWebHandler):
+
+    rate_class = "lobby"
+
+    def post(self):
+        """
+        Queues the session for a match, which is pushed over its
+        websocket as a `match_found` with the new game
+        """
+        session = self.get_session()
+        if session is None:
+            return self.response(None, 401, "no_session_id")
+        if not MatchmakerModel.enqueue(session):
+            return self.response(None, 409, "no_websocket")
+        return self.response()
+
+    def delete(self):
+        session = self.get_session()
+        if session is None:
+            return self.response(None, 401, "no_session_id")
+        MatchmakerModel.dequeue(session)
+        return self.response()
+
+
+class BotsHandler(BaseWebHandler):
+
+    def post(self, game_id):
+        """
+        Adds a computer opponent to a game the user is playing
+        """
+        game = GameModel.get_game_by_id(game_id)
+        if game is None:
+            return self.response(None, 404, "game_not_found")
+        session = self.get_session()
+        if session is None:
+            return self.response(None, 401, "no_session_id")
+        player = session.get_player_for_game(game.id)
+        if player is None:
+            return self.response(None, 403, "player_session_not_authorized")
+        if game.size > BOT_SIZE_MAX:
+            return self.response(None, 400, "bot_board_too_large")
+        game_bot = BotModel.add_to_game(game)
+        if game_bot is None:
+            return self.response(None, 401, "max_players_already_joined")
+        exported = game.export_json(player.id)
+        return self.response_json(exported)
+
+
+class MovesHandler(BaseWebHandler):
+
+    rate_class = "play"
+
+    async def put(self, game_id, player_id, move_code):
+        """
+        Moves are made in order with the other offloaded jobs of
+        the game, like bot moves
+        """
+        game = GameModel.get_game_by_id(game_id)
+        if game is None:
+            return self.response(None, 404, "game_not_found")
+        player = game.get_player(player_id)
+        if player is None:
+            return self.response(None, 403, "player_id_not_specified")
+        session = self.get_session()
+        if session is None:
+            return self.response(None, 403, "no_session")
+        if not player.check_session(session.id):
+            return self.response(None, 403, "player_session_not_authorized")
+        coords = player.parse_move(move_code)
+        TRACER.mark("parse")
+        if coords is None:
+            return self.response(None, 404, "bad_move")
+        move_status, move_data, move_msg = await await_traced(
+            self.trace,
+            OFFLOAD.submit(
+                game.id,
+                None,
+                (),
+                lambda _: game.make_move(player, coords)
+            )
+        )
+        if not move_status:
+            return self.response(None, 404, move_msg)
+        return self.response(move_data)
+
+
+class FleetHandler(BaseWebHandler):
+
+    rate_class = "play"
+
+    def put(self, game_id, player_id):
+        """
+        Adds several ships at once, or a random fleet with
+        {"auto": true}
+        """
+        game = GameModel.get_game_by_id(game_id)
+        if game is None:
+            return self.response(None, 404, "game_not_found")
+        if not game.has_player(player_id):
+            return self.response(None, 403, "player_id_not_specified")
+        player = game.get_player(player_id)
+        session = self.get_session()
+        if session is None:
+            return self.response(None, 403, "no_session")
+        if not player.check_session(session.id):
+            return self.response(None, 403, "player_session_not_authorized")
+        try:
+            data = serializer.loads(self.request.body)
+        except ValueError:
+            return self.response(None, 400, "bad_request_body")
+        fleet = player.parse_fleet(data)
+        TRACER.mark("parse")
+        if fleet is None:
+            return self.response(None, 404, "bad_ship_coords")
+        fleet_status, fleet_data, fleet_msg = player.add_fleet(fleet)
+        if not fleet_status:
+            return self.response(None, 404, fleet_msg)
+        return self.response_json(game.export_json(player.id))
+
+
+class ShipsHandler(BaseWebHandler):
+
+    rate_class = "play"
+
+    def put(self, game_id, player_id, ship_id, coords_code):
+        game = GameModel.get_game_by_id(game_id)
+        if game is None:
+            return self.response(None, 404, "game_not_found")
+        player = game.get_player(player_id)
+        if player is None:
+            return self.response(None, 403, "player_id_not_specified")
+        session = self.get_session()
+        if session is None:
+            return self.response(None, 403, "no_session")
+        if not player.check_session(session.id):
+            return self.response(None, 403, "player_session_not_authorized")
+        coords, orientation = player.parse_ship_coords(coords_code)
+        TRACER.mark("parse")
+        if not coords:
+            return self.response(None, 404, "bad_ship_coords")
+        ship_status = player.add_ship(ship_id, coords, orientation)
+        if not ship_status:
+            return self.response(None, 404, "bad_ship_coords")
+        return self.response()
+
+
+class BaseWsHandler(torn_ws.WebSocketHandler):
+    """
+    Besides server pushes, accepts commands of the form:
+
+    {"id": <request id>, "command": <command>, ...params}
+
+    Each command is answered, in order, with:
+
+    {"action": "reply", "id": <request id>, "code": <code>, "data": ...}
+    """
+
+    session = None
+    session_id = None
+    outbound = None
+    trace = None
+    commands = (
+        "join",
+        "place_ship",
+        "place_fleet",
+        "move",
+        "get_state",
+        "spectate",
+        "unspectate",
+        "matchmake",
+        "unmatchmake"
+    )
+
+    def check_origin(self, origin):
+        return True
+
+    def prepare(self):
+        if not check_ws_connect_rate(self):
+            raise torn_web.HTTPError(429)
+        return None
+
+    def open(self, session_id):
+        print("WEBSOCKET_SESSION: %s" % session_id)
+        session = SessionModel.find_session(session_id)
+        if session is None and not SessionModel.is_adoptable(session_id):
+            self.close()
+            return None
+        self.session_id = session_id
+        if session is None:
+            ##
+            ## The router connects every shard, so the id is only
+            ## adopted by a command, or a request that changes state
+            ##
+            WS_PENDING[session_id] = self
+            return None
+        self.attach_session(session)
+        return None
+
+    def attach_session(self, session):
+        self.session = session
+        self.outbound = OutboundQueueModel(self.write_message, self.close)
+        self.session.set_websocket(self)
+        METRIC_WS_CONNECTS.inc()
+        return True
+
+    def send_data(self, data, key=None):
+        return self.send_frame(serializer.dumps(data), key)
+
+    def send_frame(self, frame, key=None):
+        """
+        Queues `frame`, see `OutboundQueueModel`
+        """
+        return self.outbound.push(frame, key)
+
+    def send_reply(self, request_id, code, data_json=None):
+        self.send_frame(
+            serializer.dumps(
+                {
+                    "action": "reply",
+                    "id": request_id,
+                    "code": code
+                },
+                [("data", "null" if data_json is None else data_json)]
+            )
+        )
+        return True
+
+    async def on_message(self, message):
+        """
+        Commands return a (code, data_json) tuple, or a coroutine of
+        one when they wait on offloaded work
+        """
+        if self.session is None:
+            if self.session_id is None:
+                return None
+            session = SessionModel.find_session(self.session_id, True)
+            if self.session is None:
+                self.attach_session(session)
+        self.session.touch()
+        try:
+            msg = serializer.loads(message)
+        except ValueError:
+            self.send_reply(None, "bad_message")
+            return None
+        if not isinstance(msg, dict):
+            self.send_reply(None, "bad_message")
+            return None
+        request_id = msg.get("id")
+        command = msg.get("command")
+        if not check_ws_command_rate(self, self.session.id):
+            self.send_reply(request_id, "rate_limited")
+            return None
+        if command not in self.commands:
+            self.send_reply(request_id, "bad_command")
+            return None
+        start = time.monotonic()
+        self.trace = TRACER.begin("ws_%s" % command)
+        result = getattr(self, "command_%s" % command)(msg)
+        if not isinstance(result, tuple):
+            result = await result
+        code, data_json = result
+        self.send_reply(request_id, code, data_json)
+        TRACER.end(self.trace)
+        self.trace = None
+        METRIC_WS_COMMAND_SECONDS.observe(
+            (time.monotonic() - start),
+            (command, code)
+        )
+        return None
+
+    def get_command_game(self, msg):
+        game_id = msg.get("game_id")
+        if not isinstance(game_id, str):
+            return None
+        return GameModel.get_game_by_id(game_id)
+
+    def get_command_str(self, msg, key):
+        val = msg.get(key)
+        if not isinstance(val, str):
+            return None
+        return val
+
+    def command_join(self, msg):
+        if msg.get("game_id") is None:
+            game = GameModel.create_game_from_id()
+        else:
+            game = self.get_command_game(msg)
+            if game is None:
+                return ("game_not_found", None)
+        player = game.add_player(self.session)
+        if player is None:
+            return ("max_players_already_joined", None)
+        return ("ok", game.export_json(player.id))
 
+    async def command_get_state(self, msg):
+        game = self.get_command_game(msg)
+        if game is None:
+            return ("game_not_found", None)
+        moves_from = msg.get("moves_from")
+        if moves_from is not None and (
+            not isinstance(moves_from, int) or
+            isinstance(moves_from, bool) or
+            moves_from < 0
+        ):
+            return ("bad_moves_from", None)
+        player = self.session.get_player_for_game(game.id)
+        return (
+            "ok",
+            await await_traced(
+                self.trace,
+                game.export_json_async(
+                    None if player is None else player.id,
+                    moves_from
+                )
+            )
+        )
 
-class MovesHandler(BaseWebHandler):
+    def command_spectate(self, msg):
+        game = self.get_command_game(msg)
+        if game is None:
+            return ("game_not_found", None)
+        if not game.add_spectator(self.session):
+            return ("cannot_spectate", None)
+        return ("ok", game.export_json(None))
 
-    def put(self, game_id, player_id, move_code):
-        game = GameModel.get_game_by_id(game_id)
+    def command_unspectate(self, msg):
+        game = self.get_command_game(msg)
         if game is None:
-            return self.response(None, 404, "game_not_found")
-        player = game.get_player(player_id)
+            return ("game_not_found", None)
+        game.remove_spectator(self.session)
+        return ("ok", None)
+
+    def command_matchmake(self, msg):
+        if not MatchmakerModel.enqueue(self.session):
+            return ("no_websocket", None)
+        return ("ok", None)
+
+    def command_unmatchmake(self, msg):
+        MatchmakerModel.dequeue(self.session)
+        return ("ok", None)
+
+    def command_place_ship(self, msg):
+        game = self.get_command_game(msg)
+        if game is None:
+            return ("game_not_found", None)
+        player = self.session.get_player_for_game(game.id)
         if player is None:
-            return self.response(None, 403, "player_id_not_specified")
-        session = self.get_session()
-        if session is None:
-            return self.response(None, 403, "no_session")
-        if not player.check_session(session.id):
-            return self.response(None, 403, "player_session_not_authorized")
+            return ("player_session_not_authorized", None)
+        ship_id = self.get_command_str(msg, "ship_id")
+        coords_code = self.get_command_str(msg, "coords")
+        if ship_id not in game.ships or coords_code is None:
+            return ("bad_ship_coords", None)
+        parsed = player.parse_ship_coords(coords_code)
+        TRACER.mark("parse")
+        if not parsed:
+            return ("bad_ship_coords", None)
+        coords, orientation = parsed
+        ship_status = player.add_ship(ship_id, coords, orientation)
+        if not ship_status:
+            return ("bad_ship_coords", None)
+        return ("ok", None)
+
+    def command_place_fleet(self, msg):
+        game = self.get_command_game(msg)
+        if game is None:
+            return ("game_not_found", None)
+        player = self.session.get_player_for_game(game.id)
+        if player is None:
+            return ("player_session_not_authorized", None)
+        fleet = player.parse_fleet(msg)
+        TRACER.mark("parse")
+        if fleet is None:
+            return ("bad_ship_coords", None)
+        fleet_status, fleet_data, fleet_msg = player.add_fleet(fleet)
+        if not fleet_status:
+            return (fleet_msg, None)
+        return ("ok", None)
+
+    async def command_move(self, msg):
+        game = self.get_command_game(msg)
+        if game is None:
+            return ("game_not_found", None)
+        player = self.session.get_player_for_game(game.id)
+        if player is None:
+            return ("player_session_not_authorized", None)
+        move_code = self.get_command_str(msg, "coords")
+        if move_code is None:
+            return ("bad_move", None)
         coords = player.parse_move(move_code)
+        TRACER.mark("parse")
         if coords is None:
-            return self.response(None, 404, "bad_move")
-        move_status, move_data, move_msg = game.make_move(player, coords)
+            return ("bad_move", None)
+        move_status, move_data, move_msg = await await_traced(
+            self.trace,
+            OFFLOAD.submit(
+                game.id,
+                None,
+                (),
+                lambda _: game.make_move(player, coords)
+            )
+        )
         if not move_status:
-            return self.response(None, 404, move_msg)
-        return self.response(move_data)
+            return (move_msg, None)
+        return ("ok", serializer.dumps(move_data))
 
+    def on_close(self):
+        if WS_PENDING.get(self.session_id) is self:
+            del WS_PENDING[self.session_id]
+        if self.outbound is not None:
+            self.outbound.clear()
+        if self.session is not None:
+            METRIC_WS_DISCONNECTS.inc()
+        if self.session is not None and self.session.websocket is self:
+            self.session.remove_websocket()
+        return None
 
-class ShipsHandler(BaseWebHandler):
 
-    def put(self, game_id, player_id, ship_id, coords_code):
-        game = GameModel.get_game_by_id(game_id)
-        if game is None:
+class StaticAssetsHandler(torn_web.StaticFileHandler):
+    """
+    Serves the in-memory STATIC_ASSETS, in the best encoding the
+    client accepts.  Files that are not loaded, or all of them when
+    STATIC_ASSETS is None, are served from disk.
+    """
+
+    def get(self, path, include_body=True):
+        if STATIC_ASSETS is None:
+            return super().get(path, include_body)
+        lookup = path
+        if lookup == "" or lookup.endswith("/"):
+            lookup += self.default_filename
+        asset, is_versioned = STATIC_ASSETS.get(lookup)
+        if asset is None:
+            return super().get(path, include_body)
+        encoding = assets.choose_encoding(
+            self.request.headers.get("Accept-Encoding"),
+            asset.variants
+        )
+        body = asset.variants[encoding]
+        self.set_header("Content-Type", asset.content_type)
+        self.set_header("Vary", "Accept-Encoding")
+        self.set_header("Etag", asset.etags[encoding])
+        self.set_header(
+            "Cache-Control",
+            (
+                assets.CACHE_IMMUTABLE
+                if is_versioned
+                else assets.CACHE_REVALIDATE
+            )
+        )
+        if encoding != assets.ENCODING_IDENTITY:
+            self.set_header("Content-Encoding", encoding)
+        if self.check_etag_header():
+            self.set_status(304)
+            return None
+        self.set_header("Content-Length", len(body))
+        if include_body:
+            self.write(body)
+        return None
+
+
+async def await_traced(trace, future):
+    """
+    Awaits `future` with `trace` suspended, so requests running in
+    the meantime do not mark phases against it
+    """
+    TRACER.suspend(trace)
+    try:
+        return await future
+    finally:
+        TRACER.resume(trace)
+
+
+def get_rate_session_id(session_id):
+    """
+    Session budgets are only kept for sessions known here, so made
+    up ids do not each get a bucket, and fall back to the IP budget
+    """
+    if session_id is None or session_id not in SESSIONS:
+        return None
+    return session_id
+
+
+def check_ws_connect_rate(handler):
+    admission = handler.settings.get("admission")
+    if admission is None:
+        return True
+    return admission.check_rate("ws_connect", handler.request.remote_ip) == 0
+
+
+def check_ws_command_rate(handler, session_id):
+    admission = handler.settings.get("admission")
+    if admission is None:
+        return True
+    return admission.check_rate(
+        "ws_command",
+        handler.request.remote_ip,
+        get_rate_session_id(session_id)
+    ) == 0
+
+
+class RouterWebHandler(BaseWebHandler):
+    """
+    Front for the sharded mode, which forwards each API request
+    to the shard owning it
+    """
+
+    ## Proxied requests interleave, so they cannot be traced
+    traced = False
+
+    def get_shard_url(self, shard_id, path):
+        return "http://%s:%d%s" % (
+            SHARD_HOST,
+            (SHARD_PORT_BASE + shard_id),
+            path
+        )
+
+    def fetch_shard(self, shard_id, path, method="GET", body=None):
+        headers = {}
+        for key in (SESSION_KEY, ADMIN_KEY):
+            if key in self.request.headers:
+                headers[key] = self.request.headers[key]
+        if method not in ("POST", "PUT"):
+            body = None
+        elif body is None:
+            body = b""
+        return torn_httpclient.AsyncHTTPClient().fetch(
+            self.get_shard_url(shard_id, path),
+            method=method,
+            headers=headers,
+            body=body,
+            raise_error=False
+        )
+
+    def response_shard(self, shard_resp):
+        if shard_resp.code >= 599:
+            return self.response(None, 502, "shard_unavailable")
+        self.set_status(shard_resp.code)
+        for key in ("Content-Type", SESSION_KEY, CURSOR_KEY):
+            if key in shard_resp.headers:
+                self.set_header(key, shard_resp.headers[key])
+        self.write(shard_resp.body)
+        return None
+
+    def get_data(self, shard_resp):
+        return serializer.loads(shard_resp.body)["data"]
+
+    async def proxy(self, shard_id):
+        if shard_id is None:
             return self.response(None, 404, "game_not_found")
-        player = game.get_player(player_id)
-        if player is None:
-            return self.response(None, 403, "player_id_not_specified")
-        session = self.get_session()
-        if session is None:
-            return self.response(None, 403, "no_session")
-        if not player.check_session(session.id):
-            return self.response(None, 403, "player_session_not_authorized")
-        coords, orientation = player.parse_ship_coords(coords_code)
-        if not coords:
-            return self.response(None, 404, "bad_ship_coords")
-        ship_status = player.add_ship(ship_id, coords, orientation)
-        if not ship_status:
-            return self.response(None, 404, "bad_ship_coords")
-        return self.response()
+        shard_resp = await self.fetch_shard(
+            shard_id,
+            self.request.uri,
+            self.request.method,
+            self.request.body
+        )
+        return self.response_shard(shard_resp)
 
 
-class BaseWsHandler(torn_ws.WebSocketHandler):
+class RouterLocalHandler(RouterWebHandler):
 
-    session = None
+    rate_class = "session"
+
+    async def get(self, *args):
+        return await self.proxy(SHARD_ID)
+
+    async def post(self, *args):
+        return await self.proxy(SHARD_ID)
+
+    async def put(self, *args):
+        return await self.proxy(SHARD_ID)
+
+    async def delete(self, *args):
+        return await self.proxy(SHARD_ID)
+
+
+class RouterGameHandler(RouterWebHandler):
+
+    rate_class = "play"
+
+    async def get(self, game_id, *args):
+        return await self.proxy(get_shard_by_obj_id(game_id))
+
+    async def post(self, game_id, *args):
+        return await self.proxy(get_shard_by_obj_id(game_id))
+
+    async def put(self, game_id, *args):
+        return await self.proxy(get_shard_by_obj_id(game_id))
+
+    async def delete(self, game_id, *args):
+        return await self.proxy(get_shard_by_obj_id(game_id))
+
+
+class RouterMatchmakingHandler(RouterWebHandler):
+    """
+    A single shard runs matchmaking, so all sessions share a queue
+    """
+
+    rate_class = "lobby"
+
+    async def post(self):
+        return await self.proxy(MATCHMAKING_SHARD)
+
+    async def delete(self):
+        return await self.proxy(MATCHMAKING_SHARD)
+
+
+class RouterFanoutHandler(RouterWebHandler):
+    """
+    Sends the request to all shards, and merges their `data`,
+    concatenating lists
+    """
+
+    rate_class = None
+
+    async def get(self, *args):
+        return await self.fanout()
+
+    async def post(self, *args):
+        return await self.fanout()
+
+    async def put(self, *args):
+        return await self.fanout()
+
+    async def delete(self, *args):
+        return await self.fanout()
+
+    async def fanout(self):
+        shard_resps = await torn_gen.multi(
+            list(
+                map(
+                    lambda i: self.fetch_shard(
+                        i,
+                        self.request.uri,
+                        self.request.method,
+                        self.request.body
+                    ),
+                    range(SHARD_COUNT)
+                )
+            )
+        )
+        failed = list(filter(lambda r: r.code != 200, shard_resps))
+        if len(failed) > 0:
+            return self.response_shard(failed[0])
+        out = []
+        for data in map(self.get_data, shard_resps):
+            if isinstance(data, list):
+                out.extend(data)
+            else:
+                out.append(data)
+        return self.response(out)
+
+
+class RouterMetricsHandler(RouterWebHandler):
+    """
+    Joins the metrics of all shards, with a `shard` label
+    """
+
+    rate_class = None
+
+    async def get(self):
+        shard_resps = await torn_gen.multi(
+            list(
+                map(
+                    lambda i: self.fetch_shard(i, "/api/metrics"),
+                    range(SHARD_COUNT)
+                )
+            )
+        )
+        failed = list(filter(lambda r: r.code != 200, shard_resps))
+        if len(failed) > 0:
+            return self.response_shard(failed[0])
+        self.set_header("Content-Type", metrics.CONTENT_TYPE)
+        self.write(
+            metrics.merge_rendered(
+                list(map(lambda r: r.body.decode("utf-8"), shard_resps)),
+                "shard"
+            )
+        )
+        return None
+
+
+class RouterGamesHandler(RouterWebHandler):
+    """
+    The lobby cursor is a dot separated list of per shard cursors,
+    where "-" marks a shard with no more pages.  Each page holds up
+    to `limit` games per shard.
+    """
+
+    rate_class = "lobby"
+
+    async def post(self):
+        return await self.proxy(
+            get_shard_by_session_id(self.request.headers.get(SESSION_KEY))
+        )
+
+    async def get(self):
+        cursor_code = self.get_query_argument("cursor", None)
+        limit = self.get_query_argument("limit", str(GAMES_PAGE_SIZE))
+        cursors = (
+            ["0"] * SHARD_COUNT
+            if cursor_code is None
+            else cursor_code.split(".")
+        )
+        if len(cursors) != SHARD_COUNT:
+            return self.response(None, 400, "bad_cursor")
+        shard_ids = list(
+            filter(lambda i: cursors[i] != "-", range(SHARD_COUNT))
+        )
+        shard_resps = await torn_gen.multi(
+            list(
+                map(
+                    lambda i: self.fetch_shard(
+                        i,
+                        "/api/games?cursor=%s&limit=%s" % (
+                            torn_escape.url_escape(cursors[i]),
+                            torn_escape.url_escape(limit)
+                        )
+                    ),
+                    shard_ids
+                )
+            )
+        )
+        failed = list(filter(lambda r: r.code != 200, shard_resps))
+        if len(failed) > 0:
+            return self.response_shard(failed[0])
+        out = []
+        next_cursors = ["-"] * SHARD_COUNT
+        for shard_id, shard_resp in zip(shard_ids, shard_resps):
+            out.extend(self.get_data(shard_resp))
+            next_cursors[shard_id] = shard_resp.headers.get(CURSOR_KEY, "-")
+        headers = (
+            [(CURSOR_KEY, ".".join(next_cursors))]
+            if len(list(filter(lambda c: c != "-", next_cursors))) > 0
+            else None
+        )
+        return self.response(out, headers=headers)
+
+
+class RouterWsHandler(torn_ws.WebSocketHandler):
+    """
+    Holds one upstream websocket per shard for the session, passes
+    every pushed frame through, and sends each command to the shard
+    owning its game
+    """
+
+    session_id = None
+    upstreams = None
+    pending = None
 
     def check_origin(self, origin):
         return True
 
+    def prepare(self):
+        if not check_ws_connect_rate(self):
+            raise torn_web.HTTPError(429)
+        return None
+
     def open(self, session_id):
-        print("WEBSOCKET_SESSION: %s" % session_id)
-        session = SessionModel.find_session(session_id)
-        if session is None:
-            self.close()
-            return None
-        self.session = session
-        self.session.set_websocket(self)
+        self.session_id = session_id
+        self.upstreams = None
+        self.pending = []
+        torn_ioloop.IOLoop.current().spawn_callback(
+            self.connect_upstreams,
+            session_id
+        )
         return None
 
-    def send_data(self, data):
-        self.write_message(json.dumps(data))
+    async def connect_upstreams(self, session_id):
+        try:
+            self.upstreams = await torn_gen.multi(
+                list(
+                    map(
+                        lambda i: torn_ws.websocket_connect(
+                            "ws://%s:%d/ws/%s" % (
+                                SHARD_HOST,
+                                (SHARD_PORT_BASE + i),
+                                session_id
+                            )
+                        ),
+                        range(SHARD_COUNT)
+                    )
+                )
+            )
+        except Exception:
+            self.close()
+            return False
+        for upstream in self.upstreams:
+            torn_ioloop.IOLoop.current().spawn_callback(
+                self.read_upstream,
+                upstream
+            )
+        pending = self.pending
+        self.pending = []
+        for shard_id, message in pending:
+            self.upstreams[shard_id].write_message(message)
+        return True
+
+    async def read_upstream(self, upstream):
+        while True:
+            message = await upstream.read_message()
+            if message is None:
+                break
+            ## Waits for the client to take each frame, so a slow
+            ## client backs up into the shard queue, which is bounded
+            try:
+                await self.write_message(message)
+            except (
+                torn_ws.WebSocketClosedError,
+                torn_iostream.StreamClosedError
+            ):
+                break
+        self.close()
+        return True
+
+    def reply_rate_limited(self, message):
+        try:
+            msg = serializer.loads(message)
+        except ValueError:
+            msg = None
+        self.write_message(serializer.dumps({
+            "action": "reply",
+            "id": msg.get("id") if isinstance(msg, dict) else None,
+            "code": "rate_limited",
+            "data": None
+        }))
         return True
 
+    def get_message_shard(self, message):
+        try:
+            msg = serializer.loads(message)
+        except ValueError:
+            return SHARD_ID
+        if not isinstance(msg, dict):
+            return SHARD_ID
+        game_id = msg.get("game_id")
+        if game_id is None and msg.get("command") == "join":
+            return get_shard_by_session_id(self.session_id)
+        if msg.get("command") in ("matchmake", "unmatchmake"):
+            return MATCHMAKING_SHARD
+        if not isinstance(game_id, str):
+            return SHARD_ID
+        shard_id = get_shard_by_obj_id(game_id)
+        return SHARD_ID if shard_id is None else shard_id
+
     def on_message(self, message):
-        self.write_message("MESSAGE: %s" % message)
+        if not check_ws_command_rate(self, self.session_id):
+            self.reply_rate_limited(message)
+            return None
+        shard_id = self.get_message_shard(message)
+        if self.upstreams is None:
+            self.pending.append((shard_id, message))
+            return None
+        self.upstreams[shard_id].write_message(message)
         return None
 
     def on_close(self):
+        if self.upstreams is None:
+            return None
+        for upstream in self.upstreams:
+            upstream.close()
         return None
 
 
-def make_app():
+def make_app(admission=None):
+    """
+    Requests are rate limited, and capped, with an `admission`
+    """
     return (
         torn_web.Application([
             ##
@@ -722,6 +3949,22 @@ def make_app():
             ##
             ## These are all API routes
             ##
+            (
+                r"/api/stats",
+                StatsHandler
+            ),
+            (
+                r"/api/metrics",
+                MetricsHandler
+            ),
+            (
+                r"/api/admin/profiler",
+                ProfilerHandler
+            ),
+            (
+                r"/api/admin/traces",
+                TracesHandler
+            ),
             (
                 r"/api/sessions",
                 SessionsHandler
@@ -730,10 +3973,18 @@ def make_app():
                 r"/api/sessions/([A-Za-z0-9-]{36})",
                 SessionHandler
             ),
+            (
+                r"/api/sessions/([A-Za-z0-9-]{36})/games",
+                SessionGamesHandler
+            ),
             (
                 r"/api/games",
                 GamesHandler
             ),
+            (
+                r"/api/matchmaking",
+                MatchmakingHandler
+            ),
             (
                 r"/api/games/([A-Za-z0-9-]{36})",
                 GameHandler
@@ -742,20 +3993,31 @@ def make_app():
                 r"/api/games/([A-Za-z0-9-]{36})/players",
                 PlayersHandler
             ),
+            (
+                r"/api/games/([A-Za-z0-9-]{36})/bots",
+                BotsHandler
+            ),
+            (
+                r"/api/games/([A-Za-z0-9-]{36})/spectators",
+                SpectatorsHandler
+            ),
             (
                 r"/api/games/([A-Za-z0-9-]{36})"
                 r"/players/([A-Za-z0-9-]{36})"
-                r"/ships/(%(SHIPS)s)"
-                r"/([0-9]{1,2}-[0-9]{1,2}-[xy])" %
-                {
-                    "SHIPS": r"|".join(SHIPS.keys())
-                },
+                r"/ships",
+                FleetHandler
+            ),
+            (
+                r"/api/games/([A-Za-z0-9-]{36})"
+                r"/players/([A-Za-z0-9-]{36})"
+                r"/ships/([a-z][a-z0-9_]{0,31})"
+                r"/([0-9]{1,3}-[0-9]{1,3}-[xy])",
                 ShipsHandler
             ),
             (
                 r"/api/games/([A-Za-z0-9-]{36})"
                 r"/players/([A-Za-z0-9-]{36})"
-                r"/moves/([0-9]{1,2}-[0-9]{1,2})",
+                r"/moves/([0-9]{1,3}-[0-9]{1,3})",
                 MovesHandler
             ),
             ##
@@ -763,19 +4025,190 @@ def make_app():
             ##
             (
                 r"/(.*)",
-                torn_web.StaticFileHandler,
+                StaticAssetsHandler,
+                {
+                    "default_filename": "index.html",
+                    "path": STATIC_ROOT
+                }
+            )
+        ], admission=admission)
+    )
+
+
+def make_router_app(admission=None):
+    return (
+        torn_web.Application([
+            (
+                r"/ws/([A-Za-z0-9-]{36})",
+                RouterWsHandler,
+            ),
+            (
+                r"/api/(stats|admin/[a-z]+"
+                r"|sessions/[A-Za-z0-9-]{36}/games)",
+                RouterFanoutHandler
+            ),
+            (
+                r"/api/metrics",
+                RouterMetricsHandler
+            ),
+            (
+                r"/api/sessions(/[A-Za-z0-9-]{36})?",
+                RouterLocalHandler
+            ),
+            (
+                r"/api/games",
+                RouterGamesHandler
+            ),
+            (
+                r"/api/matchmaking",
+                RouterMatchmakingHandler
+            ),
+            (
+                r"/api/games/([A-Za-z0-9-]{36})(/.*)?",
+                RouterGameHandler
+            ),
+            (
+                r"/(.*)",
+                StaticAssetsHandler,
                 {
                     "default_filename": "index.html",
                     "path": STATIC_ROOT
                 }
             )
-        ])
+        ], admission=admission)
     )
 
 
+def load_static_assets():
+    """
+    Loaded before forking, so shards share the pages
+    """
+    global STATIC_ASSETS
+    STATIC_ASSETS = assets.AssetStore.load(STATIC_ROOT)
+    print("STATIC_ASSETS: %s" % STATIC_ASSETS.export_stats())
+    return True
+
+
+def start_offload(executor, workers):
+    """
+    Pools do not survive a fork, so this runs in each shard process
+    """
+    OFFLOAD.executor = offload.make_executor(executor, workers)
+    print("OFFLOAD_EXECUTOR: %s (%d)" % (executor, workers))
+    return True
+
+
+def main_sharded(
+    port,
+    workers,
+    data_dir,
+    snapshot_interval,
+    executor,
+    executor_workers
+):
+    """
+    Forks one process per shard.  Each serves its own shard on a
+    private port, and also runs the router on the shared public port.
+    """
+    global SHARD_ID, SHARD_COUNT, SHARD_PORT_BASE
+    sockets = torn_netutil.bind_sockets(port)
+    SHARD_COUNT = workers
+    SHARD_PORT_BASE = port + 1
+    SHARD_ID = torn_process.fork_processes(workers)
+    torn_httpclient.AsyncHTTPClient.configure(None, max_clients=1000)
+    start_offload(executor, executor_workers)
+    if data_dir is not None:
+        PersistModel.start(
+            os.path.join(data_dir, "shard-%d" % SHARD_ID),
+            snapshot_interval
+        )
+    SweeperModel.start()
+    LOOP_MONITOR.start()
+    ## Only the public router is limited, shards only see the router
+    make_app().listen((SHARD_PORT_BASE + SHARD_ID), address=SHARD_HOST)
+    router = torn_httpserver.HTTPServer(make_router_app(ADMISSION))
+    router.add_sockets(sockets)
+    print("STARTING_APP_SHARD: %d" % SHARD_ID)
+    torn_ioloop.IOLoop.current().start()
+    return True
+
+
 def main():
-    app = make_app()
-    app.listen(8888)
+    global ADMISSION
+    parser = argparse.ArgumentParser(description="BattleShip Server")
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of shard processes"
+    )
+    parser.add_argument(
+        "--data-dir",
+        default=None,
+        help="Directory for the event log and snapshots"
+    )
+    parser.add_argument(
+        "--snapshot-interval",
+        type=float,
+        default=300,
+        help="Seconds between snapshots"
+    )
+    parser.add_argument(
+        "--static-mode",
+        choices=("memory", "disk"),
+        default="memory",
+        help="Serve client files precompressed from memory, or from disk"
+    )
+    parser.add_argument(
+        "--no-rate-limit",
+        action="store_true",
+        help="Disable per session and per IP rate limits"
+    )
+    parser.add_argument(
+        "--executor",
+        choices=offload.EXECUTORS,
+        default=offload.EXECUTOR_THREAD,
+        help="Pool for bot moves and large board exports"
+    )
+    parser.add_argument(
+        "--executor-workers",
+        type=int,
+        default=2,
+        help="Number of executor threads or processes"
+    )
+    parser.add_argument(
+        "--slow-request-ms",
+        type=float,
+        default=(SLOW_REQUEST_THRESHOLD * 1000),
+        help="Keep phase traces of requests slower than this"
+    )
+    args = parser.parse_args()
+    TRACER.threshold = args.slow_request_ms / 1000
+    if not args.no_rate_limit:
+        ADMISSION = ratelimit.AdmissionModel(
+            RATE_LIMITS,
+            REQUESTS_INFLIGHT_MAX,
+            lambda *labels: METRIC_ADMISSION_REJECTED.inc(labels)
+        )
+    if args.static_mode == "memory":
+        load_static_assets()
+    if args.workers > 1:
+        return main_sharded(
+            args.port,
+            args.workers,
+            args.data_dir,
+            args.snapshot_interval,
+            args.executor,
+            args.executor_workers
+        )
+    start_offload(args.executor, args.executor_workers)
+    if args.data_dir is not None:
+        PersistModel.start(args.data_dir, args.snapshot_interval)
+    SweeperModel.start()
+    LOOP_MONITOR.start()
+    app = make_app(ADMISSION)
+    app.listen(args.port)
     print("STARTING_APP")
     torn_ioloop.IOLoop.current().start()
     return True
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+"""
+BattleShip JSON Serialization
+
+Encodes API responses and websocket frames.  Uses orjson when it
+is installed, and falls back to the stdlib json module otherwise.
+The backend can be forced with the BS_JSON_BACKEND env var.
+
+"""
+
+import os
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+BACKEND_STDLIB = "stdlib"
+BACKEND_ORJSON = "orjson"
+BACKEND = None
+
+
+def default_stdlib(obj):
+    if np is not None:
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        if isinstance(obj, np.generic):
+            return obj.item()
+    raise TypeError("Object of type %s is not JSON serializable" % type(obj))
+
+
+def dumps_stdlib(obj):
+    return json.dumps(obj, default=default_stdlib)
+
+
+def dumps_orjson(obj):
+    return orjson.dumps(
+        obj,
+        option=(orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    ).decode("utf-8")
+
+
+DUMPERS = {
+    BACKEND_STDLIB: dumps_stdlib,
+    BACKEND_ORJSON: dumps_orjson
+}
+
+
+def get_available_backends():
+    if orjson is None:
+        return [BACKEND_STDLIB]
+    return [BACKEND_STDLIB, BACKEND_ORJSON]
+
+
+def get_backend():
+    return BACKEND
+
+
+def set_backend(name=None):
+    """
+    Selects the encoder, or the fastest available one
+    when `name` is None
+    """
+    global BACKEND
+    avail = get_available_backends()
+    if name is None:
+        name = avail[-1]
+    if name not in avail:
+        return False
+    BACKEND = name
+    return True
+
+
+def dumps(obj, fragments=None):
+    """
+    Encodes `obj` to a str.  `fragments` is an optional list of
+    (key, json_str) tuples of pre-encoded values, which are
+    appended to the top level object as is.
+    """
+    out = DUMPERS[BACKEND](obj)
+    if not fragments:
+        return out
+    extra = ", ".join(
+        map(lambda f: "%s: %s" % (json.dumps(f[0]), f[1]), fragments)
+    )
+    if out == "{}":
+        return "{%s}" % extra
+    return "%s, %s}" % (out[:-1], extra)
+
+
+def loads(data):
+    if BACKEND == BACKEND_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+if not set_backend(os.environ.get("BS_JSON_BACKEND")):
+    set_backend()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+
+"""
+BattleShip Batched Game Simulator
+
+Plays many complete games at once, headless, to compare targeting
+strategies.  A batch of games is held as stacked NumPy arrays of
+shape (batch, GRID_SIZE, GRID_SIZE), and every step fires one shot
+in every unfinished game of the batch.
+
+Rules follow the server models: ships are placed like
+`PlayerModel.get_ship_arr` (a ship must end before the last row or
+column), and shots count like `PlayerModel.register_hit`.
+
+Batches are spread over a process pool, and the output is the
+distribution of shots needed to sink a whole fleet.
+
+Usage: simulator.py --games 1000000 --strategy random --strategy density
+
+"""
+
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+
+import numpy as np
+
+import bot
+import runserver
+
+
+def get_placement_table(size, length):
+    """
+    All legal placements of a ship of `length`, as a
+    (num_placements, size, size) bool array
+    """
+    span = size - 1
+    placements = []
+    for y in range(size):
+        for x in range(span - length + 1):
+            grid = np.zeros((size, size), dtype=bool)
+            grid[y, x:(x + length)] = True
+            placements.append(grid)
+            placements.append(grid.T.copy())
+    return np.array(placements, dtype=bool).reshape(-1, size, size)
+
+
+def place_fleets(rng, batch, size, lengths):
+    """
+    Samples a random legal fleet for each game.  Returns the
+    (batch, size, size) array of ship numbers, 0 for empty cells
+    and `n + 1` for the ship at `lengths[n]`.
+    """
+    ships = np.zeros((batch, size, size), dtype=np.int8)
+    tables = {}
+    for num, length in enumerate(lengths):
+        if length not in tables:
+            tables[length] = get_placement_table(size, length)
+        table = tables[length]
+        pending = np.arange(batch)
+        ## Resample only the games where the ship overlapped another
+        while len(pending) > 0:
+            picks = table[rng.randint(0, len(table), len(pending))]
+            overlap = (picks & (ships[pending] > 0)).any(axis=(1, 2))
+            placed = pending[~overlap]
+            ships[placed] += picks[~overlap].astype(np.int8) * (num + 1)
+            pending = pending[overlap]
+    return ships
+
+
+class BatchModel(object):
+    """
+    State of a batch of games, seen from the shooting side
+    """
+
+    size = None
+    lengths = None
+    ships = None
+    hits = None
+    misses = None
+    ship_hits = None
+    shots = None
+    done = None
+
+    def __init__(self, ships, lengths):
+        batch, size = ships.shape[:2]
+        self.size = size
+        self.lengths = np.array(lengths, dtype=np.int32)
+        self.ships = ships
+        self.hits = np.zeros((batch, size, size), dtype=bool)
+        self.misses = np.zeros((batch, size, size), dtype=bool)
+        self.ship_hits = np.zeros((batch, (len(lengths) + 1)), dtype=np.int32)
+        self.shots = np.zeros(batch, dtype=np.int32)
+        self.done = np.zeros(batch, dtype=bool)
+        return None
+
+    def get_sunk(self):
+        """
+        (batch, num_ships) bool array of sunk ships
+        """
+        return self.ship_hits[:, 1:] >= self.lengths
+
+    def get_sunk_cells(self):
+        sunk = np.concatenate(
+            (np.zeros((len(self.ships), 1), dtype=bool), self.get_sunk()),
+            axis=1
+        )
+        return sunk[
+            np.arange(len(self.ships))[:, None, None],
+            self.ships
+        ]
+
+    def fire(self, games, cells):
+        """
+        Fires at flat cell index `cells[n]` in game `games[n]`
+        """
+        ys, xs = np.divmod(cells, self.size)
+        ship_nums = self.ships[games, ys, xs]
+        is_hit = ship_nums > 0
+        is_repeat = self.hits[games, ys, xs] | self.misses[games, ys, xs]
+        self.hits[games, ys, xs] |= is_hit
+        self.misses[games, ys, xs] |= ~is_hit
+        counted = is_hit & ~is_repeat
+        np.add.at(self.ship_hits, (games[counted], ship_nums[counted]), 1)
+        self.shots[games] += 1
+        self.done[games] = self.get_sunk()[games].all(axis=1)
+        return True
+
+
+def noise(rng, shape):
+    return rng.random_sample(shape) * 0.5
+
+
+def strategy_random(rng, state, games):
+    scores = noise(rng, (len(games), state.size, state.size))
+    scores[state.hits[games] | state.misses[games]] = -1
+    return scores
+
+
+def strategy_hunt_target(rng, state, games):
+    """
+    Random shots, but neighbours of hits on ships that are not
+    sunk yet are fired at first
+    """
+    scores = strategy_random(rng, state, games)
+    open_hits = state.hits[games] & ~state.get_sunk_cells()[games]
+    near = np.zeros(open_hits.shape, dtype=bool)
+    near[:, 1:, :] |= open_hits[:, :-1, :]
+    near[:, :-1, :] |= open_hits[:, 1:, :]
+    near[:, :, 1:] |= open_hits[:, :, :-1]
+    near[:, :, :-1] |= open_hits[:, :, 1:]
+    scores += near * (scores >= 0)
+    return scores
+
+
+def strategy_density(rng, state, games):
+    """
+    The `bot.choose_target` strategy, for the whole batch
+    """
+    sunk_cells = state.get_sunk_cells()[games]
+    hits = state.hits[games]
+    attempted = hits | state.misses[games]
+    blocked = (state.misses[games] | sunk_cells).astype(np.int32)
+    open_hits = (hits & ~sunk_cells).astype(np.int32)
+    alive = ~state.get_sunk()[games]
+    scores = np.zeros(blocked.shape, dtype=np.float64)
+    for length in np.unique(state.lengths):
+        num_alive = alive[:, (state.lengths == length)].sum(axis=1)
+        if not num_alive.any():
+            continue
+        density = bot.get_length_density(blocked, open_hits, length)
+        scores += density * num_alive[:, None, None]
+    scores[attempted] = -1
+    scores += noise(rng, scores.shape)
+    return scores
+
+
+STRATEGIES = {
+    "random": strategy_random,
+    "hunt_target": strategy_hunt_target,
+    "density": strategy_density
+}
+
+
+def run_batch(args):
+    """
+    Plays `batch` games with one strategy, and returns the
+    bincount of shots per game
+    """
+    strategy, batch, size, lengths, seed = args
+    rng = np.random.RandomState(seed)
+    state = BatchModel(place_fleets(rng, batch, size, lengths), lengths)
+    choose = STRATEGIES[strategy]
+    while not state.done.all():
+        games = np.flatnonzero(~state.done)
+        scores = choose(rng, state, games)
+        cells = scores.reshape(len(games), -1).argmax(axis=1)
+        state.fire(games, cells)
+    return np.bincount(state.shots, minlength=((size * size) + 1))
+
+
+def summarize(counts):
+    shots = np.arange(len(counts))
+    total = int(counts.sum())
+    mean = float((shots * counts).sum()) / total
+    cumulative = np.cumsum(counts)
+    return {
+        "games": total,
+        "mean": mean,
+        "std": float(
+            np.sqrt(((shots - mean) ** 2 * counts).sum() / total)
+        ),
+        "min": int(shots[counts > 0][0]),
+        "max": int(shots[counts > 0][-1]),
+        "p50": int(np.searchsorted(cumulative, (total * 0.50))),
+        "p95": int(np.searchsorted(cumulative, (total * 0.95))),
+        "p99": int(np.searchsorted(cumulative, (total * 0.99))),
+        "histogram": dict(
+            map(
+                lambda s: (int(s), int(counts[s])),
+                np.flatnonzero(counts)
+            )
+        )
+    }
+
+
+def simulate(strategy, num_games, batch, workers, size, lengths, seed=None):
+    num_batches = max(1, -(-num_games // batch))
+    seeds = np.random.RandomState(seed).randint(0, (2 ** 31), num_batches)
+    jobs = list(
+        map(
+            lambda n: (
+                strategy,
+                min(batch, (num_games - (n * batch))),
+                size,
+                lengths,
+                int(seeds[n])
+            ),
+            range(num_batches)
+        )
+    )
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.map(run_batch, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = list(map(run_batch, jobs))
+    return summarize(np.sum(results, axis=0))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="BattleShip Batched Game Simulator"
+    )
+    parser.add_argument("--games", type=int, default=100000)
+    parser.add_argument("--batch", type=int, default=2000)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=multiprocessing.cpu_count()
+    )
+    parser.add_argument(
+        "--strategy",
+        action="append",
+        choices=sorted(STRATEGIES.keys()),
+        default=None
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+    strategies = args.strategy
+    if strategies is None:
+        strategies = sorted(STRATEGIES.keys())
+    lengths = list(map(lambda s: s["length"], runserver.SHIPS.values()))
+    out = {}
+    for strategy in strategies:
+        start = time.monotonic()
+        out[strategy] = simulate(
+            strategy,
+            args.games,
+            args.batch,
+            args.workers,
+            runserver.GRID_SIZE,
+            lengths,
+            args.seed
+        )
+        elapsed = time.monotonic() - start
+        out[strategy]["elapsed_s"] = elapsed
+        print(
+            "%-12s games %9d  mean %6.2f  std %5.2f  "
+            "p50 %3d  p95 %3d  p99 %3d  %9.0f games/s" %
+            (
+                strategy,
+                out[strategy]["games"],
+                out[strategy]["mean"],
+                out[strategy]["std"],
+                out[strategy]["p50"],
+                out[strategy]["p95"],
+                out[strategy]["p99"],
+                (out[strategy]["games"] / elapsed)
+            )
+        )
+    if args.output is not None:
+        with open(args.output, "w") as fh:
+            json.dump(out, fh, indent=2, sort_keys=True)
+        print("SAVED: %s" % args.output)
+    return True
+
+
+if __name__ == "__main__":
+    main()
+    sys.exit(0)
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+
+"""
+BattleShip Server Tests
+
+Run from this directory with `python -m unittest`.
+
+"""
+
+import time
+import uuid
+import unittest
+
+from tornado import gen as torn_gen
+from tornado import testing as torn_testing
+from tornado import websocket as torn_ws
+
+import offload
+import runserver
+
+
+class SweeperTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ttls = (runserver.GAME_OPEN_TTL, runserver.GAME_IDLE_TTL)
+        return None
+
+    def tearDown(self):
+        runserver.GAME_OPEN_TTL, runserver.GAME_IDLE_TTL = self.ttls
+        for game in list(runserver.GAMES.values()):
+            runserver.GameModel.remove_game(game)
+        return None
+
+    def make_game(self, players):
+        game = runserver.GameModel.create_game_from_id()
+        for _ in range(players):
+            game.add_player(runserver.SessionModel.make_session())
+        return game
+
+    def test_idle_sweep_keeps_open_games(self):
+        runserver.GAME_OPEN_TTL = 1e6
+        runserver.GAME_IDLE_TTL = 0
+        game = self.make_game(1)
+        time.sleep(0.001)
+        runserver.SweeperModel.sweep()
+        self.assertIn(game.id, runserver.GAMES)
+        self.assertIn(game.seq, runserver.GAMES_OPEN)
+        return None
+
+    def test_idle_sweep_expires_started_games(self):
+        runserver.GAME_OPEN_TTL = 1e6
+        runserver.GAME_IDLE_TTL = 1e6
+        stale = self.make_game(2)
+        live = self.make_game(2)
+        ## Made first, so first in GAMES_STARTED
+        stale.updated_at -= 2e6
+        runserver.SweeperModel.sweep()
+        self.assertNotIn(stale.id, runserver.GAMES)
+        self.assertIn(live.id, runserver.GAMES)
+        return None
+
+    def test_finished_sweep_orders_by_finish(self):
+        first = self.make_game(2)
+        second = self.make_game(2)
+        first.register_winner(list(first.players.values())[0])
+        second.register_winner(list(second.players.values())[0])
+        first.finished_at -= 2e6
+        second.finished_at -= 2e6
+        ## A rejoin after the finish must not hide older games
+        first.add_player(list(first.players.values())[0].session)
+        runserver.SweeperModel.sweep()
+        self.assertNotIn(first.id, runserver.GAMES)
+        self.assertNotIn(second.id, runserver.GAMES)
+        return None
+
+
+class SpectatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.spectators_max = runserver.SPECTATORS_MAX
+        runserver.SPECTATORS_MAX = 2
+        self.game = runserver.GameModel.create_game_from_id()
+        return None
+
+    def tearDown(self):
+        runserver.SPECTATORS_MAX = self.spectators_max
+        runserver.GameModel.remove_game(self.game)
+        return None
+
+    def test_closed_websocket_stops_watching(self):
+        session = runserver.SessionModel.make_session()
+        session.websocket = object()
+        self.assertTrue(self.game.add_spectator(session))
+        session.remove_websocket()
+        self.assertNotIn(session.id, self.game.spectators)
+        self.assertEqual(session.spectating, {})
+        return None
+
+    def test_detached_spectators_do_not_fill_game(self):
+        for _ in range(runserver.SPECTATORS_MAX):
+            self.game.add_spectator(runserver.SessionModel.make_session())
+        session = runserver.SessionModel.make_session()
+        session.websocket = object()
+        self.assertTrue(self.game.add_spectator(session))
+        self.assertEqual(list(self.game.spectators), [session.id])
+        return None
+
+
+def slow_identity(value):
+    time.sleep(0.05)
+    return value
+
+
+class OffloadTest(torn_testing.AsyncTestCase):
+
+    @torn_testing.gen_test
+    def test_prepare_runs_after_earlier_jobs(self):
+        executor = offload.OrderedExecutor(
+            offload.make_executor(offload.EXECUTOR_THREAD, 2)
+        )
+        state = []
+        first = executor.submit("g", slow_identity, (1,), state.append)
+        second = executor.submit(
+            "g",
+            len,
+            None,
+            lambda count: count,
+            lambda: (list(state),)
+        )
+        yield first
+        count = yield second
+        self.assertEqual(count, 1)
+        self.assertEqual(executor.get_pending(), 0)
+        executor.executor.shutdown()
+        return None
+
+    @torn_testing.gen_test
+    def test_large_export_sees_pending_moves(self):
+        runserver.OFFLOAD.executor = offload.make_executor(
+            offload.EXECUTOR_THREAD,
+            2
+        )
+        game = runserver.GameModel.create_game_from_id(
+            None,
+            runserver.OFFLOAD_EXPORT_SIZE_MIN
+        )
+        try:
+            runserver.OFFLOAD.submit(
+                game.id,
+                slow_identity,
+                (None,),
+                lambda _: game.bump_version()
+            )
+            version = game.version
+            exported = yield game.export_json_async()
+            self.assertEqual(
+                runserver.serializer.loads(exported)["version"],
+                version + 1
+            )
+        finally:
+            runserver.OFFLOAD.executor.shutdown()
+            runserver.OFFLOAD.executor = None
+            runserver.GameModel.remove_game(game)
+        return None
+
+
+class AdminTest(torn_testing.AsyncHTTPTestCase):
+
+    def setUp(self):
+        self.admin_token = runserver.ADMIN_TOKEN
+        runserver.ADMIN_TOKEN = "test-token"
+        return super().setUp()
+
+    def tearDown(self):
+        runserver.ADMIN_TOKEN = self.admin_token
+        return super().tearDown()
+
+    def get_app(self):
+        return runserver.make_app()
+
+    def fetch_admin(self, path, method):
+        return self.fetch(
+            path,
+            method=method,
+            body=(b"" if method in ("POST", "PUT") else None),
+            headers={runserver.ADMIN_KEY: "test-token"}
+        )
+
+    def test_rejects_bad_profiler_interval(self):
+        for val in ("nan", "inf", "-1", "0"):
+            resp = self.fetch_admin(
+                "/api/admin/profiler?interval_ms=%s" % val,
+                "POST"
+            )
+            self.assertEqual(resp.code, 400, val)
+        self.assertFalse(runserver.PROFILER.is_running())
+        return None
+
+    def test_rejects_bad_trace_threshold(self):
+        threshold = runserver.TRACER.threshold
+        for val in ("nan", "inf", "-5", "0"):
+            resp = self.fetch_admin(
+                "/api/admin/traces?threshold_ms=%s" % val,
+                "PUT"
+            )
+            self.assertEqual(resp.code, 400, val)
+        self.assertEqual(runserver.TRACER.threshold, threshold)
+        return None
+
+
+class ShardSessionTest(torn_testing.AsyncHTTPTestCase):
+
+    def setUp(self):
+        self.shard = (runserver.SHARD_ID, runserver.SHARD_COUNT)
+        runserver.SHARD_ID, runserver.SHARD_COUNT = 0, 2
+        return super().setUp()
+
+    def tearDown(self):
+        runserver.SHARD_ID, runserver.SHARD_COUNT = self.shard
+        for game in list(runserver.GAMES.values()):
+            runserver.GameModel.remove_game(game)
+        for session in list(runserver.SESSIONS.values()):
+            runserver.SessionModel.destroy(session)
+        return super().tearDown()
+
+    def get_app(self):
+        return runserver.make_app()
+
+    def test_reads_do_not_adopt(self):
+        session_id = str(uuid.uuid4())
+        self.assertIsNone(runserver.SessionModel.find_session(session_id))
+        resp = self.fetch(
+            "/api/games",
+            headers={runserver.SESSION_KEY: session_id}
+        )
+        self.assertEqual(resp.code, 200)
+        self.assertNotIn(session_id, runserver.SESSIONS)
+        resp = self.fetch(
+            "/api/games",
+            method="POST",
+            body=b"",
+            headers={runserver.SESSION_KEY: session_id}
+        )
+        self.assertEqual(resp.code, 200)
+        self.assertIn(session_id, runserver.SESSIONS)
+        return None
+
+    @torn_testing.gen_test
+    def test_websocket_waits_for_adoption(self):
+        session_id = str(uuid.uuid4())
+        conn = yield torn_ws.websocket_connect(
+            "ws://127.0.0.1:%d/ws/%s" % (self.get_http_port(), session_id)
+        )
+        yield torn_gen.sleep(0.01)
+        self.assertNotIn(session_id, runserver.SESSIONS)
+        self.assertIn(session_id, runserver.WS_PENDING)
+        session = runserver.SessionModel.find_session(session_id, True)
+        self.assertIsNotNone(session.websocket)
+        self.assertNotIn(session_id, runserver.WS_PENDING)
+        conn.close()
+        return None
+
+    def test_shard_from_session_id(self):
+        session_ids = list(map(lambda _: str(uuid.uuid4()), range(100)))
+        shards = list(map(runserver.get_shard_by_session_id, session_ids))
+        self.assertEqual(
+            shards,
+            list(map(runserver.get_shard_by_session_id, session_ids))
+        )
+        self.assertEqual(set(shards), {0, 1})
+        return None
+
+
+if __name__ == "__main__":
+    unittest.main()